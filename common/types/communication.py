@@ -17,7 +17,8 @@ class LaunchGoalParam(BaseModel):
     team_up_depth: The current depth of nested-teamup. Need not be manually specified.
     is_collaborative_planning_enabled: Whether to enable collaborative planning.
     comm_id: The communication ID. If specified, will continue the previous conversation.
-    cont_info: Useful only when `comm_id` is specified. The info to continue the previous conversation."""
+    cont_info: Useful only when `comm_id` is specified. The info to continue the previous conversation.
+    timeout: The seconds to wait for the conclusion. If exceeded, the session keeps running and the request returns."""
 
     goal: str
     team_member_names: list[str] | None = None
@@ -28,6 +29,7 @@ class LaunchGoalParam(BaseModel):
     obs_kwargs: dict[str, Any] = {}
     max_turns: int | None = None
     skip_naming: bool = True
+    timeout: float | None = None
 
     @root_validator(pre=True)
     def handle(cls, values):
@@ -43,6 +45,13 @@ class LaunchGoalParam(BaseModel):
         return values
 
 
+class CancelGoalParam(BaseModel):
+    """The parameters for cancelling a launched goal.
+    comm_id: The communication ID of the goal."""
+
+    comm_id: str
+
+
 class CommunicationProtocol(Enum):
     DISCUSSION = 0
     VOTE = 1
@@ -93,6 +102,7 @@ class CommunicationInfo(BaseModel):
     is_collaborative_planning_enabled: bool = False
     max_turns: int | None = None
     curr_turn: int = 0
+    header_version: int | None = None
 
 
 class AgentMessage(BaseModel):
@@ -108,6 +118,8 @@ class AgentMessage(BaseModel):
     goal: str | None = None
     team_members: list[dict] | None = None
     team_up_depth: int | None = None
+    # The version of the session header stored by the server, which replaces goal and team_members
+    header_version: int | None = None
     # properties for task manager
     task_id: str = ""
     task_desc: str = ""
@@ -125,3 +137,7 @@ class AgentMessage(BaseModel):
 
     def to_llm_result(self):
         return LLMResult(content=self.content, role="assistant", name=self.sender)
+
+
+# The serialized defaults of the fields of AgentMessage, which the binary wire format does not send
+AGENT_MESSAGE_DEFAULTS = AgentMessage().model_dump(mode="json")
@@ -1,21 +1,54 @@
 from __future__ import annotations
+
+from typing import Any, Literal
+
 from pydantic import BaseModel
 
 
 class AgentRegistryRetrivalParam(BaseModel):
+    """The parameters for retrieving agents.
+    sender: The name of the agent sending the request.
+    capabilities: The queries, which are embedded and searched in one batch.
+    exclude: The names of the agents to exclude from the results, e.g. the sender and its known contacts.
+    fusion: How the hits of the queries are merged, with reciprocal rank fusion or the best score of each agent.
+    top_k: The maximum number of agents returned. Defaults to the search limit times the number of queries."""
+
     sender: str
     capabilities: list[str]
+    exclude: list[str] = []
+    fusion: Literal["rrf", "max_score"] = "rrf"
+    top_k: int | None = None
 
 
 class AgentRegistryTeamupParam(BaseModel):
+    """The parameters for teaming up.
+    goal, team_members: The header of the session, stored by the server and fetched by the members
+    instead of being sent with every message."""
+
     sender: str
     agent_names: list[str]
     team_name: str | None = None
+    goal: str | None = None
+    team_members: list[dict] | None = None
 
 
 class AgentRegistryTeamupOutput(BaseModel):
     comm_id: str
     agent_names: list[str]
+    header_version: int | None = None
+
+
+class SessionHeader(BaseModel):
+    """The static information of a session, referenced by the messages through its version."""
+
+    comm_id: str
+    version: int
+    goal: str | None = None
+    team_members: list[dict] = []
+
+
+class SessionHeaderFetchParam(BaseModel):
+    comm_id: str
 
 
 class AgentRegistryQueryParam(BaseModel):
@@ -24,3 +57,29 @@ class AgentRegistryQueryParam(BaseModel):
 
 class ChatRecordFetchParam(BaseModel):
     comm_id: str | list[str] | None = None
+    since_seq: int = 0
+    limit: int | None = None
+
+
+# Every RPC frame on the agent WebSocket starts with this, which tells it apart from the agent messages.
+RPC_FRAME_PREFIX = '{"rpc":'
+
+
+class RPCRequest(BaseModel):
+    """A request sent to the server over the agent WebSocket.
+    rpc: The name of the method, the same as the path of the HTTP endpoint, e.g. "teamup".
+    id: The correlation id, echoed back in the response.
+    params: The parameters of the method, the same as the body of the HTTP request."""
+
+    rpc: str
+    id: str
+    params: dict = {}
+
+
+class RPCResponse(BaseModel):
+    """The response to an RPCRequest, with either the result or the error of the method."""
+
+    rpc: str
+    id: str
+    result: Any = None
+    error: str | None = None
@@ -1,10 +1,17 @@
 from __future__ import annotations
 from sqlitedict import SqliteDict, decode, encode, identity
+import asyncio
 import os
+import sqlite3
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Union, Type
+from contextlib import contextmanager
+from typing import Iterator, Literal, Union, Type
 from pydantic import BaseModel
 
+from common.log import logger
+
 
 class Serializable(ABC):
     @abstractmethod
@@ -198,3 +205,201 @@ class AutoStoredSet:
     def replace(self, other):
         self.data = set(other)
         self.save_db()
+
+
+class CachedStoredDict:
+    """
+    An in-process object cache in front of an AutoStoredDict.
+
+    Reading an item from an AutoStoredDict unpickles the row and revalidates the whole object,
+    and writing it back serializes the whole object again. CachedStoredDict keeps the live objects
+    in memory instead: reads return the cached instance and writes only mark the key as dirty.
+    Dirty entries are written back to the underlying store on `flush`, which is called at the
+    checkpoints defined by the caller, in the background every `flush_interval` seconds, or
+    immediately when the write policy is `write_through`.
+
+    Args:
+        store (AutoStoredDict): The persistent store behind the cache.
+        write_policy (Literal["write_back", "write_through"], optional): `write_through` persists every
+            assignment immediately, which keeps the store crash-consistent but still skips the read path.
+            `write_back` defers the write to the next flush. Defaults to "write_back".
+        flush_interval (float | None, optional): Interval in seconds of the background flush.
+            None or 0 disables the background flush, leaving only explicit checkpoints. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        store: AutoStoredDict,
+        write_policy: Literal["write_back", "write_through"] = "write_back",
+        flush_interval: float | None = None,
+    ):
+        if write_policy not in ["write_back", "write_through"]:
+            raise ValueError(f"Unknown write policy: {write_policy}")
+        self.store = store
+        self.write_policy = write_policy
+        self.flush_interval = flush_interval
+        self._cache = {}
+        self._dirty = set()
+        self._flush_task: asyncio.Task | None = None
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            self._cache[key] = self.store[key]
+        return self._cache[key]
+
+    def __setitem__(self, key, value):
+        self._cache[key] = value
+        self.mark_dirty(key)
+
+    def __contains__(self, key):
+        return key in self._cache or key in self.store
+
+    def __delitem__(self, key):
+        self._cache.pop(key, None)
+        self._dirty.discard(key)
+        if key in self.store:
+            del self.store[key]
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return list(dict.fromkeys([*self._cache.keys(), *self.store.keys()]))
+
+    def mark_dirty(self, key):
+        """Mark a cached object as modified in place, so that it will be written at the next flush."""
+        if self.write_policy == "write_through":
+            self.store[key] = self._cache[key]
+        else:
+            self._dirty.add(key)
+
+    def flush(self, keys: list | None = None):
+        """Write the dirty entries (or the dirty entries among `keys`) back to the store."""
+        if keys is None:
+            keys = list(self._dirty)
+        for key in keys:
+            if key in self._dirty:
+                self._dirty.discard(key)
+                self.store[key] = self._cache[key]
+
+    def evict(self, key):
+        """Flush and drop a single entry from the cache."""
+        self.flush([key])
+        self._cache.pop(key, None)
+
+    def start(self):
+        """Start the background flush. Must be called within a running event loop."""
+        if self.flush_interval and self._flush_task is None:
+            self._flush_task = asyncio.get_event_loop().create_task(self._flush_periodically())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self.flush()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush the cache of table {self.store.tablename}. {e}")
+
+
+class AppendOnlyLog:
+    """
+    An append-only log stored in a SQLite table, with one row per entry keyed by (key, seq).
+
+    Unlike an AutoStoredDict holding a whole list, appending an entry costs a single row insert
+    regardless of how many entries the key already has. Sequence numbers start at 1 and are
+    assigned by the database, so several processes may append to the same file. Within a process,
+    the log may be used from several threads (e.g. with asyncio.to_thread), which take turns on its connection.
+
+    Args:
+        filename (str): The path to the SQLite database file.
+        tablename (str): The name of the table within the database to store the entries.
+        timeout (float, optional): Seconds to wait for the write lock held by another process. Defaults to 5.
+        max_attempts (int, optional): The attempts of an append failing on a locked database. Defaults to 3.
+    """
+
+    def __init__(self, filename: str, tablename: str, timeout: float = 5, max_attempts: int = 3):
+        os.makedirs(os.path.dirname(filename.rstrip("/")), exist_ok=True)
+        self.filename = filename
+        self.tablename = tablename
+        self.max_attempts = max_attempts
+        # Held by the thread running a transaction on the shared connection, so that the others do not join it.
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(filename, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            f'CREATE TABLE IF NOT EXISTS "{tablename}" '
+            "(key TEXT NOT NULL, seq INTEGER NOT NULL, payload TEXT NOT NULL, PRIMARY KEY (key, seq))"
+        )
+
+    def append(self, key: str, payload: str) -> int:
+        """Append `payload` to the log of `key` and return its sequence number."""
+        for attempt in range(self.max_attempts):
+            try:
+                return self._append(key, payload)
+            except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
+                # Another process holds the write lock beyond the busy timeout, or took the same seq.
+                if attempt == self.max_attempts - 1:
+                    raise
+                logger.warn(f"Retrying the append to {self.tablename} for {key}. {e}")
+                time.sleep(0.05 * 2**attempt)
+
+    def _append(self, key: str, payload: str) -> int:
+        with self.lock:
+            if not self.conn.in_transaction:
+                # The write lock is taken before reading the last seq, so that concurrent appends are serialized.
+                with self.transaction():
+                    return self._append(key, payload)
+            cursor = self.conn.execute(
+                f'INSERT INTO "{self.tablename}" (key, seq, payload) '
+                f'VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM "{self.tablename}" WHERE key = ?), ?)',
+                (key, key, payload),
+            )
+            cursor = self.conn.execute(f'SELECT seq FROM "{self.tablename}" WHERE rowid = ?', (cursor.lastrowid,))
+            return cursor.fetchone()[0]
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Hold the write lock of the file while the block runs, and commit everything it wrote at once.
+        The appends within the block join the transaction, as may the statements run on the yielded
+        connection against the other tables of the file.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def iter_entries(self, key: str, since_seq: int = 0, limit: int | None = None) -> Iterator[tuple[int, str]]:
+        """
+        Lazily iterate over the (seq, payload) entries of `key` with seq > `since_seq`.
+
+        The iteration reads through its own connection, as it may be resumed from other threads
+        (e.g. a streamed response) while the appends go on, and sees the entries of one snapshot.
+        """
+        conn = sqlite3.connect(self.filename, check_same_thread=False)
+        try:
+            cursor = conn.execute(
+                f'SELECT seq, payload FROM "{self.tablename}" WHERE key = ? AND seq > ? ORDER BY seq LIMIT ?',
+                (key, since_seq, -1 if limit is None else limit),
+            )
+            yield from cursor
+        finally:
+            conn.close()
+
+    def last_seq(self, key: str) -> int:
+        with self.lock:
+            cursor = self.conn.execute(f'SELECT COALESCE(MAX(seq), 0) FROM "{self.tablename}" WHERE key = ?', (key,))
+            return cursor.fetchone()[0]
+
+    def close(self):
+        self.conn.close()
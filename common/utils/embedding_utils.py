@@ -0,0 +1,231 @@
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+
+from tenacity import retry, stop_after_attempt, wait_exponential
+
+from common.registry import Registry
+from common.utils.database_utils import AutoStoredDict
+
+embedding_backend_registry = Registry(name="EmbeddingBackendRegistry")
+
+
+class EmbeddingBackend(ABC):
+    """Backend that turns a batch of texts into embedding vectors."""
+
+    model: str
+    dim: int
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        raise NotImplementedError("Subclasses must implement this method")
+
+
+@embedding_backend_registry.register("openai")
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, model: str = "text-embedding-ada-002", dim: int = 1536):
+        from openai import OpenAI
+
+        self.model = model
+        self.dim = dim
+        self.client = OpenAI()
+
+    @retry(
+        stop=stop_after_attempt(5),
+        reraise=True,
+        wait=wait_exponential(multiplier=1, min=1, max=10),
+    )
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        embeddings = self.client.embeddings.create(input=texts, model=self.model, encoding_format="float")
+        return [x.embedding for x in embeddings.data]
+
+
+@embedding_backend_registry.register("sentence_transformers")
+class SentenceTransformersEmbeddingBackend(EmbeddingBackend):
+    """Local embedding model loaded with the (optional) sentence-transformers package."""
+
+    def __init__(self, model: str = "all-MiniLM-L6-v2", device: str | None = None):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = model
+        self.encoder = SentenceTransformer(model, device=device)
+        self.dim = self.encoder.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return self.encoder.encode(texts, normalize_embeddings=True).tolist()
+
+
+@embedding_backend_registry.register("hashing")
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Dependency-free local backend based on feature hashing of word unigrams and bigrams.
+    The vectors are L2-normalized, so inner product behaves as cosine similarity. It is meant
+    for running and benchmarking the registry offline, not for semantic quality.
+    """
+
+    def __init__(self, dim: int = 1536):
+        self.model = f"hashing-{dim}"
+        self.dim = dim
+
+    def _embed_one(self, text: str) -> list[float]:
+        vector = [0.0] * self.dim
+        words = re.findall(r"\w+", text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.md5(feature.encode()).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed_one(text) for text in texts]
+
+
+class _PendingBatch:
+    def __init__(self):
+        self.texts: list[str] = []
+        # text -> its index in `texts`, to skip the texts already in the batch
+        self.index: dict[str, int] = {}
+        self.done = threading.Event()
+        self.vectors: dict[str, list[float]] = {}
+        self.error: Exception | None = None
+
+    def add(self, texts: list[str]):
+        for text in texts:
+            if text not in self.index:
+                self.index[text] = len(self.texts)
+                self.texts.append(text)
+
+
+class EmbeddingService:
+    """
+    Embedding service in front of an EmbeddingBackend.
+
+    * Vectors are cached persistently, keyed by (model, sha256(text)), so that identical texts
+      (e.g. re-registering the same agent or repeating a capability query) are never embedded twice.
+      The cache stores them as float32 (the precision of the vector databases), whatever the backend returns.
+    * Concurrent callers are coalesced: while a batch is being embedded by the backend, the texts missed
+      by the cache within a window of `batch_window` seconds are sent in a single batch, split into backend
+      calls of at most `max_batch_size` texts. When the backend is idle, a batch is sent without waiting.
+
+    Args:
+        backend (EmbeddingBackend): The backend computing the embeddings.
+        cache_path (str | None, optional): The SQLite file of the persistent cache. None disables the cache.
+        batch_window (float, optional): Seconds to wait for other callers before sending a batch while the backend
+            is busy. Defaults to 0.01.
+        max_batch_size (int, optional): Maximum number of texts in a backend call. Defaults to 256.
+    """
+
+    def __init__(
+        self,
+        backend: EmbeddingBackend,
+        cache_path: str | None = "database/embeddings.db",
+        batch_window: float = 0.01,
+        max_batch_size: int = 256,
+    ):
+        self.backend = backend
+        self.cache = AutoStoredDict(cache_path, tablename="embeddings") if cache_path else None
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._pending: _PendingBatch | None = None
+        # The number of batches being embedded by the backend
+        self._in_flight = 0
+
+    @property
+    def dim(self) -> int:
+        return self.backend.dim
+
+    def _cache_key(self, text: str) -> str:
+        return f"{self.backend.model}:{hashlib.sha256(text.encode()).hexdigest()}"
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        vectors: dict[str, list[float]] = {}
+        if self.cache is not None:
+            for text in set(texts):
+                try:
+                    vectors[text] = array("f", self.cache[self._cache_key(text)]).tolist()
+                except KeyError:
+                    pass
+        missed = [text for text in dict.fromkeys(texts) if text not in vectors]
+        for i in range(0, len(missed), self.max_batch_size):
+            vectors.update(self._embed_coalesced(missed[i : i + self.max_batch_size]))
+        return [vectors[text] for text in texts]
+
+    def _embed_coalesced(self, texts: list[str]) -> dict[str, list[float]]:
+        # The caller detaching a batch from `self._pending` is the one sending it to the backend.
+        with self._lock:
+            if self._pending is None:
+                self._pending = _PendingBatch()
+                leader = True
+            else:
+                leader = False
+            batch = self._pending
+            batch.add(texts)
+            # Waiting for other callers is only worth it while the backend is busy with another batch.
+            detached = len(batch.texts) >= self.max_batch_size or (leader and self._in_flight == 0)
+            if detached:
+                self._pending = None
+                self._in_flight += 1
+
+        if leader and not detached:
+            time.sleep(self.batch_window)
+            with self._lock:
+                detached = self._pending is batch
+                if detached:
+                    self._pending = None
+                    self._in_flight += 1
+
+        if detached:
+            self._run_batch(batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return {text: batch.vectors[text] for text in texts}
+
+    def _run_batch(self, batch: _PendingBatch):
+        try:
+            # The texts of the callers joining the batch may exceed the maximum size of a backend call.
+            for i in range(0, len(batch.texts), self.max_batch_size):
+                texts = batch.texts[i : i + self.max_batch_size]
+                batch.vectors.update(zip(texts, self.backend.embed(texts)))
+            if self.cache is not None:
+                for text, vector in batch.vectors.items():
+                    self.cache[self._cache_key(text)] = array("f", vector).tobytes()
+        except Exception as e:
+            batch.error = e
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            batch.done.set()
+
+
+_services: dict[str, EmbeddingService] = {}
+
+
+def get_embedding_service(config: dict | None = None) -> EmbeddingService:
+    """
+    Build (or reuse) the process-wide embedding service described by `config`, e.g.
+
+    .. code-block:: yaml
+
+       embedding:
+         backend: openai # [openai, sentence_transformers, hashing]
+         backend_args:
+           model: text-embedding-ada-002
+         cache_path: database/embeddings.db
+         batch_window: 0.01
+         max_batch_size: 256
+    """
+    config = dict(config or {})
+    key = json.dumps(config, sort_keys=True)
+    if key not in _services:
+        backend = embedding_backend_registry.build(config.pop("backend", "openai"), **config.pop("backend_args", {}))
+        _services[key] = EmbeddingService(backend, **config)
+    return _services[key]
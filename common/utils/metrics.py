@@ -0,0 +1,68 @@
+import bisect
+import time
+from contextlib import contextmanager
+
+# Upper bounds (in milliseconds) of the latency buckets
+DEFAULT_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+
+
+class LatencyHistogram:
+    """
+    A lightweight latency histogram with fixed buckets, used to expose per-operation latencies
+    without pulling in a metrics library.
+
+    Examples:
+        >>> histogram = LatencyHistogram()
+        >>> with histogram.time():
+        >>>     do_something()
+        >>> histogram.summary()
+        {'count': 1, 'mean_ms': 0.12, 'max_ms': 0.12, 'p50_ms': 1, 'p90_ms': 1, 'p99_ms': 1, 'buckets': {...}}
+    """
+
+    def __init__(self, buckets_ms: list[float] = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = sorted(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets_ms, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def percentile(self, q: float) -> float:
+        """Return the upper bound of the bucket containing the q-th quantile (0 < q <= 1)."""
+        if self.count == 0:
+            return 0.0
+        threshold = q * self.count
+        accumulated = 0
+        for bound, count in zip(self.buckets_ms, self.counts):
+            accumulated += count
+            if accumulated >= threshold:
+                return bound
+        return self.max_ms
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            "buckets": {
+                **{f"le_{bound}": count for bound, count in zip(self.buckets_ms, self.counts)},
+                "le_inf": self.counts[-1],
+            },
+        }
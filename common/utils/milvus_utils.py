@@ -11,14 +11,9 @@ import yaml
 # import logging
 from common.log import logger
 import os
-from openai import OpenAI
 from typing import List
 import asyncio, json
-from tenacity import retry, stop_after_attempt, wait_exponential
-
-openai_engine = "text-embedding-ada-002"
-VECTOR_DIMENSION = 1536
-client = OpenAI()
+from common.utils.embedding_utils import EmbeddingService, get_embedding_service
 
 # MilvusConfPath = os.path.join(os.path.dirname(__file__), "..", "config", "vecdb")
 
@@ -51,6 +46,7 @@ class MilvusWrapper(Collection):
         index_config={},
         create_index=False,
         hide_keys=False,
+        embedding_service: EmbeddingService | None = None,
     ) -> None:
         if utility.has_collection(name):
             logger.info(f"Loading from exsisting collection {name}.")
@@ -67,6 +63,7 @@ class MilvusWrapper(Collection):
 
         self.search_config = search_config
         self.index_config = index_config
+        self.embedding_service = embedding_service or get_embedding_service()
 
         if create_index and self.index_config != {}:
             self.create_index(**list(self.index_config.values())[0])
@@ -120,14 +117,8 @@ class MilvusWrapper(Collection):
             data.append(vector)
         return data
 
-    @retry(
-        stop=stop_after_attempt(5),
-        reraise=True,
-        wait=wait_exponential(multiplier=1, min=1, max=10),
-    )
     def _get_embedding_for_text(self, text: List[str]):
-        embeddings = client.embeddings.create(input=text, model=openai_engine, encoding_format="float")
-        return [x.embedding for x in embeddings.data]
+        return self.embedding_service.embed(text)
 
     def _primary_field_query(self, key, output_fields):
         self.load()
@@ -201,7 +192,12 @@ class MilvusWrapper(Collection):
             return self.search_config[name]
         raise KeyError(f"Search config named {name} does not exist.")
 
-    def search_via_config(self, data, name=None):
+    def search_via_config(self, data, name=None, limit=None, with_scores=False):
+        """
+        Search with the named search config. All the queries in `data` are embedded and searched in one batch.
+        `limit` overrides the limit of the config, and `with_scores` adds the similarity of each hit as `score`
+        (higher is better, i.e. the negated distance for L2).
+        """
         self.load()
         if self.search_config == {}:
             raise RuntimeError("Search configuration is empty.")
@@ -210,9 +206,19 @@ class MilvusWrapper(Collection):
             raise KeyError(f"Search config named {name} does not exist.")
         if self.search_config[name].get("auto_vectorize", False):
             data = self._get_embedding_for_text(data)
-        res = self.search(data, **self.search_config[name]["search_params"])
+        search_params = dict(self.search_config[name]["search_params"])
+        if limit is not None:
+            search_params["limit"] = limit
+        res = self.search(data, **search_params)
+        sign = -1 if search_params.get("param", {}).get("metric_type") == "L2" else 1
         return [
-            [{f: hit.entity.get(f) for f in self.search_config[name]["search_params"]["output_fields"]} for hit in hits]
+            [
+                {
+                    **{f: hit.entity.get(f) for f in search_params["output_fields"]},
+                    **({"score": sign * hit.distance} if with_scores else {}),
+                }
+                for hit in hits
+            ]
             for hits in res
         ]
 
@@ -245,6 +251,9 @@ class ConfigMilvusWrapper(MilvusWrapper):
             field_schema = FieldSchema(**field_config)
             fields.append(field_schema)
 
+        # config for embedding
+        embedding_service = get_embedding_service(self.config.get("embedding"))
+
         # adding auto-vectorized fields
         for field_name in auto_vectorized_fields:
             vec_field_name = field_name + "_vec"
@@ -252,7 +261,7 @@ class ConfigMilvusWrapper(MilvusWrapper):
                 **{
                     "name": vec_field_name,
                     "dtype": DataType.FLOAT_VECTOR,
-                    "dim": VECTOR_DIMENSION,
+                    "dim": embedding_service.dim,
                 }
             )
             fields.append(field_schema)
@@ -286,6 +295,7 @@ class ConfigMilvusWrapper(MilvusWrapper):
             create_index=self.config.get("auto_create_index", True),
             auto_vectorized_fields=auto_vectorized_fields,
             hide_keys=hide_keys,
+            embedding_service=embedding_service,
         )
 
     def _adapt_field_config(self, field_dict):
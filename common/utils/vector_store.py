@@ -0,0 +1,330 @@
+import os
+import threading
+from typing import Literal
+
+import numpy as np
+import yaml
+
+from common.log import logger
+from common.utils.database_utils import AutoStoredDict
+from common.utils.embedding_utils import EmbeddingService, get_embedding_service
+
+
+class LocalVectorStore:
+    """
+    In-process vector store exposing the same dict-like and search interface as MilvusWrapper,
+    for deployments that do not want to run a Milvus server.
+
+    The scalar fields are kept in memory and persisted in SQLite, and the vectors are appended to
+    a raw float32 file which is memory-mapped for search. Search is an exact matrix product over
+    all the vectors, which takes well under a millisecond for registries of thousands of agents.
+    The vectors of the live entries always fill the first rows of the file (a removal moves the last
+    row into the freed one), so the mapped file is searched as is, without copying it.
+
+    Args:
+        name (str): The name of the collection, used as the sub-directory of `persist_dir`.
+        fields (list[str]): The scalar fields, including the primary field.
+        primary_field (str): The name of the primary field.
+        auto_vectorized_fields (list[str], optional): The (at most one) text field embedded automatically
+            into the vector field `<name>_vec`. Defaults to [].
+        search_config (dict, optional): Search configurations, keyed by name. Defaults to {}.
+        persist_dir (str, optional): The directory of the persisted data. Defaults to "database/vecdb".
+        embedding_service (EmbeddingService | None, optional): The service embedding the texts.
+        hide_keys (bool, optional): Whether to hide the primary field in the returned entries. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fields: list[str],
+        primary_field: str,
+        auto_vectorized_fields: list[str] = [],
+        search_config: dict = {},
+        persist_dir: str = "database/vecdb",
+        embedding_service: EmbeddingService | None = None,
+        hide_keys: bool = False,
+    ) -> None:
+        assert len(auto_vectorized_fields) <= 1
+        self.name = name
+        self.fields = fields
+        self.primary_field = primary_field
+        self.auto_vectorized_fields = auto_vectorized_fields
+        self.search_config = search_config
+        self.embedding_service = embedding_service or get_embedding_service()
+        self.dim = self.embedding_service.dim
+        self.show_fields = [f for f in fields if not (hide_keys and f == primary_field)]
+
+        directory = os.path.join(persist_dir, name)
+        os.makedirs(directory, exist_ok=True)
+        self.rows = AutoStoredDict(os.path.join(directory, "rows.db"), tablename="rows")
+        self.vector_path = os.path.join(directory, "vectors.f32")
+        if not os.path.exists(self.vector_path):
+            open(self.vector_path, "wb").close()
+
+        # key -> entry with the scalar fields and the row of its vector in the vector file
+        self.entries: dict = dict(self.rows.items())
+        self.num_rows = os.path.getsize(self.vector_path) // (4 * self.dim)
+        self._matrix: np.ndarray | None = None
+        self._row_keys: np.ndarray | None = None
+        # Writes and searches may come from the threads of an executor.
+        self._lock = threading.RLock()
+        if self.auto_vectorized_fields:
+            # Fill the rows left unused by older versions, and skip the stale rows past the live ones.
+            self._compact()
+        logger.info(f"Loaded local vector store {name} with {len(self.entries)} entries.")
+
+    # vector file helpers
+    def _write_vector(self, row: int, vector: list[float]):
+        with open(self.vector_path, "r+b") as f:
+            f.seek(row * 4 * self.dim)
+            f.write(np.asarray(vector, dtype=np.float32).tobytes())
+        self.num_rows = max(self.num_rows, row + 1)
+        self._matrix = None
+
+    def _read_vector(self, row: int) -> np.ndarray:
+        with open(self.vector_path, "rb") as f:
+            f.seek(row * 4 * self.dim)
+            return np.frombuffer(f.read(4 * self.dim), dtype=np.float32)
+
+    def _move_row(self, key, row: int):
+        """Move the vector of `key` to `row`, which must be free."""
+        entry = self.entries[key]
+        self._write_vector(row, self._read_vector(entry["__row"]))
+        entry["__row"] = row
+        self.rows[key] = entry
+
+    def _compact(self):
+        for row, key in enumerate(sorted(self.entries, key=lambda k: self.entries[k]["__row"])):
+            if self.entries[key]["__row"] != row:
+                self._move_row(key, row)
+        # The rows past the live ones are stale, and overwritten by the next insertions.
+        self.num_rows = len(self.entries)
+        self._matrix = None
+
+    def _load_matrix_unlocked(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return the vectors of the live entries and their keys, indexed by row."""
+        if self._matrix is None:
+            if self.num_rows == 0 or not self.entries:
+                self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+                self._row_keys = np.array([], dtype=object)
+            else:
+                self._matrix = np.memmap(self.vector_path, dtype=np.float32, mode="r", shape=(self.num_rows, self.dim))
+                self._row_keys = np.empty(self.num_rows, dtype=object)
+                for key, entry in self.entries.items():
+                    self._row_keys[entry["__row"]] = key
+        return self._matrix, self._row_keys
+
+    def _to_entries(self, data) -> list[dict]:
+        if isinstance(data, dict):
+            return [data]
+        if isinstance(data, list):
+            return [x if isinstance(x, dict) else x.__dict__ for x in data]
+        return [data.__dict__]
+
+    # dict-like interface
+    def __setitem__(self, key, value):
+        if not isinstance(value, dict):
+            value = value.__dict__
+        assert self.primary_field not in value
+        return self.upsert_data({self.primary_field: key, **value})
+
+    def __getitem__(self, key):
+        entry = self.entries[key]
+        return {f: entry[f] for f in self.show_fields}
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return list(self.entries.keys())
+
+    def items(self):
+        return [{f: entry[f] for f in self.show_fields} for entry in self.entries.values()]
+
+    def remove(self, key):
+        # The vector of the last row fills the freed row, so that the live rows stay contiguous.
+        with self._lock:
+            if key not in self.entries:
+                return
+            row = self.entries.pop(key)["__row"]
+            del self.rows[key]
+            last_row = self.num_rows - 1
+            if row != last_row:
+                last_key = next((k for k, e in self.entries.items() if e["__row"] == last_row), None)
+                if last_key is not None:
+                    self._move_row(last_key, row)
+            self.num_rows = last_row
+            self._matrix = None
+
+    def upsert_data(self, data):
+        entries = self._to_entries(data)
+        texts = [entry[field] for entry in entries for field in self.auto_vectorized_fields]
+        vectors = self.embedding_service.embed(texts) if texts else [None] * len(entries)
+        with self._lock:
+            for entry, vector in zip(entries, vectors):
+                key = entry[self.primary_field]
+                row = self.entries[key]["__row"] if key in self.entries else self.num_rows
+                if vector is not None:
+                    self._write_vector(row, vector)
+                stored = {f: entry.get(f) for f in self.fields}
+                stored["__row"] = row
+                self.entries[key] = stored
+                self.rows[key] = stored
+            self._matrix = None
+
+    insert_data = upsert_data
+
+    # search
+    def get_search_config(self, name):
+        if name in self.search_config:
+            return self.search_config[name]
+        raise KeyError(f"Search config named {name} does not exist.")
+
+    def search_via_config(self, data, name=None, limit=None, with_scores=False):
+        """
+        Search with the named search config. All the queries in `data` are embedded and searched in one batch.
+        `limit` overrides the limit of the config, and `with_scores` adds the similarity of each hit as `score`.
+        """
+        if self.search_config == {}:
+            raise RuntimeError("Search configuration is empty.")
+        name = name or next(iter(self.search_config))
+        if name not in self.search_config:
+            raise KeyError(f"Search config named {name} does not exist.")
+        config = self.search_config[name]
+        if config.get("auto_vectorize", False):
+            data = self.embedding_service.embed(data)
+        search_params = config["search_params"]
+        metric_type = search_params.get("param", {}).get("metric_type", "IP")
+        offset = search_params.get("param", {}).get("offset", 0)
+        limit = limit or search_params.get("limit", 10)
+        output_fields = search_params.get("output_fields", self.show_fields)
+
+        queries = np.asarray(data, dtype=np.float32).reshape(-1, self.dim)
+        # The mapped rows are moved by the removals and the entries may be replaced, so both the scores and
+        # the output fields of the hits are read under the lock.
+        with self._lock:
+            matrix, keys = self._load_matrix_unlocked()
+            if len(keys) == 0:
+                return [[] for _ in queries]
+            match metric_type:
+                case "IP":
+                    scores = queries @ matrix.T
+                case "COSINE":
+                    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(queries, axis=1)[:, None]
+                    scores = (queries @ matrix.T) / np.maximum(norms, 1e-12)
+                case "L2":
+                    scores = -(
+                        (queries**2).sum(axis=1)[:, None] - 2 * queries @ matrix.T + (matrix**2).sum(axis=1)[None, :]
+                    )
+                case _:
+                    raise ValueError(f"Unsupported metric type: {metric_type}")
+
+            k = min(offset + limit, len(keys))
+            results = []
+            for query_scores in scores:
+                top = np.argpartition(-query_scores, k - 1)[:k]
+                top = top[np.argsort(-query_scores[top])][offset:]
+                results.append(
+                    [
+                        {
+                            **{f: self.entries[keys[i]][f] for f in output_fields},
+                            **({"score": float(query_scores[i])} if with_scores else {}),
+                        }
+                        for i in top
+                    ]
+                )
+        return results
+
+
+class ConfigLocalVectorStore(LocalVectorStore):
+    """LocalVectorStore configured from the same YAML file as ConfigMilvusWrapper."""
+
+    def __init__(self, config_path, name_modify=None) -> None:
+        with open(config_path, "r") as f:
+            self.config = yaml.safe_load(f)
+
+        if name_modify != None:
+            self.config["name"] = name_modify
+
+        fields = []
+        primary_field = None
+        auto_vectorized_fields = []
+        for field_config in self.config["collectionSchema"]["fields"]:
+            fields.append(field_config["name"])
+            if field_config.get("is_primary", False):
+                primary_field = field_config["name"]
+            if field_config.get("auto_vectorize", False):
+                auto_vectorized_fields.append(field_config["name"])
+
+        search_config = {}
+        if "search" in self.config:
+            search_config = {d.pop("name"): d for d in self.config["search"]}
+
+        super().__init__(
+            name=self.config["name"],
+            fields=fields,
+            primary_field=primary_field,
+            auto_vectorized_fields=auto_vectorized_fields,
+            search_config=search_config,
+            persist_dir=self.config.get("persist_dir", "database/vecdb"),
+            embedding_service=get_embedding_service(self.config.get("embedding")),
+            hide_keys=self.config.get("hide_keys", False),
+        )
+
+
+def fuse_search_results(
+    results: list[list[dict]],
+    method: Literal["rrf", "max_score"] = "rrf",
+    key: str = "name",
+    exclude: set[str] | None = None,
+    rrf_k: int = 60,
+) -> list[dict]:
+    """
+    Merge the ranked hits of several queries into a single ranking, deduplicated by `key`.
+
+    Args:
+        results (list[list[dict]]): The hits of each query, ordered from the most to the least similar.
+        method (Literal["rrf", "max_score"], optional): `rrf` (reciprocal rank fusion) sums 1 / (rrf_k + rank)
+            over the queries, which does not depend on the scale of the scores. `max_score` keeps the best
+            `score` of each hit over the queries. Defaults to "rrf".
+        key (str, optional): The field identifying a hit. Defaults to "name".
+        exclude (set[str] | None, optional): Values of `key` to drop from the results. Defaults to None.
+        rrf_k (int, optional): The rank constant of reciprocal rank fusion. Defaults to 60.
+    """
+    exclude = exclude or set()
+    fused_scores: dict[str, float] = {}
+    hits_by_key: dict[str, dict] = {}
+    for hits in results:
+        for rank, hit in enumerate(h for h in hits if h[key] not in exclude):
+            if method == "rrf":
+                score = 1 / (rrf_k + rank + 1)
+                fused_scores[hit[key]] = fused_scores.get(hit[key], 0) + score
+            elif method == "max_score":
+                fused_scores[hit[key]] = max(fused_scores.get(hit[key], float("-inf")), hit["score"])
+            else:
+                raise ValueError(f"Unknown fusion method: {method}")
+            hits_by_key.setdefault(hit[key], hit)
+    ranking = sorted(fused_scores, key=lambda k: fused_scores[k], reverse=True)
+    return [{**hits_by_key[k], "score": fused_scores[k]} for k in ranking]
+
+
+def get_vector_store_backend(config_path: str) -> str:
+    with open(config_path, "r") as f:
+        return yaml.safe_load(f).get("backend", "milvus")
+
+
+def load_vector_store(config_path: str, name_modify=None):
+    """Build the vector store described by the YAML config, using the backend in its `backend` field."""
+    backend = get_vector_store_backend(config_path)
+    match backend:
+        case "milvus":
+            from common.utils.milvus_utils import ConfigMilvusWrapper
+
+            return ConfigMilvusWrapper(config_path, name_modify=name_modify)
+        case "local":
+            return ConfigLocalVectorStore(config_path, name_modify=name_modify)
+        case _:
+            raise ValueError(f"Unknown vector store backend: {backend}")
@@ -0,0 +1,100 @@
+from typing import Literal
+
+try:
+    import msgpack
+except ModuleNotFoundError:
+    msgpack = None
+
+from common.log import logger
+
+WireFormat = Literal["json", "msgpack"]
+
+# The fields describing the session, which stay the same across the messages of a session.
+# They are sent once per connection and comm_id, and referenced afterwards.
+SESSION_FIELDS = ("goal", "team_members", "team_up_depth")
+# The key listing the session fields to restore from the previous messages of the session
+CACHED_FIELDS_KEY = "_cached"
+# The websocket subprotocol of the binary wire format. Connections without it use JSON text frames.
+MSGPACK_SUBPROTOCOL = "ioa.msgpack"
+
+
+def offered_subprotocols(wire_format: WireFormat) -> list[str]:
+    """The websocket subprotocols offered by a client asking for the given wire format."""
+    if wire_format != "msgpack":
+        return []
+    if msgpack is None:
+        logger.warn("The msgpack wire format is configured but msgpack is not installed. Falling back to JSON.")
+        return []
+    return [MSGPACK_SUBPROTOCOL]
+
+
+def select_subprotocol(offered: list[str]) -> str | None:
+    """The subprotocol accepted by the server among the offered ones, or None to use JSON."""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in offered:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def parse_subprotocol(subprotocol: str | None) -> WireFormat:
+    """The wire format of the subprotocol agreed on by both ends."""
+    return "msgpack" if subprotocol == MSGPACK_SUBPROTOCOL else "json"
+
+
+class WireEncoder:
+    """
+    Encode the messages of a connection as binary msgpack frames.
+
+    The encoder is stateful and must see every frame of the connection in order, as must the `WireDecoder`
+    at the other end:
+
+    * The session fields are sent with the first message of each comm_id, and replaced by a reference
+      in the next messages as long as they do not change.
+    * Fields equal to their defaults are dropped.
+
+    Args:
+        defaults (dict | None, optional): The default values of the fields, which are not sent. Defaults to None.
+    """
+
+    def __init__(self, defaults: dict | None = None):
+        self.defaults = defaults or {}
+        self.session_fields: dict[str, dict] = {}
+
+    def encode(self, message: dict) -> bytes:
+        payload = {k: v for k, v in message.items() if k not in self.defaults or self.defaults[k] != v}
+        sent = self.session_fields.setdefault(payload.get("comm_id", ""), {})
+        cached = []
+        for field in SESSION_FIELDS:
+            if payload.get(field) is None:
+                continue
+            if field in sent and sent[field] == payload[field]:
+                del payload[field]
+                cached.append(field)
+            else:
+                sent[field] = payload[field]
+        if cached:
+            payload[CACHED_FIELDS_KEY] = cached
+        return msgpack.packb(payload, use_bin_type=True)
+
+
+class WireDecoder:
+    """
+    Decode the binary frames written by a `WireEncoder` back into messages, with the session fields
+    and the defaults restored.
+
+    Args:
+        defaults (dict | None, optional): The default values of the fields, restored when missing. Defaults to None.
+    """
+
+    def __init__(self, defaults: dict | None = None):
+        self.defaults = defaults or {}
+        self.session_fields: dict[str, dict] = {}
+
+    def decode(self, frame: bytes) -> dict:
+        payload = msgpack.unpackb(frame, raw=False)
+        received = self.session_fields.setdefault(payload.get("comm_id", ""), {})
+        for field in payload.pop(CACHED_FIELDS_KEY, []):
+            payload[field] = received[field]
+        for field in SESSION_FIELDS:
+            if payload.get(field) is not None:
+                received[field] = payload[field]
+        return {**self.defaults, **payload}
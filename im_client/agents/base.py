@@ -51,6 +51,18 @@ class AgentAdapter:
                         f"AGENT_DESC={config.get('desc', '')}",
                         f"AGENT_MODEL={config.get('model', '')}",
                         f"MAX_NUM_STEPS={config.get('max_num_steps', 20)}",
+                        f"MAX_CONCURRENT_TASKS={config.get('max_concurrent_tasks', 4)}",
+                        f"TOOL_TIMEOUT={config.get('tool_timeout', 600)}",
+                        f"CODE_WORKERS={config.get('code_executor', {}).get('workers', 2)}",
+                        f"CODE_PRELOAD_MODULES={','.join(config.get('code_executor', {}).get('preload_modules', []))}",
+                        f"CODE_CPU_TIME_LIMIT={config.get('code_executor', {}).get('cpu_time_limit', 600)}",
+                        f"CODE_MEMORY_LIMIT_MB={config.get('code_executor', {}).get('memory_limit_mb', 4096)}",
+                        f"CODE_MAX_OUTPUT={config.get('code_executor', {}).get('max_output', 100000)}",
+                        f"PAGE_SUMMARY_MODE={config.get('page_summary_mode', 'truncate')}",
+                        f"PAGE_SUMMARY_TOKEN_LIMIT={config.get('page_summary_token_limit', 32000)}",
+                        f"PAGE_SUMMARY_CONCURRENCY={config.get('page_summary_concurrency', 4)}",
+                        f"MAX_BROWSER_PAGES={config.get('max_browser_pages', 4)}",
+                        f"PAGE_CACHE_TTL={config.get('page_cache_ttl', 3600)}",
                         f"TOOLS_CONFIG={config.get('tools_config')}",
                         f"OPENAI_API_BASE={os.environ.get('OPENAI_API_BASE', '')}",
                         f"CUPS_SERVER={os.environ.get('CUPS_SERVER', '')}",
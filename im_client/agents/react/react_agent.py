@@ -1,4 +1,6 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from string import Template
 from collections import defaultdict
 
@@ -18,16 +20,21 @@ from prompts import (
 from common.log import logger
 from common.types.llm import LLMResult
 from common.utils.tool_utils import ToolResponse
+from tools.browser_pool import BrowserPool
+from tools.code_executor import WORKING_DIR, close_session, close_worker_pool, get_worker_pool
+from tools.page_cache import load_page_cache
 from tools.playwright_browser import SimpleTextBrowser
 
-app = FastAPI()
-
 
 class TaskDesc(BaseModel):
     task_desc: str
     uid: str
 
 
+class TaskBatch(BaseModel):
+    tasks: list[TaskDesc]
+
+
 class MemoryAdded(BaseModel):
     role: str
     message: str
@@ -82,6 +89,8 @@ class ReActAgentServer:
         model: str,
         tools: list[dict] = [],
         max_num_steps: int = 20,
+        max_concurrent_tasks: int = 4,
+        tool_timeout: float = 600,
     ):
         self.agent_name = agent_name
         self.agent_desc = agent_desc
@@ -105,9 +114,16 @@ class ReActAgentServer:
         self.cookies = defaultdict(lambda: None)
         self.llm = OpenAIChat(model=model)
 
-        self.browser = SimpleTextBrowser(bing_api_key=os.getenv("BING_API_KEY"))
+        # The browser process is kept alive across the page visits and shared by the tasks,
+        # while each task browses in its own context (cookies, history, current page).
+        self.browser_pool = BrowserPool(max_pages=int(os.getenv("MAX_BROWSER_PAGES", 4) or 4))
+        self.page_cache = load_page_cache()
+        self.browsers: dict[str, SimpleTextBrowser] = {}
 
         self.max_num_steps = max_num_steps
+        # The number of tasks run at the same time. The other tasks wait for a free slot.
+        self.task_semaphore = asyncio.Semaphore(max_concurrent_tasks)
+        self.tool_timeout = tool_timeout
         # self.reset()
 
     def reset(self, uid: str):
@@ -117,17 +133,43 @@ class ReActAgentServer:
         self.cookies[uid] = None
         self.memory[uid].reset()
 
+    def get_browser(self, uid: str) -> SimpleTextBrowser:
+        if uid not in self.browsers:
+            self.browsers[uid] = SimpleTextBrowser(
+                pool=self.browser_pool,
+                uid=uid,
+                page_cache=self.page_cache,
+                bing_api_key=os.getenv("BING_API_KEY"),
+            )
+        return self.browsers[uid]
+
+    def get_work_dir(self, uid: str) -> str:
+        return os.path.join(WORKING_DIR, uid)
+
     async def run(self, task_desc: str, uid: str):
-        await self.create_task(task_desc, uid)
-        while not await self.is_finished(uid):
-            await self.step(uid)
-            logger.info(f"Step: {self.step_cnt[uid]} completed")
-        logger.info(f"UID: {uid} - Task is finished. Conclusion: {self.conclusion[uid]}")
-        if self.conclusion[uid] != "":
-            return self.conclusion[uid]
-        else:
-            # TODO: summarize the reason on failure and the current progress
-            return "Failed to handle the task."
+        async with self.task_semaphore:
+            try:
+                await self.create_task(task_desc, uid)
+                while not await self.is_finished(uid):
+                    await self.step(uid)
+                    logger.info(f"UID: {uid} - Step: {self.step_cnt[uid]} completed")
+                logger.info(f"UID: {uid} - Task is finished. Conclusion: {self.conclusion[uid]}")
+                if self.conclusion[uid] != "":
+                    return self.conclusion[uid]
+                else:
+                    # TODO: summarize the reason on failure and the current progress
+                    return "Failed to handle the task."
+            finally:
+                await self.cleanup(uid)
+
+    async def cleanup(self, uid: str):
+        """Drop the state of a finished task. The files in its working directory are kept."""
+        for state in [self.memory, self.step_cnt, self.task_desc, self.conclusion, self.cookies]:
+            state.pop(uid, None)
+        browser = self.browsers.pop(uid, None)
+        if browser is not None:
+            await browser.close()
+        await close_session(uid)
 
     async def step(self, uid: str):
         # Get the latest messages from the memory
@@ -185,48 +227,68 @@ class ReActAgentServer:
         await self.add_to_memory(response_tool, uid)
 
         if response_tool.parsed_tool_calls:
-            for i, tool_call in enumerate(response_tool.parsed_tool_calls):
-                tool_name = tool_call.function.name
-                tool_input = tool_call.function.arguments
-                tool_call_id = tool_call.id
-
-                if tool_name == SUBMIT_TOOL["function"]["name"]:
-                    self.conclusion[uid] = tool_input["conclusion"]
+            tool_calls = response_tool.parsed_tool_calls
+            # The calls after submit_task are not executed.
+            for i, tool_call in enumerate(tool_calls):
+                if tool_call.function.name == SUBMIT_TOOL["function"]["name"]:
+                    tool_calls = tool_calls[:i]
                     break
-                elif tool_name in TOOL_MAPPING:
-                    try:
-                        tool_response = ToolResponse(observation=TOOL_MAPPING[tool_name](**tool_input))
-                    except Exception as e:
-                        tool_response = ToolResponse(observation=f"Error in calling tool {tool_name}: {e}")
-                elif tool_name in BROWSER_TOOLS_MAPPING:
-                    try:
-                        if tool_name in ["read_page_and_answer", "summarize_page"]:
-                            tool_response = ToolResponse(
-                                observation=(
-                                    await BROWSER_TOOLS_MAPPING[tool_name](self.browser, self.llm, **tool_input)
-                                )
-                            )
-                        else:
-                            tool_response = ToolResponse(
-                                observation=await BROWSER_TOOLS_MAPPING[tool_name](self.browser, **tool_input)
-                            )
-                    except Exception as e:
-                        tool_response = ToolResponse(observation=f"Error in calling tool {tool_name}: {e}")
-                elif tool_name == SUBTASK_TOOL["function"]["name"]:
-                    if "subtask" in tool_input and "solution" in tool_input:
-                        tool_response: ToolResponse = ToolResponse(observation="The record of subtask_solver saved.")
-                    else:
-                        tool_response: ToolResponse = ToolResponse(observation="The call of subtask_solver failed.")
-                else:
-                    logger.warn(f"Agent generated invalid tool call:\n{tool_name}\n{tool_input}")
-                    tool_response = ToolResponse(observation=f"{tool_name} could not be found.")
 
-                tool_response_result = tool_response.to_llm_result(tool_call_id)
+            # The independent calls run concurrently. The browser tools share the state of the browser
+            # of the task, so they run one at a time in their original order (the lock is FIFO).
+            browser_lock = asyncio.Lock()
+            tool_responses = await asyncio.gather(
+                *[
+                    self.call_tool(uid, tool_call.function.name, tool_call.function.arguments, browser_lock)
+                    for tool_call in tool_calls
+                ]
+            )
+            for tool_call, tool_response in zip(tool_calls, tool_responses):
+                tool_response_result = tool_response.to_llm_result(tool_call.id)
                 logger.log_llm_result(tool_response_result)
                 await self.add_to_memory(tool_response_result, uid)
 
+            if len(tool_calls) < len(response_tool.parsed_tool_calls):
+                self.conclusion[uid] = response_tool.parsed_tool_calls[len(tool_calls)].function.arguments["conclusion"]
+
         self.step_cnt[uid] += 1
 
+    async def call_tool(self, uid: str, tool_name: str, tool_input: dict, browser_lock: asyncio.Lock) -> ToolResponse:
+        """Call a tool with a timeout of `self.tool_timeout` seconds. Errors are returned as the observation."""
+        try:
+            if tool_name in TOOL_MAPPING:
+                tool = TOOL_MAPPING[tool_name]
+                if tool_name == "execute_code":
+                    tool_input.setdefault("work_dir", self.get_work_dir(uid))
+                    # the Python snippets of a task share their variables
+                    tool_input["session_id"] = uid
+                if asyncio.iscoroutinefunction(tool):
+                    call = tool(**tool_input)
+                else:
+                    # The blocking tools run in a worker thread not to stall the other calls and tasks.
+                    call = asyncio.to_thread(tool, **tool_input)
+                observation = await asyncio.wait_for(call, self.tool_timeout)
+            elif tool_name in BROWSER_TOOLS_MAPPING:
+                async with browser_lock:
+                    if tool_name in ["read_page_and_answer", "summarize_page"]:
+                        call = BROWSER_TOOLS_MAPPING[tool_name](self.get_browser(uid), self.llm, **tool_input)
+                    else:
+                        call = BROWSER_TOOLS_MAPPING[tool_name](self.get_browser(uid), **tool_input)
+                    observation = await asyncio.wait_for(call, self.tool_timeout)
+            elif tool_name == SUBTASK_TOOL["function"]["name"]:
+                if "subtask" in tool_input and "solution" in tool_input:
+                    observation = "The record of subtask_solver saved."
+                else:
+                    observation = "The call of subtask_solver failed."
+            else:
+                logger.warn(f"Agent generated invalid tool call:\n{tool_name}\n{tool_input}")
+                observation = f"{tool_name} could not be found."
+        except asyncio.TimeoutError:
+            observation = f"Timeout in calling tool {tool_name}: no result after {self.tool_timeout} seconds."
+        except Exception as e:
+            observation = f"Error in calling tool {tool_name}: {e}"
+        return ToolResponse(observation=observation)
+
     async def create_task(self, task_desc: str, uid: str):
         self.reset(uid)
         self.task_desc[uid] = task_desc
@@ -242,6 +304,12 @@ class ReActAgentServer:
     async def is_finished(self, uid: str):
         return self.conclusion[uid] != "" or self.step_cnt[uid] > self.max_num_steps
 
+    async def shutdown(self):
+        await self.browser_pool.close()
+        await close_worker_pool()
+        if self.page_cache is not None:
+            self.page_cache.close()
+
 
 tools = []
 if tool_config_file := os.getenv("TOOLS_CONFIG", ""):
@@ -256,14 +324,34 @@ reactagent = ReActAgentServer(
     os.getenv("AGENT_MODEL"),
     tools,
     int(os.getenv("MAX_NUM_STEPS", 20)),
+    int(os.getenv("MAX_CONCURRENT_TASKS") or 4),
+    float(os.getenv("TOOL_TIMEOUT") or 600),
 )
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if any(tool["function"]["name"] == "execute_code" for tool in tools):
+        # warm up the Python workers before the first task
+        get_worker_pool()
+    yield
+    await reactagent.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
 @app.post("/run")
 async def run(task_desc: TaskDesc):
     return await reactagent.run(task_desc.task_desc, task_desc.uid)
 
 
+@app.post("/run_batch")
+async def run_batch(task_batch: TaskBatch):
+    """Run several tasks concurrently (up to MAX_CONCURRENT_TASKS at a time) and return their conclusions in order."""
+    return await asyncio.gather(*[reactagent.run(task.task_desc, task.uid) for task in task_batch.tasks])
+
+
 @app.post("/keep_alive")
 async def keep_alive_endpoint():
     return {"message": "Keep alive endpoint"}
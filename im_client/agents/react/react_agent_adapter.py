@@ -36,13 +36,14 @@ class ReActAgent(AgentAdapter):
         self.agent_name = agent_name
         self.task_desc = ""
         self.url = f"http://{global_config['tool_agent']['container_name']}:7070"
+        # The tasks assigned concurrently share the kept-alive connections to the container, where they run in parallel.
+        self.client = httpx.AsyncClient(base_url=self.url, timeout=httpx.Timeout(None))
 
     async def run(self, task_desc: str):
         uid = uuid.uuid4().hex
         data = TaskDesc(task_desc=task_desc, uid=uid)
         headers = {"Content-Type": "application/json"}
-        async with httpx.AsyncClient(timeout=httpx.Timeout(None)) as client:
-            response = await client.post(self.url + "/run", json=data.model_dump(), headers=headers)
+        response = await self.client.post("/run", json=data.model_dump(), headers=headers)
         logger.info(f"Received response: {response.text}")
         return response.text
 
@@ -71,4 +72,5 @@ class ReActAgent(AgentAdapter):
         return messageList
 
     async def shutdown(self):
+        await self.client.aclose()
         self.docker_container.remove(force=True)
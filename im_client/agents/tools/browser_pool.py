@@ -0,0 +1,96 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from playwright.async_api import Browser, BrowserContext, Page, Playwright, async_playwright
+
+from common.log import logger
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+
+
+class BrowserPool:
+    """
+    A long-lived Chromium browser shared by the browser tools of all the tasks.
+
+    The browser is launched on first use and reused across page visits. Each task (uid) gets its
+    own isolated browser context, so that cookies and storage are not shared between tasks, and the
+    number of pages open at the same time is capped by `max_pages`. If the browser crashes or is
+    disconnected, it is relaunched on the next visit and the contexts are recreated.
+
+    Args:
+        headless (bool, optional): Whether to run the browser headless. Defaults to True.
+        max_pages (int, optional): The maximum number of pages open at the same time. Defaults to 4.
+        user_agent (str, optional): The user agent of the contexts.
+    """
+
+    def __init__(self, headless: bool = True, max_pages: int = 4, user_agent: str = USER_AGENT):
+        self.headless = headless
+        self.user_agent = user_agent
+        self.page_semaphore = asyncio.Semaphore(max_pages)
+        self.playwright: Optional[Playwright] = None
+        self.browser: Optional[Browser] = None
+        self.contexts: dict[str, BrowserContext] = {}
+        self._lock = asyncio.Lock()
+        # Guards the creation of the contexts, so that concurrent visits of a task share one context.
+        self._context_lock = asyncio.Lock()
+
+    async def _ensure_browser(self) -> Browser:
+        async with self._lock:
+            if self.browser is not None and self.browser.is_connected():
+                return self.browser
+            if self.browser is not None:
+                logger.warn("The browser is disconnected, relaunching it.")
+                await self._close_browser()
+            if self.playwright is None:
+                self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(headless=self.headless)
+            return self.browser
+
+    async def get_context(self, uid: str) -> BrowserContext:
+        """Return the browser context of `uid`, creating it if needed."""
+        browser = await self._ensure_browser()
+        async with self._context_lock:
+            if uid not in self.contexts:
+                self.contexts[uid] = await browser.new_context(user_agent=self.user_agent)
+            return self.contexts[uid]
+
+    @asynccontextmanager
+    async def page(self, uid: str) -> AsyncIterator[Page]:
+        """Open a page in the context of `uid`, waiting for a free slot if `max_pages` pages are open."""
+        async with self.page_semaphore:
+            context = await self.get_context(uid)
+            page = await context.new_page()
+            try:
+                yield page
+            finally:
+                try:
+                    await page.close()
+                except Exception:
+                    # the page is gone with the browser if it crashed
+                    pass
+
+    async def close_context(self, uid: str):
+        """Close the context of `uid` and drop its cookies and storage."""
+        context = self.contexts.pop(uid, None)
+        if context is not None:
+            try:
+                await context.close()
+            except Exception:
+                pass
+
+    async def _close_browser(self):
+        self.contexts.clear()
+        try:
+            await self.browser.close()
+        except Exception:
+            pass
+        self.browser = None
+
+    async def close(self):
+        async with self._lock:
+            if self.browser is not None:
+                await self._close_browser()
+            if self.playwright is not None:
+                await self.playwright.stop()
+                self.playwright = None
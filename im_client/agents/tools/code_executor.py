@@ -1,16 +1,32 @@
 # https://github.com/microsoft/autogen/blob/19de99e3f6e46f6040d54c4a55785d02158dec28/autogen/code_utils.py
 
+import asyncio
+import codecs
+import itertools
+import json
+import math
 import os
 import pathlib
 import subprocess
 import sys
-from concurrent.futures import ThreadPoolExecutor
 from hashlib import md5
-from typing import Optional
+from typing import Callable, Optional
+
+try:
+    import resource
+except ModuleNotFoundError:  # Windows
+    resource = None
+
+from common.log import logger
 
 WORKING_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "extensions")
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "python_worker.py")
 TIMEOUT_MSG = "Code execution timeout"
 DEFAULT_TIMEOUT = 600
+# Limits of a code execution, configurable with environment variables
+CPU_TIME_LIMIT = float(os.getenv("CODE_CPU_TIME_LIMIT") or DEFAULT_TIMEOUT)  # seconds
+MEMORY_LIMIT_MB = int(os.getenv("CODE_MEMORY_LIMIT_MB") or 4096)  # address space of a process, 0 for no limit
+MAX_OUTPUT = int(os.getenv("CODE_MAX_OUTPUT") or 100000)  # characters
 WIN32 = sys.platform == "win32"
 PATH_SEPARATOR = WIN32 and "\\" or "/"
 PYTHON_VARIANTS = ["python", "Python", "py"]
@@ -66,15 +82,311 @@ def _cmd(lang: str) -> str:
     raise NotImplementedError(f"{lang} not recognized in code execution")
 
 
-def execute_code(
+OutputCallback = Callable[[str, str], None]
+
+
+def _limit_memory():
+    """Applied in the child processes before they start."""
+    if resource is not None and MEMORY_LIMIT_MB > 0:
+        limit = MEMORY_LIMIT_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _limit_resources():
+    """Applied in the subprocesses running the other languages, which are killed with SIGXCPU past the CPU time."""
+    _limit_memory()
+    if resource is not None:
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        soft = math.ceil(CPU_TIME_LIMIT)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+class PythonWorker:
+    """A warm Python process executing snippets in a persistent namespace, see python_worker.py."""
+
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+        self.lock = asyncio.Lock()
+        self._ids = itertools.count()
+        # The output written directly to the file descriptors (e.g. by subprocesses) is attributed to the running call.
+        # The worker redirects both descriptors to its stderr, so it is reported as stderr.
+        self._on_raw_output: Optional[OutputCallback] = None
+        self._raw_reader = asyncio.get_event_loop().create_task(self._read_raw_output())
+
+    @classmethod
+    async def start(cls, preload_modules: list[str]) -> "PythonWorker":
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-u",
+            WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, "PRELOAD_MODULES": ",".join(preload_modules)},
+            preexec_fn=None if WIN32 else _limit_memory,
+            limit=2**24,
+        )
+        worker = cls(process)
+        ready = await process.stdout.readline()
+        if not ready:
+            raise RuntimeError("The Python worker exited during startup.")
+        return worker
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def _read_raw_output(self):
+        while data := await self.process.stderr.read(4096):
+            if self._on_raw_output is not None:
+                self._on_raw_output("stderr", data.decode(errors="replace"))
+
+    async def run(
+        self,
+        code: str,
+        filename: Optional[str],
+        cwd: str,
+        timeout: float,
+        on_output: OutputCallback,
+    ) -> bool:
+        """Run a snippet, streaming its output to `on_output`. Returns whether it succeeded."""
+        async with self.lock:
+            request_id = next(self._ids)
+            request = {
+                "id": request_id,
+                "code": code,
+                "filename": filename,
+                "cwd": cwd,
+                "cpu_time": CPU_TIME_LIMIT,
+                "max_output": MAX_OUTPUT,
+            }
+            self._on_raw_output = on_output
+            try:
+                self.process.stdin.write((json.dumps(request) + "\n").encode())
+                await self.process.stdin.drain()
+                return await asyncio.wait_for(self._read_until_done(request_id, on_output), timeout)
+            finally:
+                self._on_raw_output = None
+
+    async def _read_until_done(self, request_id: int, on_output: OutputCallback) -> bool:
+        while line := await self.process.stdout.readline():
+            message = json.loads(line)
+            if message.get("id") != request_id:
+                continue
+            if message.get("done"):
+                return message["success"]
+            on_output(message["stream"], message["data"])
+        # The worker died, e.g. killed for exceeding the CPU time or memory limit.
+        await self.process.wait()
+        raise ProcessLookupError(f"The Python worker exited with code {self.process.returncode}.")
+
+    async def kill(self):
+        if self.alive:
+            self.process.kill()
+            await self.process.wait()
+        self._raw_reader.cancel()
+
+
+class PythonWorkerPool:
+    """
+    A pool of pre-warmed Python workers, with the modules in `preload_modules` already imported.
+
+    A session (e.g. the uid of a ReAct task) keeps its worker until it is closed, so later snippets
+    can reuse the variables of earlier ones. Calls without a session use a fresh worker which is
+    discarded afterwards. Used workers are replaced in the background, so that calls do not pay
+    the startup of the interpreter and the imports.
+
+    Args:
+        size (int, optional): The number of idle workers kept warm. Defaults to 2.
+        preload_modules (list[str], optional): The modules imported by the workers at startup. Defaults to [].
+    """
+
+    def __init__(self, size: int = 2, preload_modules: list[str] = []):
+        self.size = size
+        self.preload_modules = preload_modules
+        self.idle: asyncio.Queue[asyncio.Task] = asyncio.Queue()
+        self.sessions: dict[str, PythonWorker] = {}
+        # Serialize the reservation of the worker of each session, so that concurrent calls share one worker.
+        self.session_locks: dict[str, asyncio.Lock] = {}
+        for _ in range(size):
+            self._spawn()
+
+    def _spawn(self):
+        self.idle.put_nowait(asyncio.get_event_loop().create_task(PythonWorker.start(self.preload_modules)))
+
+    async def _acquire(self) -> PythonWorker:
+        while True:
+            starting = await self.idle.get()
+            self._spawn()
+            try:
+                worker = await starting
+            except Exception as e:
+                logger.error(f"Failed to start a Python worker. {e}")
+                continue
+            if worker.alive:
+                return worker
+
+    async def run(
+        self,
+        code: str,
+        filename: Optional[str] = None,
+        cwd: str = WORKING_DIR,
+        session_id: Optional[str] = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        on_output: Optional[OutputCallback] = None,
+    ) -> tuple[bool, str, str]:
+        """
+        Run a snippet in the worker of `session_id` (or in a fresh worker if None).
+
+        Returns:
+            tuple[bool, str, str]: Whether the snippet succeeded, its stdout and its stderr.
+        """
+        outputs = {"stdout": [], "stderr": []}
+
+        def collect(stream: str, data: str):
+            outputs[stream].append(data)
+            if on_output is not None:
+                on_output(stream, data)
+
+        worker = await self._reserve(session_id)
+        try:
+            success = await worker.run(code, filename, cwd, timeout, collect)
+        except asyncio.TimeoutError:
+            await self._discard(worker, session_id)
+            return False, "".join(outputs["stdout"]), TIMEOUT_MSG
+        except ProcessLookupError as e:
+            await self._discard(worker, session_id)
+            return False, "".join(outputs["stdout"]), "".join(outputs["stderr"]) + f"\n{e} The resource limits may have been exceeded."
+        except json.JSONDecodeError as e:
+            # The protocol stream is out of sync, so the worker cannot be used anymore.
+            logger.error(f"Received a malformed line from the Python worker. {e}")
+            await self._discard(worker, session_id)
+            return False, "".join(outputs["stdout"]), "".join(outputs["stderr"]) + "\nThe Python worker failed."
+        except BaseException:
+            # Cancelled in the middle of the request (e.g. by an outer timeout): the worker is still running
+            # the snippet, and its remaining output would be read as the output of the next request.
+            await self._discard(worker, session_id)
+            raise
+        if session_id is None:
+            await worker.kill()
+        return success, "".join(outputs["stdout"]), "".join(outputs["stderr"])
+
+    async def _reserve(self, session_id: Optional[str]) -> PythonWorker:
+        if session_id is None:
+            return await self._acquire()
+        async with self.session_locks.setdefault(session_id, asyncio.Lock()):
+            worker = self.sessions.get(session_id)
+            if worker is None or not worker.alive:
+                worker = self.sessions[session_id] = await self._acquire()
+            return worker
+
+    async def _discard(self, worker: PythonWorker, session_id: Optional[str]):
+        await worker.kill()
+        if session_id is not None and self.sessions.get(session_id) is worker:
+            del self.sessions[session_id]
+
+    async def close_session(self, session_id: str):
+        self.session_locks.pop(session_id, None)
+        worker = self.sessions.pop(session_id, None)
+        if worker is not None:
+            await worker.kill()
+
+    async def close(self):
+        for session_id in list(self.sessions):
+            await self.close_session(session_id)
+        while not self.idle.empty():
+            starting = self.idle.get_nowait()
+            try:
+                await (await starting).kill()
+            except Exception:
+                pass
+
+
+_worker_pool: Optional[PythonWorkerPool] = None
+
+
+def get_worker_pool() -> PythonWorkerPool:
+    """The process-wide worker pool, configured with the CODE_WORKERS and CODE_PRELOAD_MODULES environment variables."""
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = PythonWorkerPool(
+            size=int(os.getenv("CODE_WORKERS") or 2),
+            preload_modules=[m.strip() for m in os.getenv("CODE_PRELOAD_MODULES", "").split(",") if m.strip()],
+        )
+    return _worker_pool
+
+
+async def close_session(session_id: str):
+    if _worker_pool is not None:
+        await _worker_pool.close_session(session_id)
+
+
+async def close_worker_pool():
+    if _worker_pool is not None:
+        await _worker_pool.close()
+
+
+async def _run_subprocess(
+    cmd: list[str], cwd: str, timeout: float, on_output: Optional[OutputCallback] = None
+) -> tuple[int | None, str, str]:
+    """
+    Run a command, streaming its output to `on_output` as it is produced.
+
+    Returns:
+        tuple[int | None, str, str]: The return code (None on timeout), the stdout and the stderr,
+            each truncated to MAX_OUTPUT characters.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        preexec_fn=None if WIN32 else _limit_resources,
+    )
+    outputs = {"stdout": [], "stderr": []}
+
+    async def read(name: str, stream: asyncio.StreamReader):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        budget = MAX_OUTPUT
+        # Keep reading past the budget, so that the process does not block on a full pipe.
+        while data := await stream.read(4096):
+            text = decoder.decode(data)[:budget]
+            if text:
+                budget -= len(text)
+                outputs[name].append(text)
+                if on_output is not None:
+                    on_output(name, text)
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(read("stdout", process.stdout), read("stderr", process.stderr), process.wait()), timeout
+        )
+    except asyncio.TimeoutError:
+        return None, "".join(outputs["stdout"]), TIMEOUT_MSG
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    return process.returncode, "".join(outputs["stdout"]), "".join(outputs["stderr"])
+
+
+async def execute_code(
     code: Optional[str] = None,
     filename: Optional[str] = None,
     work_dir: Optional[str] = None,
     lang: Optional[str] = "python",
+    session_id: Optional[str] = None,
+    on_output: Optional[OutputCallback] = None,
 ) -> str:
     """Execute code in a docker container.
     This function is not tested on MacOS.
 
+    Python code runs in a warm worker of the pool, in the namespace of `session_id` if given,
+    and the other languages run in a subprocess. The executions are limited in CPU time, memory
+    and output size (CODE_CPU_TIME_LIMIT, CODE_MEMORY_LIMIT_MB and CODE_MAX_OUTPUT).
+
     Args:
         code (Optional, str): The code to execute.
             If None, the code from the file specified by filename will be executed.
@@ -87,6 +399,10 @@ def execute_code(
             If None, a default working directory will be used.
             The default working directory is the "extensions" directory
         lang (Optional, str): The language of the code. Default is "python".
+        session_id (Optional, str): The session whose variables are kept across the Python executions.
+            If None, the code runs in a fresh interpreter.
+        on_output (Optional, Callable[[str, str], None]): Called with the stream name ("stdout" or "stderr")
+            and the data as the output is produced.
 
     Returns:
         str: The error message if the code fails to execute; the stdout otherwise.
@@ -95,13 +411,33 @@ def execute_code(
         error_msg = f"Either {code=} or {filename=} must be provided."
         return error_msg
 
+    if work_dir is None:
+        work_dir = WORKING_DIR
+    os.makedirs(work_dir, exist_ok=True)
+    is_python = lang.startswith("python") or lang in PYTHON_VARIANTS
+
+    if is_python:
+        if code is None:
+            with open(os.path.join(work_dir, filename), "r", encoding="utf-8") as f:
+                code = f.read()
+        elif filename is not None:
+            filepath = os.path.join(work_dir, filename)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with open(filepath, "w", encoding="utf-8") as fout:
+                fout.write(code)
+        success, stdout, stderr = await get_worker_pool().run(
+            code, filename, cwd=work_dir, session_id=session_id, timeout=DEFAULT_TIMEOUT, on_output=on_output
+        )
+        if success:
+            return stdout
+        abs_path = str(pathlib.Path(work_dir).absolute()) + PATH_SEPARATOR
+        return stderr.replace(abs_path, "")
+
     original_filename = filename
     if filename is None:
         code_hash = md5(code.encode()).hexdigest()
         # create a file with a automatically generated name
-        filename = f"tmp_code_{code_hash}.{'py' if lang.startswith('python') else lang}"
-    if work_dir is None:
-        work_dir = WORKING_DIR
+        filename = f"tmp_code_{code_hash}.{lang}"
 
     filepath = os.path.join(work_dir, filename)
     file_dir = os.path.dirname(filepath)
@@ -112,27 +448,16 @@ def execute_code(
             fout.write(code)
 
     cmd = [
-        sys.executable if lang.startswith("python") else _cmd(lang),
+        _cmd(lang),
         f".\\{filename}" if WIN32 else filename,
     ]
-    with ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(
-            subprocess.run, cmd, cwd=work_dir, capture_output=True, text=True, timeout=DEFAULT_TIMEOUT
-        )
-        try:
-            result = future.result(timeout=DEFAULT_TIMEOUT)
-        except subprocess.TimeoutExpired:
-            if original_filename is None:
-                os.remove(filepath)
-            return TIMEOUT_MSG
-        except TimeoutError:
-            if original_filename is None:
-                os.remove(filepath)
-            return TIMEOUT_MSG
+    returncode, stdout, stderr = await _run_subprocess(cmd, work_dir, DEFAULT_TIMEOUT, on_output)
     if original_filename is None:
         os.remove(filepath)
-    if result.returncode:
-        logs = result.stderr
+    if returncode is None:
+        return TIMEOUT_MSG
+    if returncode:
+        logs = stderr
         if original_filename is None:
             abs_path = str(pathlib.Path(filepath).absolute())
             logs = logs.replace(str(abs_path), "").replace(filename, "")
@@ -140,5 +465,5 @@ def execute_code(
             abs_path = str(pathlib.Path(work_dir).absolute()) + PATH_SEPARATOR
             logs = logs.replace(str(abs_path), "")
     else:
-        logs = result.stdout
+        logs = stdout
     return logs
@@ -0,0 +1,92 @@
+import re
+from typing import Optional, Tuple
+
+import markdownify
+from bs4 import BeautifulSoup, Tag
+
+try:
+    import lxml  # noqa: F401
+
+    HTML_PARSER = "lxml"
+except ModuleNotFoundError:
+    HTML_PARSER = "html.parser"
+
+# Elements never rendered as text
+NON_CONTENT_TAGS = ["script", "style", "noscript", "template", "svg", "canvas", "iframe", "head"]
+# Elements holding the navigation and the other boilerplate around the content
+BOILERPLATE_TAGS = ["nav", "footer", "aside", "form"]
+BOILERPLATE_ROLES = {"navigation", "banner", "contentinfo", "search", "complementary"}
+BOILERPLATE_PATTERN = re.compile(
+    r"(^|[\s_-])(nav|navbar|menu|sidebar|footer|cookie|consent|banner|advert|ads|social|share|breadcrumbs?|popup|modal)($|[\s_-])",
+    re.IGNORECASE,
+)
+# The main content is used only if it holds at least this share of the text of the page
+MIN_MAIN_CONTENT_RATIO = 0.25
+# Elements looking like boilerplate are kept if they hold more than this share of the text of the page,
+# e.g. a wrapper of the whole page with a class like "nav-open"
+MAX_BOILERPLATE_RATIO = 0.5
+
+
+def _is_boilerplate(element: Tag) -> bool:
+    if element.name in BOILERPLATE_TAGS:
+        return True
+    if element.get("role") in BOILERPLATE_ROLES:
+        return True
+    attributes = " ".join([element.get("id") or ""] + list(element.get("class") or []))
+    return bool(attributes) and BOILERPLATE_PATTERN.search(attributes) is not None
+
+
+def _find_main_content(soup: BeautifulSoup) -> Optional[Tag]:
+    body = soup.body or soup
+    body_length = len(body.get_text(" ", strip=True))
+    for candidate in [soup.find("main"), soup.find(attrs={"role": "main"}), soup.find("article")]:
+        if candidate is not None and len(candidate.get_text(" ", strip=True)) >= MIN_MAIN_CONTENT_RATIO * body_length:
+            return candidate
+    return None
+
+
+def html_to_markdown(html_content: str, url: str = "") -> Tuple[Optional[str], str]:
+    """
+    Convert a web page to markdown in a single pass: parse once, drop the non-content and boilerplate
+    elements, pick the main content of the page if there is one, and convert it once.
+    This is CPU-bound, so run it in a worker thread from async code.
+
+    Args:
+        html_content (str): The HTML of the page.
+        url (str, optional): The URL of the page, used to pick site-specific content. Defaults to "".
+
+    Returns:
+        Tuple[Optional[str], str]: The title and the markdown of the page.
+    """
+    soup = BeautifulSoup(html_content, HTML_PARSER)
+    title = soup.title.get_text(strip=True) if soup.title is not None else None
+
+    for element in soup(NON_CONTENT_TAGS):
+        element.decompose()
+    for img in soup.find_all("img", src=re.compile(r"^data:image")):
+        img.decompose()
+
+    root = None
+    if url.startswith("https://en.wikipedia.org/"):
+        root = soup.find("div", {"id": "mw-content-text"})
+        title_elm = soup.find("span", {"class": "mw-page-title-main"})
+        if title_elm is not None:
+            title = title_elm.get_text(strip=True)
+    if root is None:
+        # Collect before removing, as decomposing a parent invalidates its descendants.
+        body_length = len((soup.body or soup).get_text(" ", strip=True))
+        boilerplate = [element for element in soup.find_all(True) if _is_boilerplate(element)]
+        for element in boilerplate:
+            if element.decomposed or element.name in ["html", "body"]:
+                continue
+            if len(element.get_text(" ", strip=True)) <= MAX_BOILERPLATE_RATIO * body_length:
+                element.decompose()
+        root = _find_main_content(soup) or soup.body or soup
+
+    webpage_text = markdownify.MarkdownConverter(heading_style="ATX").convert_soup(root)
+    webpage_text = re.sub(r"\r\n", "\n", webpage_text)
+    webpage_text = re.sub(r"[ \t]+\n", "\n", webpage_text)
+    webpage_text = re.sub(r"\n{2,}", "\n\n", webpage_text).strip()
+    if title and url.startswith("https://en.wikipedia.org/"):
+        webpage_text = f"# {title}\n\n{webpage_text}"
+    return title, webpage_text
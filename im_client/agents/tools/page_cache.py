@@ -0,0 +1,189 @@
+import hashlib
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from common.log import logger
+
+
+@dataclass
+class CachedPage:
+    url: str
+    fetched_at: float
+    title: Optional[str]
+    markdown: str
+    content_type: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # Seconds after `fetched_at` during which the page is served without revalidation
+    lifetime: float = 0
+
+    def is_fresh(self) -> bool:
+        return time.time() - self.fetched_at < self.lifetime
+
+    @property
+    def validators(self) -> dict[str, str]:
+        """The headers of a conditional request revalidating the page."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def freshness_lifetime(headers: dict, ttl: float) -> Optional[float]:
+    """
+    The seconds during which a response can be served by this shared cache without revalidation,
+    at most `ttl`, from its Cache-Control (s-maxage, max-age, no-cache) or Expires header.
+
+    Args:
+        headers (dict): The headers of the response, with lowercase names.
+        ttl (float): The lifetime of the responses without explicit freshness.
+
+    Returns:
+        Optional[float]: The lifetime, 0 if the response must be revalidated before every use,
+            or None if it must not be stored.
+    """
+    directives = {}
+    for directive in headers.get("cache-control", "").split(","):
+        name, _, value = directive.strip().lower().partition("=")
+        directives[name.strip()] = value.strip().strip('"')
+    if "no-store" in directives or "private" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                return max(0, min(int(directives[name]), ttl))
+            except ValueError:
+                return 0
+    if "expires" in headers:
+        expires = _parse_http_date(headers["expires"])
+        if expires is None:
+            # An invalid date (e.g. "0") means already expired.
+            return 0
+        date = _parse_http_date(headers.get("date")) or time.time()
+        return max(0, min(expires - date, ttl))
+    return ttl
+
+
+class PageCache:
+    """
+    Disk-backed cache of the fetched pages, shared by the browsers of all the tasks in the container.
+
+    The index (converted markdown, title, ETag/Last-Modified) is kept in SQLite and the raw bytes of
+    each page in a file named after the hash of its URL. Pages are served from the cache directly during
+    their freshness lifetime (see `freshness_lifetime`); stale pages with validators are revalidated with
+    a conditional request, and the others are fetched again.
+
+    Args:
+        cache_dir (str, optional): The directory of the cache. Defaults to "database/page_cache".
+        ttl (float, optional): The maximum seconds during which a page is served without revalidation.
+            Defaults to 3600.
+    """
+
+    def __init__(self, cache_dir: str = "database/page_cache", ttl: float = 3600):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        os.makedirs(os.path.join(cache_dir, "raw"), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cache_dir, "index.db"))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, fetched_at REAL, title TEXT, markdown TEXT, "
+            "content_type TEXT, etag TEXT, last_modified TEXT, lifetime REAL)"
+        )
+        # The caches created by older versions lack the lifetime, and their pages live for the ttl.
+        if "lifetime" not in {row[1] for row in self.conn.execute("PRAGMA table_info(pages)")}:
+            self.conn.execute("ALTER TABLE pages ADD COLUMN lifetime REAL")
+        self.conn.commit()
+
+    def _raw_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, "raw", hashlib.sha256(url.encode()).hexdigest())
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        row = self.conn.execute(
+            "SELECT url, fetched_at, title, markdown, content_type, etag, last_modified, COALESCE(lifetime, ?) "
+            "FROM pages WHERE url = ?",
+            (self.ttl, url),
+        ).fetchone()
+        return CachedPage(*row) if row is not None else None
+
+    def get_raw(self, url: str) -> Optional[bytes]:
+        try:
+            with open(self._raw_path(url), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(
+        self,
+        url: str,
+        markdown: str,
+        title: Optional[str] = None,
+        raw: Optional[bytes] = None,
+        headers: Optional[dict] = None,
+        status: int = 200,
+    ):
+        """Store the page, unless the response is not successful or forbids caching it."""
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        if not 200 <= status < 300:
+            return
+        lifetime = freshness_lifetime(headers, self.ttl)
+        # A page which is never fresh is only worth storing if it can be revalidated.
+        if lifetime is None or lifetime == 0 and not (headers.get("etag") or headers.get("last-modified")):
+            return
+        if raw is not None:
+            with open(self._raw_path(url), "wb") as f:
+                f.write(raw)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                url,
+                time.time(),
+                title,
+                markdown,
+                headers.get("content-type", ""),
+                headers.get("etag"),
+                headers.get("last-modified"),
+                lifetime,
+            ),
+        )
+        self.conn.commit()
+
+    def touch(self, url: str, headers: Optional[dict] = None):
+        """Mark the page as fetched now, after a successful revalidation whose response had `headers`."""
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        if "cache-control" in headers or "expires" in headers:
+            # The freshness of the revalidation response replaces the stored one.
+            lifetime = freshness_lifetime(headers, self.ttl) or 0
+            self.conn.execute(
+                "UPDATE pages SET fetched_at = ?, lifetime = ? WHERE url = ?", (time.time(), lifetime, url)
+            )
+        else:
+            self.conn.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def load_page_cache() -> Optional[PageCache]:
+    """Build the page cache from the PAGE_CACHE_DIR and PAGE_CACHE_TTL environment variables. A TTL of 0 disables it."""
+    ttl = float(os.getenv("PAGE_CACHE_TTL") or 3600)
+    if ttl <= 0:
+        return None
+    cache_dir = os.getenv("PAGE_CACHE_DIR") or "database/page_cache"
+    logger.info(f"Caching the fetched pages in {cache_dir} for {ttl} seconds.")
+    return PageCache(cache_dir, ttl)
@@ -1,6 +1,8 @@
 # Based on https://github.com/microsoft/autogen/blob/19de99e3f6e46f6040d54c4a55785d02158dec28/autogen/browser_utils.py
 
+import asyncio
 import io
+import os
 import re
 import sys
 from typing import Dict, List, Optional, Tuple, Union
@@ -12,8 +14,12 @@ import threading
 
 import requests
 from llms import OpenAIChat
-from llms.utils import count_string_tokens
-from playwright.async_api import Error, async_playwright
+from llms.utils import chunk_by_tokens, truncate_to_token_limit
+from playwright.async_api import APIResponse, Error
+
+from .browser_pool import USER_AGENT, BrowserPool
+from .html_to_markdown import html_to_markdown
+from .page_cache import CachedPage, PageCache
 
 
 # Event to signal the completion of PDF download
@@ -36,16 +42,28 @@ except ModuleNotFoundError:
 
 
 class SimpleTextBrowser:
-    """An extremely simple text-based web browser based on Playwright."""
+    """
+    An extremely simple text-based web browser based on Playwright.
+    The pages are opened in the context of `uid` in `pool`, which is shared by the browsers of the tasks,
+    and are served from `page_cache` (if given) while they are fresh.
+    """
 
     def __init__(
         self,
         # start_page: Optional[str] = None,
+        pool: Optional[BrowserPool] = None,
+        uid: str = "default",
+        page_cache: Optional[PageCache] = None,
         viewport_size: Optional[int] = 1024 * 5,
         downloads_folder: Optional[Union[str, None]] = None,
         bing_base_url: str = "https://api.bing.microsoft.com/v7.0/search",
         bing_api_key: Optional[Union[str, None]] = None,
     ):
+        # A browser without a shared pool owns its own, which is closed with the browser.
+        self._owns_pool = pool is None
+        self.pool = pool or BrowserPool(max_pages=1)
+        self.uid = uid
+        self.page_cache = page_cache
         self.start_page: str = "about:blank"
         self.viewport_size = viewport_size
         self.downloads_folder = downloads_folder
@@ -83,78 +101,73 @@ class SimpleTextBrowser:
         self.viewport_current_page = 0
 
     async def _fetch_page(self, url: str) -> None:
+        cached = self.page_cache.get(url) if self.page_cache is not None else None
+        if cached is not None and cached.is_fresh():
+            self._load_cached_page(cached)
+            return
         try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True)
-                context = await browser.new_context()
-                request = context.request
-
-                page = await browser.new_page(
-                    user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
-                )
-
+            async with self.pool.page(self.uid) as page:
+                if cached is not None and cached.validators:
+                    response = await page.context.request.get(
+                        url, headers={"User-Agent": USER_AGENT, **cached.validators}
+                    )
+                    if response.status == 304:
+                        self.page_cache.touch(url, response.headers)
+                        self._load_cached_page(cached)
+                        return
+                    if response.status == 200:
+                        # The page changed, and the response of the revalidation already holds it.
+                        await self._process_response(url, response)
+                        return
                 try:
-                    await page.goto(url, wait_until="networkidle")
+                    response = await page.goto(url, wait_until="networkidle")
                     self.page_title = await page.title()
                     html_content = await page.content()
-                    self._process_html_content(html_content)
+                    await self._process_html_content(html_content)
+                    if response is not None:
+                        self._cache_page(url, html_content.encode(), response.headers, response.status)
                 except Error:
-                    response = await request.get(
-                        url,
-                        headers={
-                            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
-                        },
-                    )
-                    content_type = response.headers.get("content-type", "").lower()
-
-                    if "application/pdf" in content_type and IS_PDF_CAPABLE:
-                        pdf_content = await response.body()
-                        pdf_data = io.BytesIO(pdf_content)
-                        self.page_title = None
-                        self._set_page_content(pdfminer.high_level.extract_text(pdf_data))
-                    else:
-                        html_content = await response.text()
-                        self._process_html_content(html_content)
-
-                await browser.close()
+                    response = await page.context.request.get(url, headers={"User-Agent": USER_AGENT})
+                    await self._process_response(url, response)
         except Exception as e:
             self.page_title = "Error"
             self._set_page_content(str(e))
 
-    def _process_html_content(self, html_content: str) -> None:
-        import markdownify
-        from bs4 import BeautifulSoup
-
-        soup = BeautifulSoup(html_content, "html.parser")
-
-        # Remove javascript and style blocks
-        for script in soup(["script", "style"]):
-            script.extract()
-
-        for img in soup.find_all("img"):
-            if "src" in img.attrs and img.attrs["src"].startswith("data:image"):
-                img.extract()
-
-        if self.history[-1].startswith("https://en.wikipedia.org/"):
-            body_elm = soup.find("div", {"id": "mw-content-text"})
-            title_elm = soup.find("span", {"class": "mw-page-title-main"})
+    async def _process_response(self, url: str, response: APIResponse) -> None:
+        content_type = response.headers.get("content-type", "").lower()
 
-            if body_elm:
-                # What's the title
-                main_title = soup.title.string
-                if title_elm and len(title_elm) > 0:
-                    main_title = title_elm.string
-                webpage_text = "# " + main_title + "\n\n" + markdownify.MarkdownConverter().convert_soup(body_elm)
-            else:
-                webpage_text = markdownify.MarkdownConverter().convert_soup(soup)
+        if "application/pdf" in content_type and IS_PDF_CAPABLE:
+            pdf_content = await response.body()
+            pdf_data = io.BytesIO(pdf_content)
+            self.page_title = None
+            self._set_page_content(pdfminer.high_level.extract_text(pdf_data))
+            self._cache_page(url, pdf_content, response.headers, response.status)
         else:
-            webpage_text = markdownify.MarkdownConverter().convert_soup(soup)
-
-        webpage_text = markdownify.markdownify(str(soup), heading_style="ATX")
-        webpage_text = re.sub(r"\r\n", "\n", webpage_text)
-        webpage_text = re.sub(r"\n{2,}", "\n\n", webpage_text).strip()
-
-        self.page_title = soup.title.string
+            html_content = await response.text()
+            await self._process_html_content(html_content)
+            self._cache_page(url, html_content.encode(), response.headers, response.status)
+
+    async def close(self) -> None:
+        """Close the context of the browser, and its pool if it is not shared."""
+        if self._owns_pool:
+            await self.pool.close()
+        else:
+            await self.pool.close_context(self.uid)
+
+    def _load_cached_page(self, cached: CachedPage) -> None:
+        self.page_title = cached.title
+        self._set_page_content(cached.markdown)
+
+    def _cache_page(self, url: str, raw: bytes, headers: dict, status: int) -> None:
+        if self.page_cache is not None:
+            self.page_cache.put(
+                url, self._page_content, title=self.page_title, raw=raw, headers=headers, status=status
+            )
+
+    async def _process_html_content(self, html_content: str) -> None:
+        # The conversion is CPU-bound, so it runs in a worker thread to keep the event loop responsive.
+        title, webpage_text = await asyncio.to_thread(html_to_markdown, html_content, self.history[-1])
+        self.page_title = title
         self._set_page_content(webpage_text)
 
     def _set_page_content(self, content: str) -> None:
@@ -344,28 +357,15 @@ async def find_next(browser: SimpleTextBrowser):
         return header.strip() + "\n=======================\n" + content
 
 
-async def read_page_and_answer(
-    browser: SimpleTextBrowser,
-    summarization_client: OpenAIChat,
-    question: str,
-    url: str | None = None,
-):
-    if url is not None and url != browser.address:
-        await browser.visit_page(url)
-
-    limit = 32000
+# "truncate" answers from the beginning of the page within the token limit, "map_reduce" summarizes
+# every chunk of the page within the token limit and then answers from the summaries of the chunks.
+PAGE_SUMMARY_MODE = os.getenv("PAGE_SUMMARY_MODE", "truncate") or "truncate"
+PAGE_SUMMARY_TOKEN_LIMIT = int(os.getenv("PAGE_SUMMARY_TOKEN_LIMIT", 32000) or 32000)
+# The maximum number of chunks of a page summarized at the same time in the "map_reduce" mode
+PAGE_SUMMARY_CONCURRENCY = int(os.getenv("PAGE_SUMMARY_CONCURRENCY") or 4)
 
-    buffer = ""
-    for line in re.split(r"([\r\n]+)", browser.page_content):
-        tokens = count_string_tokens(buffer + line, summarization_client.args.model)
-        if tokens + 1024 > limit:  # Leave room for our summary
-            break
-        buffer += line
-
-    buffer = buffer.strip()
-    if len(buffer) == 0:
-        return "Nothing to summarize."
 
+async def _summarize_text(summarization_client: OpenAIChat, text: str, question: str | None) -> str:
     messages = [
         {
             "role": "system",
@@ -373,19 +373,55 @@ async def read_page_and_answer(
         }
     ]
 
-    prompt = f"Please summarize the following into one or two paragraph:\n\n{buffer}"
+    prompt = f"Please summarize the following into one or two paragraph:\n\n{text}"
     if question is not None:
-        prompt = f"Please summarize the following into one or two paragraphs with respect to '{question}':\n\n{buffer}"
+        prompt = f"Please summarize the following into one or two paragraphs with respect to '{question}':\n\n{text}"
 
     messages.append(
         {"role": "user", "content": prompt},
     )
 
+    response = await summarization_client.agenerate_response(history=messages)  # type: ignore[union-attr]
+    return response.content
+
+
+async def read_page_and_answer(
+    browser: SimpleTextBrowser,
+    summarization_client: OpenAIChat,
+    question: str,
+    url: str | None = None,
+):
+    if url is not None and url != browser.address:
+        await browser.visit_page(url)
+
+    model = summarization_client.args.model
+    max_tokens = PAGE_SUMMARY_TOKEN_LIMIT - 1024  # Leave room for our summary
+
     try:
-        response = await summarization_client.agenerate_response(history=messages)  # type: ignore[union-attr]
+        if PAGE_SUMMARY_MODE == "map_reduce":
+            chunks = [c.strip() for c in chunk_by_tokens(browser.page_content, max_tokens, model) if c.strip()]
+            if len(chunks) == 0:
+                return "Nothing to summarize."
+            if len(chunks) == 1:
+                return await _summarize_text(summarization_client, chunks[0], question)
+            semaphore = asyncio.Semaphore(PAGE_SUMMARY_CONCURRENCY)
+
+            async def summarize_chunk(chunk: str) -> str:
+                async with semaphore:
+                    return await _summarize_text(summarization_client, chunk, question)
+
+            summaries = await asyncio.gather(*[summarize_chunk(chunk) for chunk in chunks])
+            combined = "\n\n".join(f"Part {i + 1} of the page:\n{summary}" for i, summary in enumerate(summaries))
+            return await _summarize_text(
+                summarization_client, truncate_to_token_limit(combined, max_tokens, model), question
+            )
+
+        buffer = truncate_to_token_limit(browser.page_content, max_tokens, model).strip()
+        if len(buffer) == 0:
+            return "Nothing to summarize."
+        return await _summarize_text(summarization_client, buffer, question)
     except Exception as e:
         return str(e)
-    return response.content
 
 
 async def summarize_page(
@@ -0,0 +1,121 @@
+"""
+A long-lived Python worker process executing code snippets for the code executor.
+
+It reads one JSON request per line from stdin:
+    {"id": ..., "code": ..., "filename": ..., "cwd": ..., "cpu_time": ..., "max_output": ...}
+and writes JSON lines to its protocol stream while the snippet runs:
+    {"id": ..., "stream": "stdout" | "stderr", "data": ...}
+followed by
+    {"id": ..., "done": true, "success": ...}
+
+The snippets of a worker share the same globals, so later snippets can reuse the variables of earlier ones.
+The modules listed in the PRELOAD_MODULES environment variable (comma separated) are imported at startup.
+"""
+
+import importlib
+import io
+import json
+import math
+import os
+import sys
+import traceback
+
+try:
+    import resource
+except ModuleNotFoundError:  # Windows
+    resource = None
+
+# Keep the original stdout for the protocol, and send the output written directly to the file
+# descriptor 1 (e.g. by subprocesses) to stderr, which the executor reads as raw output.
+protocol = os.fdopen(os.dup(1), "w", buffering=1, encoding="utf-8")
+os.dup2(2, 1)
+sys.stdout = io.TextIOWrapper(os.fdopen(1, "wb", buffering=0), encoding="utf-8", write_through=True)
+
+
+def send(message: dict):
+    protocol.write(json.dumps(message) + "\n")
+    protocol.flush()
+
+
+class StreamWriter(io.TextIOBase):
+    """Forward what the snippet writes to the protocol stream, up to the characters left in `budget`."""
+
+    def __init__(self, request_id, name: str, budget: list[int]):
+        self.request_id = request_id
+        self.name = name
+        self.budget = budget
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: str) -> int:
+        if self.budget[0] > 0 and data:
+            send({"id": self.request_id, "stream": self.name, "data": data[: self.budget[0]]})
+            self.budget[0] -= len(data)
+            if self.budget[0] <= 0:
+                send({"id": self.request_id, "stream": self.name, "data": "\n[output truncated]\n"})
+        return len(data)
+
+
+def set_cpu_limit(cpu_time: float | None):
+    """Limit the CPU time of the snippet. Exceeding it kills the worker with SIGXCPU."""
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if cpu_time is None:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = math.ceil(usage.ru_utime + usage.ru_stime + cpu_time)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def main():
+    for module in filter(None, os.getenv("PRELOAD_MODULES", "").split(",")):
+        try:
+            importlib.import_module(module.strip())
+        except Exception as e:
+            print(f"Failed to preload {module}: {e}", file=sys.stderr)
+    session_globals = {"__name__": "__main__", "__builtins__": __builtins__}
+    send({"ready": True})
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        request_id = request["id"]
+        max_output = request.get("max_output", 100000)
+        real_stdout, real_stderr, real_stdin = sys.stdout, sys.stderr, sys.stdin
+        # Each stream has its own budget, so that a verbose stdout does not hide the errors.
+        sys.stdout = StreamWriter(request_id, "stdout", [max_output])
+        sys.stderr = StreamWriter(request_id, "stderr", [max_output])
+        # The requests are read from stdin, so the snippets must not read it.
+        sys.stdin = io.StringIO("")
+        success = True
+        try:
+            if request.get("cwd"):
+                os.chdir(request["cwd"])
+            # Like `python <filename>` run in the working directory, the directory of the snippet comes first
+            # on sys.path instead of the directory of this script.
+            sys.path[0] = os.path.dirname(os.path.abspath(request.get("filename") or "<string>"))
+            set_cpu_limit(request.get("cpu_time"))
+            session_globals["__file__"] = request.get("filename") or "<string>"
+            exec(compile(request["code"], request.get("filename") or "<string>", "exec"), session_globals)
+        except SystemExit as e:
+            success = e.code in (None, 0)
+        except BaseException:
+            success = False
+            # skip the frame of the worker itself, and report the traceback even if the snippet used up stderr
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            traceback.print_exception(
+                exc_type, exc_value, exc_traceback.tb_next, file=StreamWriter(request_id, "stderr", [max_output])
+            )
+        finally:
+            set_cpu_limit(None)
+            sys.stdout.flush()
+            sys.stdout, sys.stderr, sys.stdin = real_stdout, real_stderr, real_stdin
+        send({"id": request_id, "done": True, "success": success})
+
+
+if __name__ == "__main__":
+    main()
@@ -41,15 +41,26 @@ from server_helper import ServerHelper
 
 from common.config import global_config
 from common.log import logger
-from common.types import CommunicationInfo, CommunicationState, CommunicationType
+from common.types import (
+    AgentRegistryTeamupOutput,
+    CommunicationInfo,
+    CommunicationState,
+    CommunicationType,
+    SessionHeader,
+)
 from common.types.communication import AgentMessage, COMMUNICATION_TYPE_MAP
 from common.types.llm import LLMResult
-from common.utils.database_utils import AutoStoredDict
-from common.utils.milvus_utils import ConfigMilvusWrapper
+from common.utils.database_utils import AutoStoredDict, CachedStoredDict
+from common.utils.vector_store import load_vector_store
 
+from .dispatcher import SessionDispatcher
 from .task_management import TaskEntry, TaskManager, TaskStatus
 from .websocket_client import WebSocketClient
 
+# The maximum number of agents excluded from the discovery on the server. Beyond it, the request grows with the
+# contact list for little gain, and the older contacts are only filtered out locally.
+MAX_EXCLUDED_AGENTS = 100
+
 TEAM_UP_TOOLS = [
     {
         "type": "function",
@@ -111,6 +122,7 @@ class CommunicationLayer:
         agent_type (str): The type of agent ("Human Assistant" or "Thing Assistant").
         tool_agent (AgentAdapter): An optional third-party agent for executing specific tasks.
         server_websocket (WebSocketClient): A WebSocket client for server communication.
+        server_helper (ServerHelper): The pooled HTTP client for the requests to the server.
         support_nested_teams (bool): Whether the agent supports forming nested teams.
         discussion_only (bool): Whether the agent is limited to discussion-only mode.
 
@@ -128,6 +140,7 @@ class CommunicationLayer:
         desc: str,
         agent_type: Literal["Human Assistant", "Thing Assistant"],
         server_websocket: WebSocketClient,
+        server_helper: ServerHelper,
         tool_agent: AgentAdapter | None = None,
         support_nested_teams: bool = False,
         discussion_only: bool = False,
@@ -137,6 +150,7 @@ class CommunicationLayer:
         self.agent_type = agent_type
         self.tool_agent = tool_agent
         self.server_websocket = server_websocket
+        self.server_helper = server_helper
         self.observation_func = observation_registry[global_config["comm"].get("observation_func", "dummy")]
         self.discussion_only = discussion_only
         self.llm = load_llm(deepcopy(global_config["comm"]["llm"]))
@@ -147,25 +161,48 @@ class CommunicationLayer:
             self.system_prompt_template = COMM_THINGAGENT_SYSTEM_PROMPT
 
         agent_db_name = "agent_" + re.sub(r"[^a-zA-Z0-9_]", "_", self.name)
-        self.agent_contact = ConfigMilvusWrapper(
+        self.agent_contact = load_vector_store(
             os.path.join("configs", "vecdb", "agent_contact.yaml"),
             name_modify=agent_db_name,
         )
 
-        self.comm_bank = AutoStoredDict(
-            f"./database/{agent_db_name}/comm.db",
-            tablename="comm_bank",
-            object_type=CommunicationInfo,
-            from_dict_hook=CommunicationInfo_from_dict_hook,
+        # The banks keep the live objects in memory and write them back to SQLite
+        # at the checkpoints (after sending a message) or in the background.
+        cache_config = global_config["comm"].get("cache", {})
+        self.comm_bank = CachedStoredDict(
+            AutoStoredDict(
+                f"./database/{agent_db_name}/comm.db",
+                tablename="comm_bank",
+                object_type=CommunicationInfo,
+                from_dict_hook=CommunicationInfo_from_dict_hook,
+            ),
+            write_policy=cache_config.get("write_policy", "write_back"),
+            flush_interval=cache_config.get("flush_interval", 5),
         )
 
-        self.task_manager_bank = AutoStoredDict(
-            f"./database/{agent_db_name}/comm.db",
-            tablename="task_manager_bank",
-            object_type=TaskManager,
+        self.task_manager_bank = CachedStoredDict(
+            AutoStoredDict(
+                f"./database/{agent_db_name}/comm.db",
+                tablename="task_manager_bank",
+                object_type=TaskManager,
+            ),
+            write_policy=cache_config.get("write_policy", "write_back"),
+            flush_interval=cache_config.get("flush_interval", 5),
         )
         self.support_nested_teams: bool = support_nested_teams  # whether the agent can organize teams (in a hierarchical structure) when assigned a task
 
+        # comm_id -> future resolved with the conclusion of the session, awaited by `launch_goal`
+        self.completions: dict[str, asyncio.Future[str]] = {}
+        # sessions cancelled through `cancel_goal`, whose incoming messages are ignored until relaunched
+        self.cancelled_comm_ids: set[str] = set()
+
+        dispatch_config = global_config["comm"].get("dispatch", {})
+        self.dispatcher = SessionDispatcher(
+            self._handle_message,
+            max_concurrency=dispatch_config.get("max_concurrency"),
+            idle_timeout=dispatch_config.get("idle_timeout", 60),
+        )
+
     @classmethod
     async def create(
         cls,
@@ -176,17 +213,26 @@ class CommunicationLayer:
         support_nested_teams: bool = False,
         discussion_only: bool = False,
     ):
-        await cls.register(name, desc, agent_type)
+        # A single pooled HTTP client is shared by all the requests to the server
+        server_helper = ServerHelper(global_config["comm"].get("http", {}))
+        await cls.register(name, desc, agent_type, server_helper)
         server_websocket = await cls.register_websocket(name)
+        rpc_config = global_config["comm"].get("rpc", {})
+        if rpc_config.get("enabled", True):
+            # The later requests to the server go over the agent websocket, whose responses are read by `_listen_message`
+            server_helper.use_websocket(server_websocket, timeout=rpc_config.get("timeout", 30))
         layer = cls(
             name,
             desc,
             agent_type,
             server_websocket,
+            server_helper,
             tool_agent,
             support_nested_teams,
             discussion_only,
         )
+        layer.comm_bank.start()
+        layer.task_manager_bank.start()
         asyncio.get_event_loop().create_task(layer._listen_message())
         return layer
 
@@ -196,8 +242,9 @@ class CommunicationLayer:
         name: str,
         desc: str,
         agent_type: Literal["Human Assistant", "Thing Assistant"],
+        server_helper: ServerHelper,
     ):
-        await ServerHelper.register(name, desc, agent_type)
+        await server_helper.register(name, desc, agent_type)
 
     @classmethod
     async def register_websocket(cls, name: str):
@@ -206,7 +253,12 @@ class CommunicationLayer:
         uri = f"ws://{hostname}:{port}/ws/{name}"
         # encode the uri
         uri = urllib.parse.quote(uri, safe=":/?&=,.")
-        websocket = WebSocketClient(uri)
+        websocket_config = global_config["comm"].get("websocket", {})
+        websocket = WebSocketClient(
+            uri,
+            wire_format=websocket_config.get("wire_format", "json"),
+            compression=websocket_config.get("compression", "deflate"),
+        )
         await websocket.connect()
         return websocket
 
@@ -221,6 +273,7 @@ class CommunicationLayer:
         obs_kwargs: dict = {},
         max_turns: int | None = None,
         skip_naming: bool = True,
+        timeout: float | None = None,
     ) -> Tuple[str, str]:
         """
         Launch a group chat targetted on the given goal.
@@ -236,6 +289,7 @@ class CommunicationLayer:
             obs_kwargs (dict, optional): The observation arguments. Defaults to {}.
             max_turns (int, optional): The maximum turns of the chat session. Defaults to None.
             skip_naming (bool, optional): Whether to skip the naming of the team. Defaults to True.
+            timeout (float, optional): The seconds to wait for the conclusion. Defaults to None (no limit).
         Returns:
             Tuple[str, str]: The id of the chat session and the conclusion of the chat session.
         """
@@ -252,6 +306,7 @@ class CommunicationLayer:
                 max_turns=max_turns,
                 skip_naming=skip_naming,
             )
+            completion = self._get_completion(comm_id)
         else:
             # continue the previous discussion
             if comm_id not in self.comm_bank:
@@ -260,6 +315,8 @@ class CommunicationLayer:
             comm_info.conclusion = None
             comm_info.max_turns = max_turns
             self.comm_bank[comm_id] = comm_info
+            self.cancelled_comm_ids.discard(comm_id)
+            completion = self._get_completion(comm_id)
             if cont_input is not None:
                 # if the continuation message is provided, then send the message to all the team members.
                 # and randomly assign the next speaker.
@@ -270,9 +327,8 @@ class CommunicationLayer:
                     next_speaker=random.choice([t["name"] for t in comm_info.team_members]),
                     state=CommunicationState.DISCUSSION,
                     type=CommunicationType.DISCUSSION,
-                    goal=comm_info.goal,
-                    team_members=comm_info.team_members,
                     team_up_depth=comm_info.team_up_depth,
+                    **self._session_header_fields(comm_info),
                     is_collaborative_planning_enabled=comm_info.is_collaborative_planning_enabled,
                 )
                 self.comm_bank[comm_id] = comm_info
@@ -286,13 +342,40 @@ class CommunicationLayer:
                 max_turns=max_turns,
             )
 
-        # check the conclusion field in polling
-        while True:
+        # The future is resolved when the conclusion is recorded. It is shielded so that a timeout
+        # or a cancelled request does not cancel it for the other waiters of the same session.
+        try:
+            return comm_id, await asyncio.wait_for(asyncio.shield(completion), timeout)
+        except asyncio.TimeoutError:
+            return comm_id, f"The communication session {comm_id} did not conclude within {timeout} seconds."
+
+    def _get_completion(self, comm_id: str) -> asyncio.Future[str]:
+        """Return the pending completion future of `comm_id`, creating it if needed."""
+        completion = self.completions.get(comm_id)
+        if completion is None or completion.done():
+            completion = asyncio.get_event_loop().create_future()
+            self.completions[comm_id] = completion
             conclusion = self.comm_bank[comm_id].conclusion
-            if conclusion is None:
-                await asyncio.sleep(5)
-            else:
-                return comm_id, conclusion
+            if conclusion is not None:
+                completion.set_result(conclusion)
+        return completion
+
+    def _resolve_completion(self, comm_id: str, conclusion: str):
+        """Wake up the `launch_goal` calls waiting for the conclusion of `comm_id`."""
+        completion = self.completions.pop(comm_id, None)
+        if completion is not None and not completion.done():
+            completion.set_result(conclusion)
+
+    def cancel_goal(self, comm_id: str) -> bool:
+        """
+        Stop waiting for the conclusion of `comm_id` and ignore the further messages of the session,
+        until it is continued with `launch_goal`. Returns whether the session exists.
+        """
+        if comm_id not in self.comm_bank:
+            return False
+        self.cancelled_comm_ids.add(comm_id)
+        self._resolve_completion(comm_id, f"The communication session {comm_id} was cancelled.")
+        return True
 
     async def _naming_team(self, goal: str, team_members: list[str] = []) -> str:
         prepend_prompt = [
@@ -315,19 +398,20 @@ class CommunicationLayer:
         tool_call: ChatCompletionMessageToolCall,
         goal: str,
         skip_naming: bool = True,
-    ) -> Tuple[bool, LLMResult, str, list[str]]:
+    ) -> Tuple[bool, LLMResult, AgentRegistryTeamupOutput, list[dict]]:
         tool_name = tool_call.function.name
         tool_input = tool_call.function.arguments
         tool_call_id = tool_call.id
         match tool_name:
             case "agent_discovery":
                 try:
-                    agent_infos = await ServerHelper.retrieve_assistant(self.name, tool_input["queries"])
-                    # deduplicate agent_infos compared with self.agent_contact
-                    new_agents_retrieved = []
-                    for agent in agent_infos:
-                        if agent.get("name") != self.name and agent.get("name") not in self.agent_contact:
-                            new_agents_retrieved.append(agent)
+                    # the agent itself and the most recent contacts are excluded on the server
+                    known_agents = {self.name, *self.agent_contact.keys()}
+                    recent_contacts = list(self.agent_contact.keys())[-(MAX_EXCLUDED_AGENTS - 1) :]
+                    agent_infos = await self.server_helper.retrieve_assistant(
+                        self.name, tool_input["queries"], exclude=list({self.name, *recent_contacts})
+                    )
+                    new_agents_retrieved = [agent for agent in agent_infos if agent.get("name") not in known_agents]
 
                 except Exception as e:
                     logger.error(e)
@@ -344,22 +428,23 @@ class CommunicationLayer:
                 )
                 logger.log_llm_result(result)
                 # TODO: update the contact list.
-                for agent in agent_infos:
-                    if agent["name"] not in self.agent_contact and agent["name"] != self.name:
-                        self.agent_contact[agent["name"]] = agent
+                for agent in new_agents_retrieved:
+                    self.agent_contact[agent["name"]] = agent
                 return False, result, None, None
             case "team_up":
                 try:
                     team_member_names = tool_input["team_members"]
-                    team_members = await ServerHelper.query_assistant(team_member_names)
+                    team_members = await self.server_helper.query_assistant(team_member_names)
                     team_name = None
                     if not skip_naming:
                         team_name = await self._naming_team(goal, team_members)
 
-                    team_info = await ServerHelper.teamup(
+                    team_info = await self.server_helper.teamup(
                         sender=self.name,
                         agent_names=[agent_name for agent_name in team_member_names if agent_name != self.name],
                         team_name=team_name,
+                        goal=goal,
+                        team_members=team_members,
                     )
 
                     result = LLMResult(
@@ -369,7 +454,7 @@ class CommunicationLayer:
                         role="tool",
                     )
                     logger.log_llm_result(result)
-                    return True, result, team_info.comm_id, team_members
+                    return True, result, team_info, team_members
                 except Exception as e:
                     logger.error(e)
                     result = LLMResult(
@@ -389,7 +474,7 @@ class CommunicationLayer:
         obs_kwargs: dict = {},
         skip_naming: bool = True,
         is_last_attempt: bool = False,
-    ) -> Tuple[bool, str, list[str]]:
+    ) -> Tuple[bool, AgentRegistryTeamupOutput, list[dict]]:
         """
         Let the agent decide whether to search for more relevent agents on the server or to team up.
         """
@@ -427,18 +512,18 @@ class CommunicationLayer:
         memory.add_messages(response)
 
         finished = False
-        comm_id = None
+        team_info = None
         team_members = None
         if response.parsed_tool_calls:
             for i, tool_call in enumerate(response.parsed_tool_calls):
-                finished, tool_response, comm_id, team_members = await self._call_teamup_tool(
+                finished, tool_response, team_info, team_members = await self._call_teamup_tool(
                     tool_call, goal, skip_naming
                 )
                 if tool_response is not None:
                     memory.add_messages(tool_response)
                 if finished:
                     break
-        return finished, comm_id, team_members
+        return finished, team_info, team_members
 
     async def team_up(
         self,
@@ -464,7 +549,7 @@ class CommunicationLayer:
         if team_member_names is not None:
             # if the team members have been specified
             # difrectly create a group chat for them
-            agents_upated_for_contact = await ServerHelper.query_assistant(team_member_names)
+            agents_upated_for_contact = await self.server_helper.query_assistant(team_member_names)
             team_members = []
             for item in agents_upated_for_contact:
                 if isinstance(item, dict) and item.get("name") != self.name:
@@ -476,31 +561,33 @@ class CommunicationLayer:
             if not skip_naming:
                 team_name = await self._naming_team(goal, team_members)
 
-            team_info = await ServerHelper.teamup(
+            team_members.append({"name": self.name, "type": self.agent_type, "desc": self.desc})
+            team_info = await self.server_helper.teamup(
                 sender=self.name,
                 agent_names=[name for name in team_member_names if name != self.name],
                 team_name=team_name,
+                goal=goal,
+                team_members=team_members,
             )
-            team_members.append({"name": self.name, "type": self.agent_type, "desc": self.desc})
-            comm_id = team_info.comm_id
         else:
             # if the team members are not specified, let the agent itself
             # search for the agents on the server, and decide who to teamup with
             memory = ChatHistoryMemory()
-            comm_id = None
+            team_info = None
             local_contact = self.agent_contact.items()
             for i in range(global_config["comm"]["max_team_up_attempts"]):
                 is_last_attempt = i == global_config["comm"]["max_team_up_attempts"] - 1
-                finished, comm_id, team_members = await self._discover_and_teamup(
+                finished, team_info, team_members = await self._discover_and_teamup(
                     goal, local_contact, memory, obs_kwargs, skip_naming, is_last_attempt=is_last_attempt
                 )
 
                 if finished:
                     break
 
-        if comm_id is None:
+        if team_info is None:
             raise ValueError("Failed to decide the teammates.")
 
+        comm_id = team_info.comm_id
         self.comm_bank[comm_id] = CommunicationInfo(
             comm_id=comm_id,
             goal=goal,
@@ -509,11 +596,60 @@ class CommunicationLayer:
             team_up_depth=team_up_depth,
             is_collaborative_planning_enabled=is_collaborative_planning_enabled,
             max_turns=max_turns,
+            header_version=team_info.header_version,
         )
         self.task_manager_bank[comm_id] = TaskManager(comm_id)
 
         return comm_id
 
+    def _session_header_fields(self, comm_info: CommunicationInfo) -> dict:
+        """
+        The fields of a message describing its session. Once the server stores the header of the session,
+        the messages carry only its version instead of the goal and the team members, except the first message
+        of the session, so that the members learn the header without fetching it.
+        """
+        if comm_info.header_version is None:
+            return {"goal": comm_info.goal, "team_members": comm_info.team_members}
+        if len(comm_info.memory) == 0:
+            return {
+                "header_version": comm_info.header_version,
+                "goal": comm_info.goal,
+                "team_members": comm_info.team_members,
+            }
+        return {"header_version": comm_info.header_version}
+
+    async def _get_session_header(self, message: AgentMessage) -> SessionHeader:
+        """
+        Get the header of the session of the message. Messages carrying the goal and the team members
+        (those without a header version, and the first message of a session) are used as is, otherwise
+        the header is fetched from the server, and cached in the communication info of the session until
+        a message with a newer version arrives.
+
+        If the header cannot be fetched, the fields of the message are used with the version 0, so that the
+        message is still handled and the header is fetched again with the next message of the session.
+        """
+        if message.header_version is None or (message.goal is not None and message.team_members is not None):
+            return SessionHeader(
+                comm_id=message.comm_id,
+                version=message.header_version or 0,
+                goal=message.goal,
+                team_members=message.team_members or [],
+            )
+        try:
+            header = await self.server_helper.fetch_session_header(message.comm_id)
+        except Exception as e:
+            logger.error(f"Failed to fetch the header of the session {message.comm_id}. {e}")
+            header = None
+        if header is None:
+            logger.error(f"Failed to get the header of the session {message.comm_id}, using the fields of the message.")
+            return SessionHeader(
+                comm_id=message.comm_id,
+                version=0,
+                goal=message.goal,
+                team_members=message.team_members or [],
+            )
+        return header
+
     def _update_memory_and_task_manager(self, new_message: AgentMessage, comm_id: str):
         """
         Update chat history and task manager
@@ -558,6 +694,7 @@ class CommunicationLayer:
             comm_info.conclusion = new_message.content
             comm_info.curr_turn = 0
             self.comm_bank[comm_id] = comm_info
+            self._resolve_completion(comm_id, comm_info.conclusion)
         if new_message.type in [
             CommunicationType.DISCUSSION,
             CommunicationType.ASYNC_TASK_ASSIGNMENT,
@@ -594,18 +731,33 @@ class CommunicationLayer:
         if new_message and new_message.state != CommunicationState.DISCUSSION:
             logger.error("Receiving a message with a state that is not DISCUSSION.")
             return
+        if comm_id in self.cancelled_comm_ids:
+            return
         if comm_id not in self.comm_bank:
+            header = await self._get_session_header(new_message)
             self.comm_bank[comm_id] = CommunicationInfo(
                 comm_id=comm_id,
-                goal=new_message.goal,
-                team_members=new_message.team_members,
+                goal=header.goal or "",
+                team_members=header.team_members,
                 memory=ChatHistoryMemory(),  # TODO: configurable
                 state=new_message.state,
                 team_up_depth=new_message.team_up_depth,
                 is_collaborative_planning_enabled=new_message.is_collaborative_planning_enabled,
                 max_turns=max_turns,
+                header_version=header.version if new_message.header_version is not None else None,
             )
             self.task_manager_bank[comm_id] = TaskManager(comm_id)
+        elif new_message is not None and (new_message.header_version or 0) > (
+            self.comm_bank[comm_id].header_version or 0
+        ):
+            # The header of the session has changed since it was cached.
+            header = await self._get_session_header(new_message)
+            if header.version > 0:
+                comm_info = self.comm_bank[comm_id]
+                comm_info.goal = header.goal or comm_info.goal
+                comm_info.team_members = header.team_members or comm_info.team_members
+                comm_info.header_version = header.version
+                self.comm_bank[comm_id] = comm_info
 
         if new_message is None:
             # This agent is the first speaker.
@@ -775,9 +927,8 @@ class CommunicationLayer:
             next_speaker="" if trigger_set else [self.name],
             state=CommunicationState.DISCUSSION,
             type=CommunicationType.PAUSE if trigger_set else CommunicationType.DISCUSSION,
-            goal=comm_info.goal,
-            team_members=comm_info.team_members,
             team_up_depth=comm_info.team_up_depth,
+            **self._session_header_fields(comm_info),
             triggers=selected_task_ids if trigger_set else [],
             updated_plan=updated_plan,
             is_collaborative_planning_enabled=comm_info.is_collaborative_planning_enabled,
@@ -792,7 +943,7 @@ class CommunicationLayer:
         prepend_prompt, collaborative_management_msgs, append_prompt = self._get_discussion_prompt(comm_id, obs_kwargs)
 
         max_turns = comm_info.max_turns
-        curr_turn = len(await comm_info.memory.to_messages())
+        curr_turn = len(comm_info.memory)
         if max_turns is not None and curr_turn >= max_turns:
             append_prompt.append(
                 "The discussion has reached the maximum turns. Now you must send a message with type `conclude_group_discussion` anyway."
@@ -867,9 +1018,8 @@ class CommunicationLayer:
                 next_speaker=next_speakers,
                 state=CommunicationState.DISCUSSION,
                 type=message_type,
-                goal=comm_info.goal,
-                team_members=comm_info.team_members,
                 team_up_depth=comm_info.team_up_depth,
+                **self._session_header_fields(comm_info),
                 updated_plan=updated_plan,
                 is_collaborative_planning_enabled=comm_info.is_collaborative_planning_enabled,
                 max_turns=max_turns,
@@ -951,9 +1101,8 @@ class CommunicationLayer:
             next_speaker=parsed_response["next_speaker"],
             state=CommunicationState.DISCUSSION,
             type=CommunicationType.INFORM_TASK_PROGRESS,
-            goal=comm_info.goal,
             team_up_depth=comm_info.team_up_depth,
-            team_members=comm_info.team_members,
+            **self._session_header_fields(comm_info),
             task_id=task_id,
             task_desc=task_desc,
             task_abstract=task_abstract,
@@ -1444,7 +1593,8 @@ class CommunicationLayer:
         append_prompt = [Template(COMM_CONCLUDE_APPEND_PROMPT).safe_substitute({"goal": comm_info.goal})]
         history = await comm_info.memory.to_messages()
         if len(history) > 0:
-            history[0]["content"] = "The history of the GROUP DISCUSSION:\n" + history[0]["content"]
+            # the message dicts are cached by the memory, so the first one is replaced instead of modified
+            history[0] = {**history[0], "content": "The history of the GROUP DISCUSSION:\n" + history[0]["content"]}
         response: LLMResult = await self.llm.agenerate_response(
             history=history,
             append_prompt=append_prompt,
@@ -1470,28 +1620,42 @@ class CommunicationLayer:
         comm_info.curr_turn = 0
         self.comm_bank[comm_id] = comm_info
         await self._send_message(message_to_send)
+        self._resolve_completion(comm_id, comm_info.conclusion)
+
+    def _checkpoint(self, comm_id: str):
+        """Write the cached session state of `comm_id` back to the database."""
+        self.comm_bank.flush([comm_id])
+        self.task_manager_bank.flush([comm_id])
 
     async def _send_message(self, payload: AgentMessage):
         """Send a message to the chat session."""
+        self._checkpoint(payload.comm_id)
         try:
-            await self.server_websocket.send_message(payload.model_dump_json())
+            await self.server_websocket.send_message(payload)
         except Exception as e:
             logger.error(f"Failed to send the message. {e}")
             return {"status": "failed", "message": str(e)}
         return {"status": "success"}
 
     async def _listen_message(self):
+        """Read the incoming messages and hand them over to the per-session workers of the dispatcher."""
         while True:
             message = await self.server_websocket.receive_message()
-            comm_id = message.comm_id
             logger.info(f"Received message: {str(message)}")
-            match message.state:
-                case CommunicationState.DISCUSSION | CommunicationState.VOTE:
-                    await self.coordination(message, comm_id, max_turns=message.max_turns)
-                # TODO: complete execution cases
-                case _:
-                    logger.error(f"Unknown state: {message.state}")
+            self.dispatcher.dispatch(message)
+
+    async def _handle_message(self, message: AgentMessage):
+        match message.state:
+            case CommunicationState.DISCUSSION | CommunicationState.VOTE:
+                await self.coordination(message, message.comm_id, max_turns=message.max_turns)
+            # TODO: complete execution cases
+            case _:
+                logger.error(f"Unknown state: {message.state}")
 
     async def shutdown(self):
+        await self.dispatcher.close()
+        await self.comm_bank.close()
+        await self.task_manager_bank.close()
+        await self.server_helper.close()
         if self.tool_agent is not None:
             await self.tool_agent.shutdown()
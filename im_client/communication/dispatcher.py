@@ -0,0 +1,109 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from common.log import logger
+from common.types import AgentMessage
+
+
+class SessionDispatcher:
+    """
+    Dispatch the received messages to one serial worker per chat session.
+
+    The messages of a session are handled one at a time and in the order they are received,
+    while different sessions are handled concurrently, so a long LLM call in one session never
+    stops the client from reading the messages of the other sessions. A worker exits once its
+    queue has been idle for `idle_timeout` seconds and is recreated by the next message.
+
+    Note that a handler may wait for other sessions, e.g. a synchronous task assignment launching
+    a nested team. With `max_concurrency` set, the nested sessions need a free slot to conclude,
+    so the cap should be well above the depth of nested team-ups, or left unbounded.
+
+    Args:
+        handler (Callable[[AgentMessage], Awaitable]): The coroutine function handling a message.
+        max_concurrency (int | None, optional): The maximum number of messages handled at the same time
+            across all the sessions. Defaults to None (unbounded).
+        idle_timeout (float, optional): Seconds after which an idle worker exits. Defaults to 60.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[AgentMessage], Awaitable],
+        max_concurrency: int | None = None,
+        idle_timeout: float = 60,
+    ):
+        self.handler = handler
+        self.idle_timeout = idle_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.queues: dict[str, asyncio.Queue[AgentMessage]] = {}
+        self.workers: dict[str, asyncio.Task] = {}
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+
+    def dispatch(self, message: AgentMessage):
+        """Enqueue the message to the worker of its session without waiting."""
+        comm_id = message.comm_id
+        if comm_id not in self.queues:
+            self.queues[comm_id] = asyncio.Queue()
+            self.workers[comm_id] = asyncio.get_event_loop().create_task(self._work(comm_id))
+        queue = self.queues[comm_id]
+        queue.put_nowait(message)
+        self.max_queue_depth = max(self.max_queue_depth, queue.qsize())
+
+    async def _next_message(self, queue: asyncio.Queue[AgentMessage]) -> AgentMessage | None:
+        """
+        Wait for the next message of the queue, or return None after `idle_timeout` seconds.
+
+        Unlike asyncio.wait_for before Python 3.12, a message arriving as the timeout fires is never lost:
+        the get is cancelled before it takes the message out of the queue, which then still holds it.
+        """
+        get = asyncio.ensure_future(queue.get())
+        try:
+            done, _ = await asyncio.wait({get}, timeout=self.idle_timeout)
+        finally:
+            if not get.done():
+                get.cancel()
+        return get.result() if done else None
+
+    async def _work(self, comm_id: str):
+        queue = self.queues[comm_id]
+        while True:
+            message = await self._next_message(queue)
+            if message is None:
+                # No await between the check and the removal, so no message can be enqueued in between.
+                if queue.empty():
+                    del self.queues[comm_id]
+                    del self.workers[comm_id]
+                    return
+                continue
+            if self.semaphore is not None:
+                await self.semaphore.acquire()
+            self.running += 1
+            try:
+                await self.handler(message)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Failed to handle the message of {comm_id}. {e}")
+            finally:
+                self.running -= 1
+                if self.semaphore is not None:
+                    self.semaphore.release()
+
+    async def close(self):
+        for worker in self.workers.values():
+            worker.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.queues.clear()
+        self.workers.clear()
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.queues),
+            "running": self.running,
+            "processed": self.processed,
+            "failed": self.failed,
+            "max_queue_depth": self.max_queue_depth,
+            "queue_depth": {comm_id: queue.qsize() for comm_id, queue in self.queues.items()},
+        }
@@ -1,33 +1,86 @@
 from pydantic import ValidationError
 import websockets
 import asyncio
+import json
+import uuid
+from typing import Any, Literal
 
 # import logging
 from common.log import logger
-from common.types import AgentMessage
+from common.types import AGENT_MESSAGE_DEFAULTS, RPC_FRAME_PREFIX, AgentMessage, RPCRequest, RPCResponse
+from common.utils.wire_format import WireDecoder, WireEncoder, WireFormat, offered_subprotocols, parse_subprotocol
 from websockets.client import WebSocketClientProtocol
 from websockets.exceptions import ConnectionClosed
 
 
+class RPCError(Exception):
+    """The server failed to serve an RPC request."""
+
+
+class RPCNotSentError(Exception):
+    """The RPC request could not be sent, so it was never handled by the server."""
+
+
+class RPCConnectionLostError(Exception):
+    """The connection closed after the RPC request was sent, so the server may or may not have handled it."""
+
+
 class WebSocketClient:
-    def __init__(self, uri):
+    """
+    The websocket connection of an agent to the server.
+
+    Args:
+        uri (str): The URI of the websocket endpoint, e.g. "ws://localhost:8000/ws/agent".
+        wire_format (WireFormat, optional): The format of the messages. "msgpack" is used only if the server
+            accepts it when connecting, otherwise the messages are sent as JSON text frames. Defaults to "json".
+        compression (Literal["deflate", "none"], optional): Whether to negotiate the permessage-deflate
+            extension, which compresses every frame of the connection with a shared context. Defaults to "deflate".
+    """
+
+    def __init__(self, uri, wire_format: WireFormat = "json", compression: Literal["deflate", "none"] = "deflate"):
         self.uri = uri  # "ws://localhost:8000/ws"
         self.websocket: WebSocketClientProtocol = None
+        self.subprotocols = offered_subprotocols(wire_format)
+        self.compression = "deflate" if compression == "deflate" else None
+        # The codecs of the binary wire format are stateful, so they are reset on every connection,
+        # and the messages are encoded and sent one at a time.
+        self.encoder: WireEncoder | None = None
+        self.decoder: WireDecoder | None = None
+        self.send_lock = asyncio.Lock()
+        # correlation id -> future resolved with the response of the RPC request
+        self.pending_rpcs: dict[str, asyncio.Future[RPCResponse]] = {}
 
     async def connect(self):
+        # The responses to the requests sent on the previous connection will never arrive.
+        self._fail_pending_rpcs("The websocket reconnected before the response arrived.")
         try:
-            self.websocket: WebSocketClientProtocol = await websockets.connect(self.uri, ping_timeout=None)
+            self.websocket: WebSocketClientProtocol = await websockets.connect(
+                self.uri,
+                ping_timeout=None,
+                subprotocols=self.subprotocols or None,
+                compression=self.compression,
+            )
+            if parse_subprotocol(self.websocket.subprotocol) == "msgpack":
+                self.encoder, self.decoder = WireEncoder(AGENT_MESSAGE_DEFAULTS), WireDecoder(AGENT_MESSAGE_DEFAULTS)
+            else:
+                self.encoder, self.decoder = None, None
         except Exception as e:
             print(f"Websocket connection error: {e}")
 
-    async def send_message(self, message: AgentMessage):
+    def _encode(self, message: AgentMessage | str) -> str | bytes:
+        if self.encoder is None:
+            return message if isinstance(message, str) else message.model_dump_json()
+        return self.encoder.encode(message.model_dump(mode="json") if isinstance(message, AgentMessage) else json.loads(message))
+
+    async def send_message(self, message: AgentMessage | str):
         max_retries = 3
         retries = 0
 
         while retries < max_retries:
             if self.websocket and self.websocket.open:
                 try:
-                    await self.websocket.send(message)
+                    async with self.send_lock:
+                        await self.websocket.send(self._encode(message))
                     break
 
                 except ConnectionClosed as e:
@@ -52,10 +105,16 @@ class WebSocketClient:
             if self.websocket and self.websocket.open:
                 try:
                     message = await self.websocket.recv()
+                    if isinstance(message, bytes):
+                        return AgentMessage.model_validate(self.decoder.decode(message))
+                    if message.startswith(RPC_FRAME_PREFIX):
+                        self._resolve_rpc(message)
+                        continue
                     message = AgentMessage.model_validate_json(message)
                     return message
                 except (ConnectionClosed, RuntimeError) as e:
                     logger.error(e)
+                    self._fail_pending_rpcs(f"The websocket closed before the response arrived. {e}")
                     retries += 1
                     await asyncio.sleep(3)
                 except (ValidationError, Exception) as e:
@@ -70,5 +129,59 @@ class WebSocketClient:
         if retries >= max_retries:
             print("Failed to receive message after several attempts.")
 
+    async def call(self, method: str, params: dict, timeout: float = 30) -> Any:
+        """
+        Call a method of the server over the WebSocket. The response is read by `receive_message`,
+        so the messages must be listened to while calling.
+
+        Args:
+            method (str): The name of the method, e.g. "teamup".
+            params (dict): The parameters of the method.
+            timeout (float, optional): Seconds to wait for the response. Defaults to 30.
+
+        Raises:
+            RPCNotSentError: If the WebSocket is not connected or the request could not be sent.
+            RPCError: If the server failed to serve the request.
+            RPCConnectionLostError: If the connection closed before the response arrived.
+            asyncio.TimeoutError: If no response arrived in time.
+
+        Returns:
+            Any: The result of the method, decoded from JSON.
+        """
+        if not (self.websocket and self.websocket.open):
+            raise RPCNotSentError("The websocket is not connected.")
+        request = RPCRequest(rpc=method, id=uuid.uuid4().hex, params=params)
+        future = asyncio.get_event_loop().create_future()
+        self.pending_rpcs[request.id] = future
+        try:
+            try:
+                # Sent under the lock like the messages, as the frames of the binary format must stay in order.
+                async with self.send_lock:
+                    await self.websocket.send(request.model_dump_json())
+            except ConnectionClosed as e:
+                raise RPCNotSentError(str(e)) from e
+            response = await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending_rpcs.pop(request.id, None)
+        if response.error is not None:
+            raise RPCError(response.error)
+        return response.result
+
+    def _resolve_rpc(self, frame: str):
+        try:
+            response = RPCResponse.model_validate_json(frame)
+        except ValidationError:
+            logger.error(f"Failed to parse the RPC response: {frame}")
+            return
+        future = self.pending_rpcs.get(response.id)
+        if future is not None and not future.done():
+            future.set_result(response)
+
+    def _fail_pending_rpcs(self, reason: str):
+        for future in self.pending_rpcs.values():
+            if not future.done():
+                future.set_exception(RPCConnectionLostError(reason))
+
     async def close(self):
+        self._fail_pending_rpcs("The websocket was closed before the response arrived.")
         await self.websocket.close()
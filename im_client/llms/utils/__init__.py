@@ -1,2 +1,10 @@
 from .jsonrepair import JsonRepair
-from .token_counter import count_string_tokens, count_message_tokens
+from .token_counter import (
+    chunk_by_tokens,
+    count_message_tokens,
+    count_string_tokens,
+    count_tokens_batch,
+    encode_batch,
+    get_tokenizer,
+    truncate_to_token_limit,
+)
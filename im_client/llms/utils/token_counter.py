@@ -1,19 +1,126 @@
 # Modified from AutoGPT https://github.com/Significant-Gravitas/AutoGPT/blob/release-v0.4.7/autogpt/llm/utils/token_counter.py
 
-import tiktoken
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from typing import List, Union, Dict
+
+import tiktoken
 from common.log import logger
 from llms import LOCAL_LLMS, LOCAL_LLMS_MAPPING
 
 
-def count_string_tokens(prompt: str = "", model: str = "gpt-3.5-turbo") -> int:
-    if model.startswith("gpt-3.5-turbo") or model.startswith("gpt-4"):
-        return len(tiktoken.encoding_for_model(model).encode(prompt))
-    elif model.lower() in LOCAL_LLMS or model in LOCAL_LLMS:
+class Tokenizer:
+    """Uniform interface over the tiktoken encodings and the Hugging Face tokenizers."""
+
+    def __init__(self, name: str, encoding):
+        self.name = name
+        self.encoding = encoding
+        self.is_tiktoken = isinstance(encoding, tiktoken.Encoding)
+
+    def encode(self, text: str) -> List[int]:
+        if self.is_tiktoken:
+            return self.encoding.encode(text, disallowed_special=())
+        return self.encoding.encode(text, add_special_tokens=False)
+
+    def encode_batch(self, texts: List[str]) -> List[List[int]]:
+        if self.is_tiktoken:
+            return self.encoding.encode_batch(texts, disallowed_special=())
+        return self.encoding(texts, add_special_tokens=False)["input_ids"]
+
+    def decode(self, tokens: List[int]) -> str:
+        return self.encoding.decode(tokens)
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model: str = "gpt-3.5-turbo") -> Tokenizer:
+    """
+    Return the tokenizer of `model`, loaded once per process. The models unknown to tiktoken
+    fall back to the cl100k_base encoding.
+    """
+    if model.lower() in LOCAL_LLMS or model in LOCAL_LLMS:
         from transformers import AutoTokenizer
 
-        encoding = AutoTokenizer.from_pretrained(LOCAL_LLMS_MAPPING[model.lower()])
-        return len(encoding.encode(prompt))
+        name = LOCAL_LLMS_MAPPING[model.lower()]
+        return Tokenizer(name, AutoTokenizer.from_pretrained(name))
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        logger.warn(f"Warning: model {model} not found. Using cl100k_base encoding.")
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return Tokenizer(encoding.name, encoding)
+
+
+class TokenCountCache:
+    """
+    LRU cache of token counts, keyed by (tokenizer, hash of the text, length of the text)
+    so that the cached texts themselves are not kept alive.
+    """
+
+    def __init__(self, maxsize: int = 65536):
+        self.maxsize = maxsize
+        self.counts: OrderedDict[tuple, int] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> int | None:
+        with self.lock:
+            count = self.counts.get(key)
+            if count is not None:
+                self.counts.move_to_end(key)
+            return count
+
+    def put(self, key: tuple, count: int):
+        with self.lock:
+            self.counts[key] = count
+            self.counts.move_to_end(key)
+            if len(self.counts) > self.maxsize:
+                self.counts.popitem(last=False)
+
+
+_token_count_cache = TokenCountCache()
+
+
+def encode_batch(texts: List[str], model: str = "gpt-3.5-turbo") -> List[List[int]]:
+    return get_tokenizer(model).encode_batch(texts)
+
+
+def count_tokens_batch(texts: List[str], model: str = "gpt-3.5-turbo") -> List[int]:
+    """Count the tokens of several texts, encoding the ones missed by the cache in one batch."""
+    tokenizer = get_tokenizer(model)
+    keys = [(tokenizer.name, hash(text), len(text)) for text in texts]
+    counts = [_token_count_cache.get(key) for key in keys]
+    missed = [i for i, count in enumerate(counts) if count is None]
+    if missed:
+        for i, tokens in zip(missed, tokenizer.encode_batch([texts[i] for i in missed])):
+            counts[i] = len(tokens)
+            _token_count_cache.put(keys[i], counts[i])
+    return counts
+
+
+def count_string_tokens(prompt: str = "", model: str = "gpt-3.5-turbo") -> int:
+    tokenizer = get_tokenizer(model)
+    key = (tokenizer.name, hash(prompt), len(prompt))
+    count = _token_count_cache.get(key)
+    if count is None:
+        count = len(tokenizer.encode(prompt))
+        _token_count_cache.put(key, count)
+    return count
+
+
+def truncate_to_token_limit(text: str, max_tokens: int, model: str = "gpt-3.5-turbo") -> str:
+    """Return the longest prefix of `text` within `max_tokens` tokens, tokenizing the text only once."""
+    tokenizer = get_tokenizer(model)
+    tokens = tokenizer.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return tokenizer.decode(tokens[: max(max_tokens, 0)])
+
+
+def chunk_by_tokens(text: str, max_tokens: int, model: str = "gpt-3.5-turbo") -> List[str]:
+    """Split `text` into consecutive chunks of at most `max_tokens` tokens, tokenizing the text only once."""
+    tokenizer = get_tokenizer(model)
+    tokens = tokenizer.encode(text)
+    return [tokenizer.decode(tokens[i : i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
 
 
 def count_message_tokens(messages: Union[Dict, List[Dict]], model: str = "gpt-3.5-turbo") -> int:
@@ -29,21 +136,15 @@ def count_message_tokens(messages: Union[Dict, List[Dict]], model: str = "gpt-3.
         tokens_per_name = 1
         encoding_model = "gpt-4"
     elif model.lower() in LOCAL_LLMS or model in LOCAL_LLMS:
-        from transformers import AutoTokenizer
-
-        encoding = AutoTokenizer.from_pretrained(LOCAL_LLMS_MAPPING[model.lower()])
+        tokens_per_message = 0
+        tokens_per_name = 0
+        encoding_model = model
     else:
         raise NotImplementedError(
             f"count_message_tokens() is not implemented for model {model}.\n"
             " See https://github.com/openai/openai-python/blob/main/chatml.md for"
             " information on how messages are converted to tokens."
         )
-    if model.startswith("gpt-3.5-turbo") or model.startswith("gpt-4"):
-        try:
-            encoding = tiktoken.encoding_for_model(encoding_model)
-        except KeyError:
-            logger.warn("Warning: model not found. Using cl100k_base encoding.")
-            encoding = tiktoken.get_encoding("cl100k_base")
 
     num_tokens = 0
     for message in messages:
@@ -51,10 +152,10 @@ def count_message_tokens(messages: Union[Dict, List[Dict]], model: str = "gpt-3.
         for key, value in message.items():
             # TODO: count number of function_call's token more accurately
             if key == "function_call":
-                num_tokens += len(encoding.encode(value["name"]))
-                num_tokens += len(encoding.encode(value["arguments"]))
+                num_tokens += count_string_tokens(value["name"], encoding_model)
+                num_tokens += count_string_tokens(value["arguments"], encoding_model)
             else:
-                num_tokens += len(encoding.encode(value))
+                num_tokens += count_string_tokens(value, encoding_model)
                 if key == "name":
                     num_tokens += tokens_per_name
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
@@ -1,12 +1,13 @@
+import os
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
-from pymilvus import connections
 
 from agents import AgentAdapter
 from communication.communication_layer import CommunicationLayer
 from common.config import global_config
-from common.types import LaunchGoalParam
+from common.types import CancelGoalParam, LaunchGoalParam
+from common.utils.vector_store import get_vector_store_backend
 
 
 @asynccontextmanager
@@ -31,14 +32,17 @@ app = FastAPI(lifespan=lifespan)
 
 communicator: CommunicationLayer = None
 
-connections.connect(
-    alias="default",
-    user="username",
-    password="password",
-    # host='localhost', #'host.docker.internal',
-    host="standalone",
-    port="19530",
-)
+if get_vector_store_backend(os.path.join("configs", "vecdb", "agent_contact.yaml")) == "milvus":
+    from pymilvus import connections
+
+    connections.connect(
+        alias="default",
+        user="username",
+        password="password",
+        # host='localhost', #'host.docker.internal',
+        host="standalone",
+        port="19530",
+    )
 
 
 @app.post("/launch_goal")
@@ -46,6 +50,21 @@ async def launch_goal(param: LaunchGoalParam):
     return await communicator.launch_goal(**param.model_dump())
 
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "dispatcher": communicator.dispatcher.stats(),
+        "server_requests": communicator.server_helper.stats(),
+    }
+
+
+@app.post("/cancel_goal")
+async def cancel_goal(param: CancelGoalParam):
+    if not communicator.cancel_goal(param.comm_id):
+        return {"status": "failed", "message": f"Could not find the communication session: {param.comm_id}."}
+    return {"status": "success"}
+
+
 if __name__ == "__main__":
     import uvicorn
 
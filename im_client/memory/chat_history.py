@@ -1,3 +1,4 @@
+import bisect
 import copy
 from string import Template
 from typing import Dict, List, Optional, Tuple
@@ -5,7 +6,7 @@ from typing import Dict, List, Optional, Tuple
 import openai
 from llms import OpenAIChat
 from llms.utils import count_message_tokens, count_string_tokens
-from pydantic import Field
+from pydantic import Field, PrivateAttr
 
 from common.types.llm import LLMResult
 
@@ -35,12 +36,59 @@ ${new_events}
 """
 '''
 
+
+    # Caches derived from `messages`, extended incrementally as messages are appended, and dropped by
+    # the other changes of the messages (`reset` or assigning `messages`), which must not be modified in place.
+    # They are not serialized, and are rebuilt lazily after loading the memory.
+    _rendered: List[dict] = PrivateAttr(default_factory=list)
+    # model -> prefix sums of the token counts of the messages, with a leading 0
+    _token_prefix_sums: Dict[str, List[int]] = PrivateAttr(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "messages":
+            self._invalidate_caches()
+
+    def _invalidate_caches(self) -> None:
+        self._rendered = []
+        self._token_prefix_sums = {}
+
     def add_messages(self, messages: LLMResult | List[LLMResult]) -> None:
         if isinstance(messages, LLMResult):
             messages = [messages]
         for message in messages:
             self.messages.append(message)
 
+    def _rendered_messages(self) -> List[dict]:
+        """The OpenAI messages of all the messages, rendered once per message."""
+        for message in self.messages[len(self._rendered) :]:
+            self._rendered.append(message.to_openai_message())
+        return self._rendered
+
+    def _prefix_sums(self, model: str) -> List[int]:
+        """Prefix sums of the token counts of the messages, each message being counted once per model."""
+        rendered = self._rendered_messages()
+        prefix_sums = self._token_prefix_sums.setdefault(model, [0])
+        for message in rendered[len(prefix_sums) - 1 :]:
+            prefix_sums.append(prefix_sums[-1] + count_message_tokens(message, model))
+        return prefix_sums
+
+    def count_tokens(self, model: str = "gpt-3.5-turbo", start_index: int = 0) -> int:
+        """The number of tokens of the messages from `start_index` on."""
+        prefix_sums = self._prefix_sums(model)
+        return prefix_sums[-1] - prefix_sums[start_index]
+
+    def trim_index(self, t_limit: int, model: str = "gpt-3.5-turbo", start_index: int = 0) -> int:
+        """
+        The index of the first message of the longest suffix of the messages (from `start_index` on)
+        fitting in `t_limit` tokens.
+        """
+        prefix_sums = self._prefix_sums(model)
+        return bisect.bisect_left(prefix_sums, prefix_sums[-1] - t_limit, lo=start_index, hi=len(prefix_sums) - 1)
+
     def to_string(self, add_sender_prefix: bool = False) -> str:
         if add_sender_prefix:
             return "\n".join(
@@ -63,7 +111,8 @@ ${new_events}
         if self.has_summary:
             start_index = self.last_trimmed_index
 
-        messages = [message.to_openai_message() for message in self.messages[start_index:]]
+        # A new list is returned, but the message dicts are shared with the cache and must not be modified.
+        messages = self._rendered_messages()[start_index:]
 
         # summary message
         if self.has_summary:
@@ -71,15 +120,16 @@ ${new_events}
             if max_summary_length == 0:
                 max_summary_length = self.max_summary_tlength
             max_send_token -= max_summary_length
-            prompt = []
-            trimmed_history = add_history_upto_token_limit(prompt, messages, max_send_token, model)
-            if trimmed_history:
+            trim_index = self.trim_index(max_send_token, model, start_index)
+            prompt = self._rendered_messages()[trim_index:]
+            if trim_index > start_index:
                 new_summary_msg, _ = await self.trim_messages(list(prompt), model, messages)
                 prompt.append(new_summary_msg)
             messages = prompt
         return messages
 
     def reset(self) -> None:
+        # Assigning the messages drops the caches.
         self.messages = []
 
     async def trim_messages(
@@ -162,20 +212,3 @@ ${new_events}
             "role": "system",
             "content": f"This reminds you of these events from your past: \n{self.summary}",
         }
-
-
-def add_history_upto_token_limit(prompt: List[dict], history: List[dict], t_limit: int, model: str) -> List[LLMResult]:
-    limit_reached = False
-    current_prompt_length = 0
-    trimmed_messages: List[Dict] = []
-    for message in history[::-1]:
-        token_to_add = count_message_tokens(message, model)
-        if current_prompt_length + token_to_add > t_limit:
-            limit_reached = True
-
-        if not limit_reached:
-            prompt.insert(0, message)
-            current_prompt_length += token_to_add
-        else:
-            trimmed_messages.insert(0, message)
-    return trimmed_messages
@@ -1,67 +1,128 @@
-from typing import Literal
+import asyncio
+import importlib.util
+from collections import defaultdict
+from typing import Any, Literal
 
-from httpx import AsyncClient, RequestError, Timeout
+from httpx import AsyncClient, ConnectError, ConnectTimeout, Limits, RequestError, Response, Timeout
 from tenacity import (
-    retry,
+    AsyncRetrying,
     retry_if_exception_type,
     stop_after_attempt,
     wait_exponential,
 )
 
 from common.config import global_config
+from common.log import logger
 from common.types.agent import AgentInfo
-from common.types.server import AgentRegistryTeamupOutput
+from common.types.server import AgentRegistryTeamupOutput, SessionHeader
+from common.utils.metrics import LatencyHistogram
 from common.utils.misc import log_retry
+from communication.websocket_client import RPCConnectionLostError, RPCNotSentError, WebSocketClient
 
 
 class ServerHelper:
     """
     Helper functions that help communicate with the server.
+
+    All the requests share one pooled `AsyncClient`, so consecutive calls reuse the kept-alive
+    connections instead of opening a new one each time. The helper is owned by the communication
+    layer, which closes it on shutdown.
+
+    Failed requests are retried with exponential backoff. Idempotent requests are retried on any
+    transport error, while the others (teamup creates a session) are retried only when the
+    connection could not be established, i.e. when the server cannot have handled the request.
+
+    Once `use_websocket` is called, the requests are sent as RPCs over the agent WebSocket instead,
+    and HTTP is used only when the RPC could not be sent (or got no response, for the idempotent requests).
+
+    Args:
+        config (dict | None, optional): The `comm.http` section of the config, with the keys
+            timeout, max_connections, max_keepalive_connections, keepalive_expiry, http2 and max_attempts.
     """
 
     host = "http://" + global_config["server"]["hostname"]
     port = global_config["server"]["port"]
     url = f"{host}:{port}"
 
-    @classmethod
-    @retry(
-        stop=stop_after_attempt(5),
-        reraise=True,
-        retry=retry_if_exception_type(RequestError),
-        wait=wait_exponential(multiplier=1, min=1, max=10),
-        before_sleep=log_retry,
-    )
+    def __init__(self, config: dict | None = None):
+        config = config or {}
+        http2 = config.get("http2", False)
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warn("HTTP/2 is enabled but the h2 package is not installed. Falling back to HTTP/1.1.")
+            http2 = False
+        self.client = AsyncClient(
+            base_url=self.url,
+            timeout=Timeout(timeout=config.get("timeout", 60)),
+            limits=Limits(
+                max_connections=config.get("max_connections", 20),
+                max_keepalive_connections=config.get("max_keepalive_connections", 10),
+                keepalive_expiry=config.get("keepalive_expiry", 30),
+            ),
+            http2=http2,
+        )
+        self.max_attempts = config.get("max_attempts", 5)
+        self.latency: defaultdict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.websocket: WebSocketClient | None = None
+        self.rpc_timeout = 30
+
+    def use_websocket(self, websocket: WebSocketClient, timeout: float = 30):
+        """Send the requests over the agent WebSocket, whose messages must be listened to for the responses."""
+        self.websocket = websocket
+        self.rpc_timeout = timeout
+
+    async def _send(self, endpoint: str, json: dict) -> Response:
+        with self.latency[endpoint].time():
+            response = await self.client.post(endpoint, json=json)
+        response.raise_for_status()
+        return response
+
+    async def _post(self, endpoint: str, json: dict, idempotent: bool = True) -> Response:
+        retryable_errors = RequestError if idempotent else (ConnectError, ConnectTimeout)
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(self.max_attempts),
+            reraise=True,
+            retry=retry_if_exception_type(retryable_errors),
+            wait=wait_exponential(multiplier=1, min=1, max=10),
+            before_sleep=log_retry,
+        )
+        return await retrying(self._send, endpoint, json)
+
+    async def _request(self, endpoint: str, json: dict, idempotent: bool = True) -> Any:
+        if self.websocket is not None:
+            try:
+                with self.latency[f"ws:{endpoint}"].time():
+                    return await self.websocket.call(endpoint.lstrip("/"), json, self.rpc_timeout)
+            except RPCNotSentError as e:
+                logger.warn(f"Failed to send {endpoint} over the websocket, falling back to HTTP. {e}")
+            except (asyncio.TimeoutError, RPCConnectionLostError) as e:
+                # The server may have handled the request, so only the idempotent ones are sent again.
+                if not idempotent:
+                    raise
+                logger.warn(f"No response to {endpoint} over the websocket, falling back to HTTP. {e!r}")
+        response = await self._post(endpoint, json, idempotent)
+        return response.json()
+
     async def retrieve_assistant(
-        cls,
+        self,
         sender: str,
         capabilities: list[str],
+        exclude: list[str] | None = None,
     ) -> list[AgentInfo]:
         """
         Retrieve relevant agents from the server with specified capability keywords.
+        The agents in `exclude` are filtered out on the server.
         """
-        async with AsyncClient(timeout=Timeout(timeout=30)) as client:
-            retrieve_result = await client.post(
-                f"{cls.url}/retrieve_assistant",
-                json={
-                    "sender": sender,
-                    "capabilities": capabilities,
-                },
-                timeout=60.0,
-            )
-            retrieve_result.raise_for_status()
-            agent_infos = retrieve_result.json()
-        return agent_infos
-
-    @classmethod
-    @retry(
-        stop=stop_after_attempt(5),
-        reraise=True,
-        retry=retry_if_exception_type(RequestError),
-        wait=wait_exponential(multiplier=1, min=1, max=10),
-        before_sleep=log_retry,
-    )
+        return await self._request(
+            "/retrieve_assistant",
+            {
+                "sender": sender,
+                "capabilities": capabilities,
+                "exclude": exclude or [],
+            },
+        )
+
     async def register(
-        cls,
+        self,
         name: str,
         desc: str,
         agent_type: Literal["Human Assistant", "Thing Assistant"],
@@ -69,54 +130,42 @@ class ServerHelper:
         """
         Register the client to the server
         """
-        async with AsyncClient(timeout=Timeout(timeout=30)) as client:
-            response = await client.post(
-                f"{cls.url}/register",
-                json=AgentInfo(name=name, desc=desc, type=agent_type).model_dump(),
-                timeout=60,
-            )
-            response.raise_for_status()
-
-    @classmethod
-    @retry(
-        stop=stop_after_attempt(5),
-        reraise=True,
-        retry=retry_if_exception_type(RequestError),
-        wait=wait_exponential(multiplier=1, min=1, max=10),
-        before_sleep=log_retry,
-    )
+        await self._request("/register", AgentInfo(name=name, desc=desc, type=agent_type).model_dump())
+
     async def teamup(
-        cls, sender: str, agent_names: list[str], team_name: str | None = None
+        self,
+        sender: str,
+        agent_names: list[str],
+        team_name: str | None = None,
+        goal: str | None = None,
+        team_members: list[dict] | None = None,
     ) -> AgentRegistryTeamupOutput:
         """
-        Forming group with specified agents
+        Forming group with specified agents. The goal and the team members are stored by the server
+        as the header of the session.
         """
-        async with AsyncClient(timeout=Timeout(timeout=30)) as client:
-            teamup_result = await client.post(
-                f"{cls.url}/teamup",
-                json={
-                    "sender": sender,
-                    "agent_names": agent_names,
-                    "team_name": team_name,
-                },
-            )
-            teamup_result.raise_for_status()
-            team_info = AgentRegistryTeamupOutput.model_validate_json(teamup_result.text)
-        return team_info
-
-    @classmethod
-    @retry(
-        stop=stop_after_attempt(5),
-        reraise=True,
-        retry=retry_if_exception_type(RequestError),
-        wait=wait_exponential(multiplier=1, min=1, max=10),
-        before_sleep=log_retry,
-    )
-    async def query_assistant(cls, name: list[str] | str):
-        async with AsyncClient(timeout=Timeout(timeout=30)) as client:
-            response = await client.post(
-                f"{cls.url}/query_assistant",
-                json={"name": name},
-            )
-            response.raise_for_status()
-        return response.json()
+        teamup_result = await self._request(
+            "/teamup",
+            {
+                "sender": sender,
+                "agent_names": agent_names,
+                "team_name": team_name,
+                "goal": goal,
+                "team_members": team_members,
+            },
+            idempotent=False,
+        )
+        return AgentRegistryTeamupOutput.model_validate(teamup_result)
+
+    async def query_assistant(self, name: list[str] | str):
+        return await self._request("/query_assistant", {"name": name})
+
+    async def fetch_session_header(self, comm_id: str) -> SessionHeader | None:
+        header = await self._request("/fetch_session_header", {"comm_id": comm_id})
+        return SessionHeader.model_validate(header) if header is not None else None
+
+    def stats(self) -> dict:
+        return {endpoint: histogram.summary() for endpoint, histogram in self.latency.items()}
+
+    async def close(self):
+        await self.client.aclose()
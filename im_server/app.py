@@ -1,16 +1,24 @@
+import asyncio
 import json
+import sqlite3
 import uuid
-from copy import deepcopy
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache, partial
+from typing import Callable, Iterator
 from urllib.parse import quote, unquote
 
 import uvicorn
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from pymilvus import connections
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 
+from common.config import global_config
 from common.log import logger
 from common.types import (
+    AGENT_MESSAGE_DEFAULTS,
     AgentEntry,
     AgentInfo,
     AgentMessage,
@@ -19,9 +27,18 @@ from common.types import (
     AgentRegistryTeamupOutput,
     AgentRegistryTeamupParam,
     ChatRecordFetchParam,
+    RPC_FRAME_PREFIX,
+    RPCRequest,
+    RPCResponse,
+    SessionHeader,
+    SessionHeaderFetchParam,
 )
-from common.utils.database_utils import AutoStoredDict
-from common.utils.milvus_utils import ConfigMilvusWrapper
+from common.utils.database_utils import AppendOnlyLog, AutoStoredDict
+from common.utils.metrics import LatencyHistogram
+from common.utils.vector_store import fuse_search_results, get_vector_store_backend, load_vector_store
+from common.utils.wire_format import WireDecoder, WireEncoder, parse_subprotocol, select_subprotocol
+from backplane import load_backplane
+from outbound_queue import OutboundChannel
 
 app = FastAPI()
 
@@ -36,66 +53,205 @@ app.add_middleware(
 )
 
 
+# The name of the frontend in the presence of the backplane
+FRONTEND_RECEIVER = "__frontend__"
+
+
+@lru_cache(maxsize=256)
+def parse_frame(frame: str) -> dict:
+    """
+    Parse the JSON frame of a message for the binary encoders. A broadcast frame is the same string for all
+    the receivers, so it is parsed once and the dict is shared by their encoders, which must not modify it.
+    """
+    return json.loads(frame)
+
+
 class ConnectionManager:
+    """
+    Connection Manager block. Every connection gets its own outbound queue drained by a writer task,
+    so that sending to one receiver never waits for another.
+    The frames to the receivers connected to the other workers of the server are routed through the backplane.
+    """
+
     def __init__(self):
         self.agent_to_websocket: dict[str, WebSocket] = {}
+        self.channels: dict[str, OutboundChannel] = {}
+        self.config = global_config.get("connection", {})
+        self.backplane = load_backplane(global_config.get("backplane", {}))
+        # The unregistrations running in the background, referenced until they finish
+        self.unregister_tasks: set[asyncio.Task] = set()
+
+    def create_channel(self, name: str, websocket: WebSocket, subprotocol: str | None = None) -> OutboundChannel:
+        return OutboundChannel(
+            name,
+            websocket,
+            max_queue_size=self.config.get("max_queue_size", 1000),
+            policy=self.config.get("slow_consumer_policy", "spill"),
+            spill_dir=self.config.get("spill_dir", "database/server/spill"),
+            encoder=self.create_frame_encoder() if parse_subprotocol(subprotocol) == "msgpack" else None,
+            on_close=self._forget_channel,
+        )
 
-    async def connect(self, websocket: WebSocket, agent_name: str) -> str:
-        await websocket.accept()
+    def _forget_channel(self, channel: OutboundChannel):
+        """Unregister a channel whose writer failed, unless the receiver has reconnected since."""
+        if self.channels.get(channel.name) is channel:
+            del self.channels[channel.name]
+            self.agent_to_websocket.pop(channel.name, None)
+            task = asyncio.create_task(self.backplane.unregister(channel.name))
+            self.unregister_tasks.add(task)
+            task.add_done_callback(self.unregister_tasks.discard)
+
+    @staticmethod
+    def create_frame_encoder() -> Callable[[str], str | bytes]:
+        """Transcode the JSON frames of the messages into the binary wire format. The RPC responses stay JSON text."""
+        encoder = WireEncoder(AGENT_MESSAGE_DEFAULTS)
+
+        def encode(frame: str) -> str | bytes:
+            if frame.startswith(RPC_FRAME_PREFIX):
+                return frame
+            return encoder.encode(parse_frame(frame))
+
+        return encode
+
+    async def connect(self, websocket: WebSocket, agent_name: str, subprotocol: str | None = None) -> str:
+        await websocket.accept(subprotocol=subprotocol)
+        if agent_name in self.channels:
+            await self.channels.pop(agent_name).close()
         self.agent_to_websocket[agent_name] = websocket
+        self.channels[agent_name] = self.create_channel(agent_name, websocket, subprotocol)
+        await self.backplane.register(agent_name)
         print(self.agent_to_websocket)
 
     async def disconnect(self, agent_name: str):
         self.agent_to_websocket.pop(agent_name, None)
-
-    async def send_personal_message(self, receiver: str, message: AgentMessage):
-        try:
-            websocket = self.agent_to_websocket[receiver]
-        except:
+        if agent_name in self.channels:
+            await self.channels.pop(agent_name).close()
+        await self.backplane.unregister(agent_name)
+
+    async def send_personal_message(self, receiver: str, message: AgentMessage | str):
+        """Enqueue the message (or its already serialized JSON) to the receiver and return immediately."""
+        await self.broadcast([receiver], message if isinstance(message, str) else message.model_dump_json())
+
+    async def broadcast(self, receivers: list[str], frame: str):
+        """
+        Enqueue the same serialized frame to all the receivers connected to this worker,
+        and publish it once to the other workers for the remaining receivers.
+        """
+        remote_receivers = []
+        for receiver in receivers:
+            channel = self.channels.get(receiver)
+            if channel is None:
+                remote_receivers.append(receiver)
+            else:
+                channel.put(frame)
+        if remote_receivers:
+            for receiver in await self.backplane.publish(remote_receivers, frame):
+                logger.error(f"Failed to find the websocket for {receiver}")
+
+    def deliver(self, receiver: str, frame: str):
+        """Enqueue a frame routed by another worker to the receiver connected to this worker."""
+        channel = frontend_channel if receiver == FRONTEND_RECEIVER else self.channels.get(receiver)
+        if channel is None:
             logger.error(f"Failed to find the websocket for {receiver}")
-        await websocket.send_text(message.model_dump_json())
+            return
+        channel.put(frame)
+
+    def stats(self) -> dict:
+        return {name: channel.stats() for name, channel in self.channels.items()}
 
 
 class AgentRegistry:
     """
-    Agent Registry block. Providing agent registering and querying services based on Milvus vector database.
+    Agent Registry block. Providing agent registering and querying services based on a vector database
+    (Milvus, or the in-process LocalVectorStore).
+    The blocking calls to the vector database and to the embedding API run in a dedicated thread pool with a limited
+    concurrency, so that discovery never stalls the event loop relaying the messages.
     """
 
     def __init__(self):
-        self.agents = ConfigMilvusWrapper("configs/agent_registry.yaml")
+        config = global_config.get("registry", {})
+        self.agents = load_vector_store(AGENT_REGISTRY_CONFIG)
+        # In-memory set of the registered names. Milvus is written through on registration,
+        # so that membership checks never query the vector database.
+        self.names: set[str] = set(self.agents.keys())
+        # Only Milvus is shared by the workers of the server, the local vector store lives in each worker.
+        self.shared = get_vector_store_backend(AGENT_REGISTRY_CONFIG) == "milvus"
+        self.executor = ThreadPoolExecutor(max_workers=config.get("max_workers", 8), thread_name_prefix="registry")
+        self.semaphore = asyncio.Semaphore(config.get("max_concurrency", 8))
+        self.max_overfetch = config.get("max_overfetch", 100)
+        self.latency: dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+
+    def __contains__(self, name: str) -> bool:
+        # Queries Milvus for the names unknown to this worker, so it must run in the executor.
+        if name in self.names:
+            return True
+        # The agent may have been registered through another worker of the server.
+        if self.shared and name in self.agents:
+            self.names.add(name)
+            return True
+        return False
+
+    async def filter_registered(self, names: list[str]) -> list[str]:
+        """
+        The names of registered agents among `names`, in order. The names unknown to this worker are
+        looked up in the shared vector database in a single call off the event loop.
+        """
+        unknown = [name for name in names if name not in self.names]
+        if unknown and self.shared:
+            await self._run_blocking("contains", lambda: [name for name in unknown if name in self])
+        return [name for name in names if name in self.names]
+
+    async def _run_blocking(self, operation: str, func: Callable, *args):
+        async with self.semaphore:
+            with self.latency[operation].time():
+                return await asyncio.get_event_loop().run_in_executor(self.executor, partial(func, *args))
 
     async def register(self, agent: AgentInfo) -> None:
-        if agent.name in self.agents:
+        if agent.name in self.names:
             return agent.name
         timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-        self.agents[agent.name] = AgentEntry(
+        entry = AgentEntry(
             name=agent.name,
             desc=agent.desc,
             type=agent.type,
             created_at=timestamp,
         )
+        await self._run_blocking("register", self.agents.__setitem__, agent.name, entry)
+        self.names.add(agent.name)
 
     async def retrieve(self, param: AgentRegistryRetrivalParam) -> list[AgentInfo]:
-        res = self.agents.search_via_config(param.capabilities)
-        deduplicate_ids = set()
-        deduplicate_hits = []
-        for hits in res:
-            for hit in hits:
-                if hit.get("name") not in deduplicate_ids:
-                    deduplicate_hits.append(hit)
-                    deduplicate_ids.add(hit.get("name"))
-        return [AgentInfo(name=hit.get("name"), type=hit.get("type"), desc=hit.get("desc")) for hit in deduplicate_hits]
+        """
+        Search all the queries in one batch, then merge the hits with `param.fusion`
+        and drop the agents in `param.exclude`.
+        """
+        if not param.capabilities:
+            return []
+        exclude = set(param.exclude)
+        limit = self.agents.get_search_config(next(iter(self.agents.search_config)))["search_params"]["limit"]
+        top_k = param.top_k or limit * len(param.capabilities)
+        # Over-fetch so that the excluded agents do not shrink the results, within a bound on the search size.
+        res = await self._run_blocking(
+            "retrieve",
+            partial(
+                self.agents.search_via_config, limit=limit + min(len(exclude), self.max_overfetch), with_scores=True
+            ),
+            param.capabilities,
+        )
+        hits = fuse_search_results(res, method=param.fusion, exclude=exclude)[:top_k]
+        return [AgentInfo(name=hit.get("name"), type=hit.get("type"), desc=hit.get("desc")) for hit in hits]
 
     async def query(self, name: list[str] | str) -> list[AgentInfo | None] | AgentInfo | None:
-        result = []
         candidates = name if isinstance(name, list) else [name]
+        # The membership check may query Milvus for the agents registered through the other workers.
+        entries = await self._run_blocking("query", lambda: {n: self.agents[n] for n in candidates if n in self})
+        result = []
         for agent_name in candidates:
-            if agent_name in self.agents:
+            if agent_name in entries:
                 result.append(
                     AgentInfo(
                         name=agent_name,
-                        desc=self.agents[agent_name].get("desc"),
-                        type=self.agents[agent_name].get("type"),
+                        desc=entries[agent_name].get("desc"),
+                        type=entries[agent_name].get("type"),
                     )
                 )
             else:
@@ -105,70 +261,241 @@ class AgentRegistry:
         else:
             return result
 
+    async def list_all(self) -> list[dict]:
+        return await self._run_blocking("list_all", self.agents.items)
+
+    def stats(self) -> dict:
+        return {operation: histogram.summary() for operation, histogram in self.latency.items()}
+
+
+class ChatRecordManager:
+    """
+    Chat Record Manager block. Storing the chat record of each group chat, where every message
+    is appended as its own row keyed by (comm_id, seq) instead of rewriting the whole record.
+    """
+
+    # The version of the records in the file (its user_version), 1 once the legacy records are migrated
+    RECORD_VERSION = 1
+
+    def __init__(self):
+        self.headers = AutoStoredDict("database/server/chat.db", tablename="chat")
+        self.messages = AppendOnlyLog("database/server/chat.db", tablename="chat_log")
+
+    def migrate_legacy_records(self):
+        """
+        Move the records written by older versions, which keep the whole message list in the header,
+        to the message log. Called by every worker when it starts.
+
+        The messages and the rewritten header of every record are written in one transaction (both
+        tables live in the same file), so that an interrupted migration never duplicates messages.
+        The transaction also records the version of the file, so that only the first worker migrates
+        and the others, waiting for its write lock, find nothing left to do.
+        """
+        with self.messages.transaction() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= self.RECORD_VERSION:
+                return
+            rows = conn.execute(f'SELECT key, value FROM "{self.headers.tablename}"').fetchall()
+            for key, value in rows:
+                header = self.headers.decode(value)
+                if not isinstance(header, dict) or "chat_record" not in header:
+                    continue
+                comm_id = self.headers.decode_key(key)
+                for message in header.pop("chat_record"):
+                    payload = message.model_dump_json() if isinstance(message, AgentMessage) else json.dumps(message)
+                    self.messages.append(comm_id, payload)
+                conn.execute(
+                    f'UPDATE "{self.headers.tablename}" SET value = ? WHERE key = ?', (self.headers.encode(header), key)
+                )
+            conn.execute(f"PRAGMA user_version = {self.RECORD_VERSION}")
+
+    def create(self, comm_id: str, agent_names: list[str], team_name: str | None = None, goal: str | None = None):
+        self.headers[comm_id] = {
+            "comm_id": comm_id,
+            "agent_names": agent_names,
+            "team_name": team_name,
+            "goal": goal,
+        }
+
+    def append(self, comm_id: str, message: str) -> int:
+        """Append a serialized AgentMessage to the record, and return its sequence number."""
+        return self.messages.append(comm_id, message)
+
+    def __contains__(self, comm_id: str):
+        return comm_id in self.headers
+
+    def comm_ids(self) -> list[str]:
+        return self.headers.keys()
+
+    def iter_record(self, comm_id: str, since_seq: int = 0, limit: int | None = None) -> Iterator[str]:
+        """
+        Lazily assemble the JSON of the chat record from the stored messages, with only the
+        messages after `since_seq` (at most `limit` of them) included.
+        """
+        header = self.headers[comm_id]
+        last_seq = since_seq
+        yield json.dumps(header)[:-1] + ', "chat_record": ['
+        for i, (seq, message) in enumerate(self.messages.iter_entries(comm_id, since_seq, limit)):
+            yield message if i == 0 else "," + message
+            last_seq = seq
+        yield f'], "last_seq": {last_seq}}}'
+
 
 class SessionManager:
     """
     Session Manager block. Maintaining the basic group chat information.
+    The members of every session are indexed in memory and written through to SQLite.
+    The header of every session (goal and roster) is stored with a version, which the messages
+    carry instead of the header itself.
     """
 
     def __init__(self):
         self.sessions = AutoStoredDict("database/server/sessions.db", tablename="sessions")
+        self.members: dict[str, list[str]] = dict(self.sessions.items())
+        self.headers = AutoStoredDict("database/server/sessions.db", tablename="session_headers")
+
+    def __contains__(self, comm_id: str) -> bool:
+        return comm_id in self.members or self._load(comm_id)
+
+    def _load(self, comm_id: str) -> bool:
+        """Load a session created by another worker of the server from the shared database."""
+        if comm_id in self.sessions:
+            self.members[comm_id] = self.sessions[comm_id]
+            return True
+        return False
+
+    def get_members(self, comm_id: str) -> list[str]:
+        if comm_id not in self.members:
+            self._load(comm_id)
+        return self.members[comm_id]
 
     async def teamup(self, agent_names: list[str]) -> AgentRegistryTeamupOutput:
         comm_id = uuid.uuid4().hex
-        session_group = []
-        for name in agent_names:
-            if name in agent_registry.agents.keys():
-                session_group.append(name)
+        session_group = await agent_registry.filter_registered(agent_names)
+        self.members[comm_id] = session_group
         self.sessions[comm_id] = session_group
         return {"comm_id": comm_id, "agent_names": session_group}
 
+    def set_header(self, comm_id: str, goal: str | None, team_members: list[dict] | None) -> int:
+        """Store the header of the session under a new version, and return the version."""
+        version = self.headers[comm_id]["version"] + 1 if comm_id in self.headers else 1
+        header = SessionHeader(comm_id=comm_id, version=version, goal=goal, team_members=team_members or [])
+        self.headers[comm_id] = header.model_dump()
+        return version
+
+    def get_header(self, comm_id: str) -> SessionHeader | None:
+        if comm_id not in self.headers:
+            return None
+        return SessionHeader.model_validate(self.headers[comm_id])
+
 
 @app.websocket("/ws/{agent_name}")
 async def websocket_endpoint(websocket: WebSocket, agent_name: str):
     """
     Endpoint for receiving agent messages
     """
-    await connection_manager.connect(websocket, agent_name)
+    # The client may ask for the binary wire format through the websocket subprotocol, otherwise JSON text frames are used.
+    subprotocol = select_subprotocol(websocket.scope.get("subprotocols", []))
+    decoder = WireDecoder(AGENT_MESSAGE_DEFAULTS) if parse_subprotocol(subprotocol) == "msgpack" else None
+    await connection_manager.connect(websocket, agent_name, subprotocol)
+    connection_name = agent_name
     agent_name = unquote(agent_name)
 
     try:
         while True:
             # 1. listen to the websocket
-            data = await websocket.receive_text()
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            if frame.get("bytes") is not None:
+                if decoder is None:
+                    logger.error(f"Received a binary frame from {agent_name}, which did not negotiate a binary wire format")
+                    continue
+                try:
+                    parsed_data = AgentMessage.model_validate(decoder.decode(frame["bytes"]))
+                except Exception as e:
+                    logger.error(f"Failed to decode the message from {agent_name}: {e}")
+                    continue
+                # Stored and forwarded as JSON, as if the client had sent it in JSON.
+                data = parsed_data.model_dump_json()
+                await route_message_safely(agent_name, parsed_data, data)
+                continue
+            data = frame["text"]
+            if data.startswith(RPC_FRAME_PREFIX):
+                # Requests to the registry are served concurrently, so that a slow retrieval never holds up the messages.
+                task = asyncio.create_task(handle_rpc(connection_name, data))
+                rpc_tasks.add(task)
+                task.add_done_callback(rpc_tasks.discard)
+                continue
             try:
-                # 2. parse the received message using Agent Message protocol
+                # 2. parse the received message using Agent Message protocol.
+                # The frame is validated once, and the raw text is what gets stored and forwarded.
                 parsed_data = AgentMessage.model_validate_json(data)
             except:
-                logger.error("Failed to parse the message: {data}")
-            if parsed_data.comm_id not in session_manager.sessions:
-                logger.error(f"Failed to find the session {parsed_data.comm_id} for {agent_name}")
-
-            record = chat_record_manager[parsed_data.comm_id]
-            record["chat_record"].append(parsed_data)
-            chat_record_manager[parsed_data.comm_id] = record
-            await send_to_frontend(json.loads(parsed_data.model_dump_json()), "message")
-            for receiver in session_manager.sessions[parsed_data.comm_id]:
-                # 3. Forward the message to all the members including the sender itself.
-                await connection_manager.send_personal_message(receiver, parsed_data)
+                logger.error(f"Failed to parse the message: {data}")
+                continue
+            await route_message_safely(agent_name, parsed_data, data)
 
     except WebSocketDisconnect:
         agent_name = quote(agent_name)
         await connection_manager.disconnect(agent_name)
 
 
+async def route_message_safely(sender: str, message: AgentMessage, data: str):
+    """Route the message, logging the failures so that one frame never closes the connection of the sender."""
+    try:
+        await route_message(sender, message, data)
+    except Exception as e:
+        logger.error(f"Failed to route the message from {sender}: {e}")
+
+
+async def route_message(sender: str, message: AgentMessage, data: str):
+    """Store the message and forward its JSON `data` to the frontend and to all the members of the session."""
+    if message.comm_id not in session_manager:
+        logger.error(f"Failed to find the session {message.comm_id} for {sender}")
+        return
+
+    try:
+        # The append may wait for the write lock held by another worker, and retries with a sleep.
+        await asyncio.to_thread(chat_record_manager.append, message.comm_id, data)
+    except sqlite3.Error as e:
+        # The message is still delivered, so that a storage failure never stalls the session.
+        logger.error(f"Failed to store the message from {sender} in the session {message.comm_id}: {e}")
+    await send_to_frontend(data, "message")
+    # 3. Forward the message to all the members including the sender itself.
+    await connection_manager.broadcast(session_manager.get_members(message.comm_id), data)
+
+
 @app.websocket("/chatlist_ws")
 async def websocket_chatlist(websocket: WebSocket):
     await websocket.accept()
-    global frontend_ws
-    frontend_ws = websocket
+    global frontend_channel
+    if frontend_channel is not None:
+        await frontend_channel.close()
+    frontend_channel = connection_manager.create_channel("frontend", websocket)
+    await connection_manager.backplane.register(FRONTEND_RECEIVER)
 
     try:
         while True:
             data = await websocket.receive_text()
 
     except WebSocketDisconnect:
-        frontend_ws = None
+        await frontend_channel.close()
+        frontend_channel = None
+        await connection_manager.backplane.unregister(FRONTEND_RECEIVER)
+
+
+@app.on_event("startup")
+async def startup():
+    try:
+        await asyncio.to_thread(chat_record_manager.migrate_legacy_records)
+    except sqlite3.Error as e:
+        logger.error(f"Failed to migrate the legacy chat records: {e}")
+    await connection_manager.backplane.start(connection_manager.deliver)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await connection_manager.backplane.close()
 
 
 @app.post("/health_check")
@@ -201,55 +528,129 @@ async def query_assistant(
 async def teamup(teamup_param: AgentRegistryTeamupParam):
     result = await session_manager.teamup(teamup_param.agent_names + [teamup_param.sender])
     result["team_name"] = teamup_param.team_name
-    chat_record_manager[result["comm_id"]] = {
-        "comm_id": result["comm_id"],
-        "agent_names": result["agent_names"],
-        "team_name": teamup_param.team_name,
-        "chat_record": [],
-    }
-    await send_to_frontend(result, "teamup")
+    if teamup_param.goal is not None or teamup_param.team_members is not None:
+        result["header_version"] = session_manager.set_header(
+            result["comm_id"], teamup_param.goal, teamup_param.team_members
+        )
+    chat_record_manager.create(result["comm_id"], result["agent_names"], teamup_param.team_name, teamup_param.goal)
+    await send_to_frontend({**result, "goal": teamup_param.goal}, "teamup")
     return result
 
 
-async def send_to_frontend(data: dict, type: str):
-    global frontend_ws
-    if frontend_ws:
-        try:
-            new_result = deepcopy(data)
-            new_result["frontend_type"] = type
-            await frontend_ws.send_text(json.dumps(new_result))
-        except WebSocketDisconnect:
-            frontend_ws = None
+@app.post("/fetch_session_header")
+async def fetch_session_header(param: SessionHeaderFetchParam) -> SessionHeader | None:
+    """Fetch the latest header of the session, which the messages reference through `header_version`."""
+    return session_manager.get_header(param.comm_id)
+
+
+# The HTTP endpoints served over the agent WebSocket, with the types of their parameters
+RPC_METHODS = {
+    "register": (register_agent, AgentInfo),
+    "retrieve_assistant": (retrieve_assistant, AgentRegistryRetrivalParam),
+    "query_assistant": (query_assistant, AgentRegistryQueryParam),
+    "teamup": (teamup, AgentRegistryTeamupParam),
+    "fetch_session_header": (fetch_session_header, SessionHeaderFetchParam),
+}
+
+
+async def handle_rpc(connection_name: str, data: str):
+    """
+    Serve an RPC frame received on the agent WebSocket with the handler of the corresponding HTTP endpoint,
+    and queue the response on the outbound channel of the connection, behind the messages already queued.
+    """
+    try:
+        request = RPCRequest.model_validate_json(data)
+    except Exception:
+        logger.error(f"Failed to parse the RPC request: {data}")
+        return
+    try:
+        handler, param_type = RPC_METHODS[request.rpc]
+        result = await handler(param_type.model_validate(request.params))
+        response = RPCResponse(rpc=request.rpc, id=request.id, result=jsonable_encoder(result))
+    except Exception as e:
+        logger.error(f"Failed to serve the RPC request {request.rpc}: {e}")
+        response = RPCResponse(rpc=request.rpc, id=request.id, error=f"{e.__class__.__name__}: {e}")
+    await connection_manager.send_personal_message(connection_name, response.model_dump_json())
+
+
+async def send_to_frontend(data: dict | str, type: str):
+    """
+    Send the data to the frontend with the `frontend_type` field added. `data` can be
+    the serialized JSON of an object, which is extended in place without being parsed.
+    The frontend may be connected to another worker, in which case the frame goes through the backplane.
+    """
+    if isinstance(data, str):
+        body = data.rstrip()[:-1].rstrip()
+        separator = "" if body.endswith("{") else ", "
+        frame = f'{body}{separator}"frontend_type": {json.dumps(type)}}}'
+    else:
+        frame = json.dumps({**data, "frontend_type": type})
+    if frontend_channel:
+        frontend_channel.put(frame)
+    else:
+        await connection_manager.backplane.publish([FRONTEND_RECEIVER], frame)
+
+
+@app.post("/metrics")
+async def metrics():
+    return {
+        "connections": connection_manager.stats(),
+        "frontend": frontend_channel.stats() if frontend_channel else None,
+        "registry": agent_registry.stats(),
+        "backplane": connection_manager.backplane.stats(),
+    }
 
 
 @app.post("/list_all_agents")
 async def list_all_agents():
-    return agent_registry.agents.items()
+    return await agent_registry.list_all()
 
 
 @app.post("/fetch_chat_record")
 async def fetch_chat_record(param: ChatRecordFetchParam):
+    """
+    Fetch the chat records, keyed by comm_id. Each record contains the messages with a sequence number
+    greater than `since_seq` (at most `limit` of them), and `last_seq` to be used as the cursor of the next page.
+    """
     if param.comm_id is None:
-        return chat_record_manager.todict()
-    if isinstance(param.comm_id, str):
-        param.comm_id = [param.comm_id]
-    return {comm_id: chat_record_manager[comm_id] for comm_id in param.comm_id}
-
-
-connections.connect(
-    alias="default",
-    user="username",
-    password="password",
-    # host="localhost",
-    host="standalone",
-    port="19530",
-)
+        comm_ids = chat_record_manager.comm_ids()
+    elif isinstance(param.comm_id, str):
+        comm_ids = [param.comm_id]
+    else:
+        comm_ids = param.comm_id
+
+    def iter_records():
+        yield "{"
+        for i, comm_id in enumerate(c for c in comm_ids if c in chat_record_manager):
+            yield ("" if i == 0 else ",") + json.dumps(comm_id) + ":"
+            yield from chat_record_manager.iter_record(comm_id, param.since_seq, param.limit)
+        yield "}"
+
+    return StreamingResponse(iter_records(), media_type="application/json")
+
+
+AGENT_REGISTRY_CONFIG = "configs/agent_registry.yaml"
+if get_vector_store_backend(AGENT_REGISTRY_CONFIG) == "milvus":
+    from pymilvus import connections
+
+    connections.connect(
+        alias="default",
+        user="username",
+        password="password",
+        # host="localhost",
+        host="standalone",
+        port="19530",
+    )
 
 agent_registry = AgentRegistry()
 connection_manager = ConnectionManager()
 session_manager = SessionManager()
-chat_record_manager = AutoStoredDict("database/server/chat.db", tablename="chat")
-frontend_ws = None
+chat_record_manager = ChatRecordManager()
+frontend_channel: OutboundChannel | None = None
+rpc_tasks: set[asyncio.Task] = set()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=7788, ws_ping_timeout=None)
+    workers = global_config.get("workers", 1)
+    if workers > 1 and global_config.get("backplane", {}).get("type", "in_process") == "in_process":
+        logger.warn("Running several workers with the in-process backplane. Agents on different workers cannot talk.")
+    uvicorn.run("app:app" if workers > 1 else app, host="0.0.0.0", port=7788, ws_ping_timeout=None, workers=workers)
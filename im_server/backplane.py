@@ -0,0 +1,239 @@
+import asyncio
+import json
+import uuid
+from abc import ABC, abstractmethod
+from typing import Callable
+
+try:
+    import redis.asyncio as aioredis
+except ModuleNotFoundError:
+    aioredis = None
+
+from common.log import logger
+
+# Delivers a frame to a receiver connected to this worker
+DeliverFunc = Callable[[str, str], None]
+
+
+class Backplane(ABC):
+    """
+    Pub/sub backplane connecting the workers of the server, so that it can run with several uvicorn
+    workers or on several nodes.
+
+    Every worker registers the agents connected to it (their presence). A frame routed to a receiver
+    connected to another worker is published to that worker, which delivers it to the local connection
+    through the function passed to `start`.
+    """
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self.deliver: DeliverFunc | None = None
+        self.published = 0
+        self.received = 0
+
+    async def start(self, deliver: DeliverFunc):
+        self.deliver = deliver
+
+    @abstractmethod
+    async def register(self, name: str):
+        """Record that the receiver is connected to this worker."""
+
+    @abstractmethod
+    async def unregister(self, name: str):
+        """Record that the receiver is no longer connected to this worker."""
+
+    @abstractmethod
+    async def publish(self, receivers: list[str], frame: str) -> list[str]:
+        """
+        Send the frame to the receivers connected to the other workers.
+
+        Returns:
+            list[str]: The receivers not connected to any other worker.
+        """
+
+    def _deliver(self, receivers: list[str], frame: str):
+        self.received += 1
+        for receiver in receivers:
+            self.deliver(receiver, frame)
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"worker_id": self.worker_id, "published": self.published, "received": self.received}
+
+
+class InProcessBackplane(Backplane):
+    """
+    Backplane of the workers running in the same process. Used by default, where the only worker
+    is the server itself; several instances sharing the same `hub` behave like separate workers.
+
+    Args:
+        hub (dict | None, optional): The presence shared by the workers, mapping the receivers to
+            the backplane of their worker. Defaults to None (a single worker).
+    """
+
+    def __init__(self, hub: dict[str, "InProcessBackplane"] | None = None):
+        super().__init__()
+        self.hub = hub if hub is not None else {}
+
+    async def register(self, name: str):
+        self.hub[name] = self
+
+    async def unregister(self, name: str):
+        if self.hub.get(name) is self:
+            del self.hub[name]
+
+    async def publish(self, receivers: list[str], frame: str) -> list[str]:
+        missing = []
+        by_worker: dict[InProcessBackplane, list[str]] = {}
+        for receiver in receivers:
+            worker = self.hub.get(receiver)
+            if worker is None or worker is self:
+                missing.append(receiver)
+            else:
+                by_worker.setdefault(worker, []).append(receiver)
+        for worker, worker_receivers in by_worker.items():
+            self.published += 1
+            worker._deliver(worker_receivers, frame)
+        return missing
+
+
+class RedisBackplane(Backplane):
+    """
+    Backplane of workers sharing a Redis server (or any server speaking its protocol).
+
+    The presence of every receiver is a key holding the id of its worker, which expires unless the worker
+    refreshes it, so that the receivers of a crashed worker are forgotten. Every worker subscribes to its
+    own channel, and a frame is published once per worker with the list of its receivers.
+
+    Args:
+        client (redis.asyncio.Redis | None, optional): The client, e.g. a fakeredis client in tests.
+            Defaults to None, to connect to `url`.
+        url (str, optional): The URL of the Redis server. Defaults to "redis://localhost:6379/0".
+        prefix (str, optional): The prefix of the keys and the channels. Defaults to "ioa".
+        presence_ttl (float, optional): Seconds after which the presence of a receiver expires
+            if its worker stops refreshing it. Defaults to 30.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        url: str = "redis://localhost:6379/0",
+        prefix: str = "ioa",
+        presence_ttl: float = 30,
+    ):
+        super().__init__()
+        if client is None:
+            if aioredis is None:
+                raise ModuleNotFoundError("The redis backplane requires the redis package.")
+            client = aioredis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.presence_ttl = presence_ttl
+        self.local_names: set[str] = set()
+        self.pubsub = None
+        self._tasks: list[asyncio.Task] = []
+
+    def _presence_key(self, name: str) -> str:
+        return f"{self.prefix}:presence:{name}"
+
+    def _channel(self, worker_id: str) -> str:
+        return f"{self.prefix}:worker:{worker_id}"
+
+    async def start(self, deliver: DeliverFunc):
+        await super().start(deliver)
+        self.pubsub = self.client.pubsub()
+        await self.pubsub.subscribe(self._channel(self.worker_id))
+        self._tasks = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._refresh_presence()),
+        ]
+        logger.info(f"Started the redis backplane of worker {self.worker_id}.")
+
+    async def _listen(self):
+        async for message in self.pubsub.listen():
+            if message["type"] != "message":
+                continue
+            try:
+                envelope = json.loads(message["data"])
+                self._deliver(envelope["receivers"], envelope["frame"])
+            except Exception as e:
+                logger.error(f"Failed to deliver the frame from the backplane. {e}")
+
+    async def _refresh_presence(self):
+        while True:
+            await asyncio.sleep(self.presence_ttl / 3)
+            if not self.local_names:
+                continue
+            try:
+                async with self.client.pipeline(transaction=False) as pipe:
+                    for name in list(self.local_names):
+                        pipe.set(self._presence_key(name), self.worker_id, px=int(self.presence_ttl * 1000))
+                    await pipe.execute()
+            except Exception as e:
+                logger.warn(f"Failed to refresh the presence of worker {self.worker_id}. {e}")
+
+    async def register(self, name: str):
+        self.local_names.add(name)
+        await self.client.set(self._presence_key(name), self.worker_id, px=int(self.presence_ttl * 1000))
+
+    async def unregister(self, name: str):
+        # Stop refreshing the presence even if deleting it fails, so that it expires after the ttl.
+        self.local_names.discard(name)
+        try:
+            # The receiver may have reconnected to another worker in the meantime.
+            if _decode(await self.client.get(self._presence_key(name))) == self.worker_id:
+                await self.client.delete(self._presence_key(name))
+        except Exception as e:
+            logger.warn(f"Failed to unregister {name} from worker {self.worker_id}. {e}")
+
+    async def publish(self, receivers: list[str], frame: str) -> list[str]:
+        if not receivers:
+            return []
+        workers = await self.client.mget([self._presence_key(receiver) for receiver in receivers])
+        missing = []
+        by_worker: dict[str, list[str]] = {}
+        for receiver, worker_id in zip(receivers, map(_decode, workers)):
+            if worker_id is None or worker_id == self.worker_id:
+                missing.append(receiver)
+            else:
+                by_worker.setdefault(worker_id, []).append(receiver)
+        for worker_id, worker_receivers in by_worker.items():
+            envelope = json.dumps({"receivers": worker_receivers, "frame": frame})
+            if await self.client.publish(self._channel(worker_id), envelope) == 0:
+                # The worker is gone, and its presence keys have not expired yet.
+                missing.extend(worker_receivers)
+            else:
+                self.published += 1
+        return missing
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self.local_names:
+            await self.client.delete(*[self._presence_key(name) for name in self.local_names])
+            self.local_names.clear()
+        if self.pubsub is not None:
+            await self.pubsub.unsubscribe()
+            await self.pubsub.aclose()
+        await self.client.aclose()
+
+
+def _decode(value: bytes | str | None) -> str | None:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def load_backplane(config: dict) -> Backplane:
+    """Build the backplane from the `backplane` section of the server config."""
+    match config.get("type", "in_process"):
+        case "in_process":
+            return InProcessBackplane()
+        case "redis":
+            return RedisBackplane(
+                url=config.get("redis_url", "redis://localhost:6379/0"),
+                prefix=config.get("prefix", "ioa"),
+                presence_ttl=config.get("presence_ttl", 30),
+            )
+        case backplane_type:
+            raise ValueError(f"Unknown backplane type: {backplane_type}")
@@ -68,6 +68,7 @@ function App() {
                 comm_id: message.comm_id,
                 agent_names: message.agent_names,
                 team_name: message.team_name || message.agent_names.join(", "),
+                goal: message.goal,
               },
               ...prevGroups,
             ]);
@@ -153,6 +154,7 @@ function App() {
                 ? `[${latestMessage.sender}]: ${latestMessage.content}`
                 : "",
               team_name: teamName,
+              goal: data[comm_id]["goal"],
             },
             ...newGroups,
           ];
@@ -166,6 +168,8 @@ function App() {
   }, []);
 
   let selectedMessages = messages[selectedGroup] || [];
+  // The messages carry only the version of the session header, so the goal comes with the group
+  let selectedGoal = groups.find((group) => group.comm_id === selectedGroup)?.goal;
 
   return (
     <div className="app-container">
@@ -173,6 +177,7 @@ function App() {
       <ChatWindow
         messages={selectedMessages}
         teamName={selectedGroup ? commID2Name[selectedGroup] : "Select a group"}
+        goal={selectedGoal}
       />
     </div>
   );
@@ -3,7 +3,7 @@ import Message from "../Message/Message"; // Assuming you have a Message compone
 import "./ChatWindow.css"; // Assuming you have a CSS file
 import ReactMarkdown from 'react-markdown';
 
-function ChatWindow({ messages, teamName }) {
+function ChatWindow({ messages, teamName, goal }) {
   const [displayMessages, setDisplayMessages] = useState([]);
   const [newMessageText, setNewMessageText] = useState("");
   const [shouldScroll, setShouldScroll] = useState(false);
@@ -57,7 +57,7 @@ function ChatWindow({ messages, teamName }) {
           <div className="chat-goal">
             <span className="chat-goal-title">Goal:</span>
             <ReactMarkdown className="chat-goal-content">
-              {displayMessages[0].goal}
+              {goal || displayMessages[0].goal}
             </ReactMarkdown>
           </div>
         )}
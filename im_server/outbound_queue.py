@@ -0,0 +1,170 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from typing import Callable, Literal
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from common.log import logger
+from common.utils.metrics import LatencyHistogram
+
+SlowConsumerPolicy = Literal["drop", "disconnect", "spill"]
+
+
+class OutboundChannel:
+    """
+    Outbound queue of a single websocket connection, drained by a dedicated writer task.
+
+    The router only enqueues frames and returns immediately, so a slow or stalled receiver
+    never delays the delivery to other receivers or the reading of the next incoming frame.
+    When the queue is full, the frame is handled according to `policy`:
+
+    * drop: discard the frame.
+    * disconnect: close the connection of the slow consumer.
+    * spill: append the frame to a file on disk, which the writer replays in order once the
+      in-memory queue has been drained.
+
+    Args:
+        name (str): The name of the receiver, used in logs and for the spill file.
+        websocket (WebSocket): The websocket to write to.
+        max_queue_size (int, optional): The size of the in-memory queue. Defaults to 1000.
+        policy (SlowConsumerPolicy, optional): The slow consumer policy. Defaults to "spill".
+        spill_dir (str, optional): The directory of the spill files. Defaults to "database/server/spill".
+        encoder (Callable[[str], str | bytes] | None, optional): Transcodes the frames right before they are
+            written, e.g. into the binary wire format negotiated by the receiver. It is stateful, so it only sees
+            the frames actually written, in order. Defaults to None.
+        on_close (Callable[[OutboundChannel], None] | None, optional): Called when the writer stops on an error,
+            so that the owner forgets the channel. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        websocket: WebSocket,
+        max_queue_size: int = 1000,
+        policy: SlowConsumerPolicy = "spill",
+        spill_dir: str = "database/server/spill",
+        encoder: Callable[[str], str | bytes] | None = None,
+        on_close: Callable[["OutboundChannel"], None] | None = None,
+    ):
+        if policy not in ["drop", "disconnect", "spill"]:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.name = name
+        self.websocket = websocket
+        self.policy = policy
+        self.encoder = encoder
+        self.on_close = on_close
+        self.queue: asyncio.Queue[tuple[float, str]] = asyncio.Queue(maxsize=max_queue_size)
+        self.latency = LatencyHistogram()
+        self.dropped = 0
+        self.closed = False
+
+        # Every connection spills to its own file, as names may collide (the frontend and an agent named "frontend").
+        spill_name = f'{re.sub(r"[^a-zA-Z0-9_]", "_", name)}-{uuid.uuid4().hex[:8]}.jsonl'
+        self._spill_path = os.path.join(spill_dir, spill_name)
+        self._spill_offset = 0
+        self._spilled = 0
+        if policy == "spill":
+            os.makedirs(spill_dir, exist_ok=True)
+            open(self._spill_path, "w").close()
+
+        self._writer = asyncio.get_event_loop().create_task(self._run())
+
+    def put(self, frame: str) -> bool:
+        """Enqueue a text frame without waiting. Returns whether the frame is accepted."""
+        if self.closed:
+            return False
+        item = (time.perf_counter(), frame)
+        # Once frames are spilled, new frames go to the spill file as well to preserve the order.
+        if self._spilled == 0:
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except asyncio.QueueFull:
+                pass
+        match self.policy:
+            case "drop":
+                self.dropped += 1
+                logger.warn(f"Outbound queue of {self.name} is full, dropping the message.")
+                return False
+            case "disconnect":
+                logger.warn(f"Outbound queue of {self.name} is full, disconnecting the slow consumer.")
+                asyncio.get_event_loop().create_task(self._disconnect())
+                return False
+            case "spill":
+                with open(self._spill_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(item) + "\n")
+                self._spilled += 1
+                return True
+
+    def _read_spilled(self, max_frames: int = 100) -> list[tuple[float, str]]:
+        items = []
+        with open(self._spill_path, "r+", encoding="utf-8") as f:
+            f.seek(self._spill_offset)
+            while len(items) < max_frames and (line := f.readline()):
+                items.append(tuple(json.loads(line)))
+            self._spill_offset = f.tell()
+            self._spilled -= len(items)
+            if self._spilled == 0:
+                f.truncate(0)
+                self._spill_offset = 0
+        return items
+
+    async def _run(self):
+        try:
+            while True:
+                if self.queue.empty() and self._spilled > 0:
+                    items = self._read_spilled()
+                else:
+                    items = [await self.queue.get()]
+                for enqueued_at, frame in items:
+                    if self.encoder is not None:
+                        frame = self.encoder(frame)
+                    if isinstance(frame, bytes):
+                        await self.websocket.send_bytes(frame)
+                    else:
+                        await self.websocket.send_text(frame)
+                    self.latency.observe(time.perf_counter() - enqueued_at)
+        except asyncio.CancelledError:
+            pass
+        except (WebSocketDisconnect, RuntimeError) as e:
+            logger.warn(f"Failed to write to the websocket of {self.name}. {e}")
+            self._stop()
+        except Exception as e:
+            # e.g. a frame the encoder cannot transcode, or a spill file that cannot be read.
+            logger.error(f"The writer of {self.name} failed. {e}")
+            self._stop()
+
+    def _stop(self):
+        """Stop accepting frames after the writer failed, and let the owner forget the channel."""
+        self.closed = True
+        self._remove_spill_file()
+        if self.on_close is not None:
+            self.on_close(self)
+
+    def _remove_spill_file(self):
+        if self.policy == "spill" and os.path.exists(self._spill_path):
+            os.remove(self._spill_path)
+
+    async def _disconnect(self):
+        await self.close()
+        try:
+            await self.websocket.close(code=1013)
+        except RuntimeError:
+            pass
+
+    async def close(self):
+        self.closed = True
+        self._writer.cancel()
+        self._remove_spill_file()
+
+    def stats(self) -> dict:
+        return {
+            "queue_size": self.queue.qsize(),
+            "spilled": self._spilled,
+            "dropped": self.dropped,
+            "latency": self.latency.summary(),
+        }
@@ -0,0 +1,87 @@
+"""
+Benchmark the HTML-to-markdown conversion of the ReAct browser tools against a corpus of saved pages.
+
+Save the pages as .html files in a directory (the first line may be an HTML comment with the URL of
+the page, e.g. `<!-- https://en.wikipedia.org/wiki/Python -->`) and run:
+
+    python scripts/benchmark_html_to_markdown.py --corpus path/to/pages --repeat 5
+"""
+
+import os
+import re
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.append("im_client/agents/tools")
+import markdownify
+from bs4 import BeautifulSoup
+from html_to_markdown import HTML_PARSER, html_to_markdown
+
+parser = ArgumentParser()
+parser.add_argument("--corpus", type=str, required=True, help="The directory of the saved .html pages")
+parser.add_argument("--repeat", type=int, default=3, help="The number of conversions of each page")
+args = parser.parse_args()
+
+
+def legacy_html_to_markdown(html_content: str, url: str = ""):
+    """The conversion previously done by SimpleTextBrowser._process_html_content."""
+    soup = BeautifulSoup(html_content, "html.parser")
+    for script in soup(["script", "style"]):
+        script.extract()
+    for img in soup.find_all("img"):
+        if "src" in img.attrs and img.attrs["src"].startswith("data:image"):
+            img.extract()
+    if url.startswith("https://en.wikipedia.org/"):
+        body_elm = soup.find("div", {"id": "mw-content-text"})
+        if body_elm:
+            markdownify.MarkdownConverter().convert_soup(body_elm)
+        else:
+            markdownify.MarkdownConverter().convert_soup(soup)
+    else:
+        markdownify.MarkdownConverter().convert_soup(soup)
+    webpage_text = markdownify.markdownify(str(soup), heading_style="ATX")
+    webpage_text = re.sub(r"\r\n", "\n", webpage_text)
+    webpage_text = re.sub(r"\n{2,}", "\n\n", webpage_text).strip()
+    return soup.title.string if soup.title else None, webpage_text
+
+
+def load_corpus(directory: str) -> list[tuple[str, str, str]]:
+    pages = []
+    for file in sorted(os.listdir(directory)):
+        if not file.endswith((".html", ".htm")):
+            continue
+        with open(os.path.join(directory, file), "r", encoding="utf-8", errors="replace") as f:
+            html_content = f.read()
+        m = re.match(r"\s*<!--\s*(https?://\S+)\s*-->", html_content)
+        pages.append((file, m.group(1) if m else "", html_content))
+    return pages
+
+
+def benchmark(convert, html_content: str, url: str) -> tuple[float, int]:
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        _, text = convert(html_content, url)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, len(text)
+
+
+pages = load_corpus(args.corpus)
+if not pages:
+    sys.exit(f"No .html pages found in {args.corpus}")
+
+print(f"Parser: {HTML_PARSER}, pages: {len(pages)}, repeat: {args.repeat}")
+print(f"{'page':40s} {'KB':>8s} {'legacy ms':>10s} {'new ms':>10s} {'speedup':>8s} {'legacy chars':>13s} {'new chars':>10s}")
+total_legacy, total_new = 0.0, 0.0
+for file, url, html_content in pages:
+    legacy_ms, legacy_chars = benchmark(legacy_html_to_markdown, html_content, url)
+    new_ms, new_chars = benchmark(html_to_markdown, html_content, url)
+    total_legacy += legacy_ms
+    total_new += new_ms
+    print(
+        f"{file[:40]:40s} {len(html_content) / 1024:8.1f} {legacy_ms:10.1f} {new_ms:10.1f} "
+        f"{legacy_ms / new_ms:7.1f}x {legacy_chars:13d} {new_chars:10d}"
+    )
+print(f"{'total':40s} {'':8s} {total_legacy:10.1f} {total_new:10.1f} {total_legacy / total_new:7.1f}x")
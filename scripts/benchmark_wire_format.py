@@ -0,0 +1,99 @@
+"""
+Benchmark the size and the parse time of AgentMessage in the JSON and msgpack wire formats, on a synthetic
+session where every message carries the goal and the team members, as the communication layer sends them.
+The deflate columns emulate the permessage-deflate extension, which compresses the frames of a connection
+with a shared context.
+
+    python scripts/benchmark_wire_format.py --team-size 8 --messages 200
+"""
+
+import random
+import statistics
+import string
+import sys
+import time
+import zlib
+from argparse import ArgumentParser
+
+sys.path.append(".")
+from common.types import AGENT_MESSAGE_DEFAULTS, AgentMessage
+from common.types.communication import CommunicationState, CommunicationType
+from common.utils.wire_format import WireDecoder, WireEncoder
+
+parser = ArgumentParser()
+parser.add_argument("--team-size", type=int, default=8, help="The number of the members of the session")
+parser.add_argument("--messages", type=int, default=200, help="The number of the messages of the session")
+parser.add_argument("--content-length", type=int, default=400, help="The length of the content of each message")
+parser.add_argument("--repeat", type=int, default=5, help="The number of the runs of the parse benchmark")
+args = parser.parse_args()
+
+random.seed(0)
+
+
+def words(n: int) -> str:
+    return " ".join("".join(random.choices(string.ascii_lowercase, k=random.randint(3, 9))) for _ in range(n))
+
+
+team_members = [
+    {"name": f"Agent {i}", "type": "Thing Assistant", "desc": words(60)} for i in range(args.team_size)
+]
+goal = words(80)
+messages = [
+    AgentMessage(
+        content=words(args.content_length // 6),
+        sender=team_members[i % args.team_size]["name"],
+        comm_id="c" * 32,
+        next_speaker=[team_members[(i + 1) % args.team_size]["name"]],
+        state=CommunicationState.DISCUSSION,
+        type=CommunicationType.DISCUSSION,
+        goal=goal,
+        team_members=team_members,
+        team_up_depth=1,
+        updated_plan=words(30) if i % 10 == 0 else "",
+    )
+    for i in range(args.messages)
+]
+
+
+def deflated_size(frames: list[bytes]) -> int:
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return sum(len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) for frame in frames)
+
+
+def median_time(func) -> float:
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+json_frames = [message.model_dump_json().encode() for message in messages]
+encoder = WireEncoder(AGENT_MESSAGE_DEFAULTS)
+msgpack_frames = [encoder.encode(message.model_dump(mode="json")) for message in messages]
+
+
+def parse_json():
+    for frame in json_frames:
+        AgentMessage.model_validate_json(frame)
+
+
+def parse_msgpack():
+    # The decoder is stateful, so every run decodes the session from the start.
+    decoder = WireDecoder(AGENT_MESSAGE_DEFAULTS)
+    for frame in msgpack_frames:
+        AgentMessage.model_validate(decoder.decode(frame))
+
+
+decoder = WireDecoder(AGENT_MESSAGE_DEFAULTS)
+assert all(AgentMessage.model_validate(decoder.decode(frame)) == message for frame, message in zip(msgpack_frames, messages))
+
+n = len(messages)
+print(f"team size: {args.team_size}, messages: {n}, content length: {args.content_length}")
+print(f"{'format':10s} {'bytes/msg':>10s} {'deflate bytes/msg':>18s} {'parse us/msg':>13s}")
+for name, frames, parse in [("json", json_frames, parse_json), ("msgpack", msgpack_frames, parse_msgpack)]:
+    print(
+        f"{name:10s} {sum(map(len, frames)) / n:10.0f} {deflated_size(frames) / n:18.0f} "
+        f"{median_time(parse) / n * 1e6:13.1f}"
+    )
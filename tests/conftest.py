@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The server imports its sibling modules at top level, as when it runs from im_server/.
+for path in (ROOT, os.path.join(ROOT, "im_server")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
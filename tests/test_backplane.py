@@ -0,0 +1,187 @@
+import asyncio
+
+import pytest
+
+from backplane import InProcessBackplane, RedisBackplane
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class Inbox:
+    """Collects the frames delivered by a backplane, like the connections of a worker."""
+
+    def __init__(self):
+        self.frames: list[tuple[str, str]] = []
+        self.received = asyncio.Event()
+
+    def deliver(self, receiver: str, frame: str):
+        self.frames.append((receiver, frame))
+        self.received.set()
+
+
+async def start_redis_workers(count: int, presence_ttl: float = 30) -> tuple[list[RedisBackplane], list[Inbox]]:
+    server = fakeredis.FakeServer()
+    workers = [
+        RedisBackplane(client=fakeredis.aioredis.FakeRedis(server=server), presence_ttl=presence_ttl)
+        for _ in range(count)
+    ]
+    inboxes = [Inbox() for _ in range(count)]
+    for worker, inbox in zip(workers, inboxes):
+        await worker.start(inbox.deliver)
+    return workers, inboxes
+
+
+def test_in_process_cross_worker_delivery():
+    async def main():
+        hub = {}
+        first, second = InProcessBackplane(hub), InProcessBackplane(hub)
+        first_inbox, second_inbox = Inbox(), Inbox()
+        await first.start(first_inbox.deliver)
+        await second.start(second_inbox.deliver)
+        await first.register("alice")
+        await second.register("bob")
+
+        missing = await first.publish(["alice", "bob", "carol"], "frame")
+
+        # alice is local to the publisher and carol is connected nowhere.
+        assert missing == ["alice", "carol"]
+        assert second_inbox.frames == [("bob", "frame")]
+        assert first_inbox.frames == []
+        assert first.stats()["published"] == 1
+        assert second.stats()["received"] == 1
+
+    asyncio.run(main())
+
+
+def test_in_process_unregister():
+    async def main():
+        hub = {}
+        first, second = InProcessBackplane(hub), InProcessBackplane(hub)
+        await second.start(Inbox().deliver)
+        await second.register("bob")
+        await second.unregister("bob")
+
+        assert await first.publish(["bob"], "frame") == ["bob"]
+
+    asyncio.run(main())
+
+
+def test_in_process_unregister_keeps_reconnected_receiver():
+    async def main():
+        hub = {}
+        first, second = InProcessBackplane(hub), InProcessBackplane(hub)
+        await first.register("bob")
+        await second.register("bob")
+        await first.unregister("bob")
+
+        assert hub["bob"] is second
+
+    asyncio.run(main())
+
+
+def test_redis_cross_worker_delivery():
+    async def main():
+        (first, second), (first_inbox, second_inbox) = await start_redis_workers(2)
+        try:
+            await first.register("alice")
+            await second.register("bob")
+
+            missing = await first.publish(["alice", "bob", "carol"], "frame")
+            await asyncio.wait_for(second_inbox.received.wait(), 5)
+
+            assert missing == ["alice", "carol"]
+            assert second_inbox.frames == [("bob", "frame")]
+            assert first_inbox.frames == []
+            assert first.stats()["published"] == 1
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(main())
+
+
+def test_redis_presence_ttl_refresh():
+    async def main():
+        (first, second), _ = await start_redis_workers(2, presence_ttl=0.3)
+        try:
+            await second.register("bob")
+            # Outlive several ttls: the refresh task keeps the presence alive.
+            await asyncio.sleep(1)
+            assert await first.client.get(second._presence_key("bob")) == second.worker_id.encode()
+            assert await first.publish(["bob"], "frame") == []
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(main())
+
+
+def test_redis_presence_expires_without_refresh():
+    async def main():
+        (first, second), _ = await start_redis_workers(2, presence_ttl=0.3)
+        try:
+            await second.register("bob")
+            # Simulate a crashed worker, which stops refreshing the presence of its receivers.
+            for task in second._tasks:
+                task.cancel()
+            await asyncio.sleep(0.6)
+            assert await first.publish(["bob"], "frame") == ["bob"]
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(main())
+
+
+def test_redis_unregister():
+    async def main():
+        (first, second), _ = await start_redis_workers(2)
+        try:
+            await second.register("bob")
+            await second.unregister("bob")
+
+            assert "bob" not in second.local_names
+            assert await first.client.get(second._presence_key("bob")) is None
+            assert await first.publish(["bob"], "frame") == ["bob"]
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(main())
+
+
+def test_redis_unregister_keeps_reconnected_receiver():
+    async def main():
+        (first, second), _ = await start_redis_workers(2)
+        try:
+            await first.register("bob")
+            await second.register("bob")
+            await first.unregister("bob")
+
+            assert await first.client.get(first._presence_key("bob")) == second.worker_id.encode()
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(main())
+
+
+def test_redis_failed_unregister_stops_refresh():
+    async def main():
+        (worker,), _ = await start_redis_workers(1)
+        try:
+            await worker.register("bob")
+
+            async def fail(*args, **kwargs):
+                raise ConnectionError("redis is down")
+
+            get = worker.client.get
+            worker.client.get = fail
+            await worker.unregister("bob")
+            worker.client.get = get
+
+            assert "bob" not in worker.local_names
+        finally:
+            await worker.close()
+
+    asyncio.run(main())